@@ -1,111 +1,488 @@
-from typing import Dict, Any, Optional
-from app.services.rag_service import SchemaRetriever
-from app.services.sql_generation_service import generate_sql
-from app.services.safety_service import validate_sql
-from app.services.response_service import generate_natural_response
-from app.models.query.query_executor import execute_query
-from app.models.schema.schema_manager import fetch_schema
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from app.config.settings import settings
+from app.services.schema_registry import schema_registry
+from app.services.sql_cache import normalize_question, sql_cache
+from app.services.sql_generation_service import build_sql_prompt, generate_sql
+from app.services.safety_service import validate_query
+from app.services.llm_client import LLMTimeoutError
+from app.services.response_service import generate_natural_response, stream_natural_response
+from app.models.query.query_executor import cached_result, execute_query, fetch_page, stream_columns
+from app.models.query.query_planner import QueryTooExpensive, query_planner
+from app.models.query.result_cache import MISS
+from app.models.rollup.store import rollup_store
 from app.utils.time_utils import get_time_context
+from app.utils.admission import Overloaded, admit_request
+from app.utils.concurrency import run_blocking
+from app.utils.cursor_tokens import decode_cursor, encode_cursor
 from app.utils.logger import app_logger
+from app.utils.metrics import StageTimer, record_outcome
+from app.utils.single_flight import SingleFlight
 from app.utils.validators import validate_query_input
 
 
+# Answer text used when the natural-language step is shed under load or times out
+BUSY_RESPONSE = "The service is busy, so this answer has no summary; the query result is included as is."
+
+
+class BatchContext:
+    """
+    Work shared by all questions of one batch: a single schema snapshot, and
+    one execution per distinct canonical SQL under a bounded DB concurrency
+    """
+    def __init__(self, snapshot, db_concurrency: int):
+        self.snapshot = snapshot
+        self._db_semaphore = asyncio.Semaphore(db_concurrency)
+        self._executions: Dict[str, asyncio.Task] = {}
+
+    async def _execute(self, validated, slow: bool):
+        async with self._db_semaphore:
+            return await execute_query(validated, limit=settings.QUERY_ROW_LIMIT, slow=slow)
+
+    async def execute(self, validated, slow: bool = False):
+        key = validated.canonical_sql
+        task = self._executions.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._execute(validated, slow))
+            self._executions[key] = task
+        # shield() so one cancelled waiter doesn't cancel the shared execution
+        return await asyncio.shield(task)
+
+    def cancel(self):
+        for task in self._executions.values():
+            task.cancel()
+
+
 class QueryController:
     def __init__(self):
         app_logger.info("Initializing QueryController")
-        # We'll fetch schema dynamically for each query to ensure it's current
-        self.retriever = None
-        app_logger.info("Query controller initialized. Schema will be fetched dynamically for each query.")
+        # Schema and retriever come from the process-wide registry, which refreshes them on drift
+        self.schema_registry = schema_registry
+        self._query_flight = SingleFlight("process_query")
+        app_logger.info("Query controller initialized. Schema is served from the shared schema registry.")
+
+    async def process_query(self, user_query: str, batch: Optional[BatchContext] = None) -> Dict[str, Any]:
+        """
+        Process a natural language query and return the results. Concurrent
+        requests for the same question (after normalisation), schema version
+        and date share one computation, which waits for a request slot at the
+        admission gate; Overloaded is raised when the service is saturated.
+        """
+        if batch is not None or not isinstance(user_query, str):
+            # Batch items are admitted with their batch and deduplicated by it
+            return await self._process_query(user_query, batch)
+        try:
+            snapshot = await self.schema_registry.get_snapshot_async()
+        except Exception:
+            # Let the pipeline report the schema error
+            return await self._admitted(user_query)
+        key = (normalize_question(user_query), snapshot.version, get_time_context())
+        response = await self._query_flight.do(key, lambda: self._admitted(user_query))
+        # Each caller gets its own top-level dicts; result rows are shared read-only
+        response = dict(response)
+        if "meta" in response:
+            response["meta"] = dict(response["meta"])
+        return response
+
+    async def _admitted(self, user_query: str) -> Dict[str, Any]:
+        async with admit_request():
+            return await self._process_query(user_query)
+
+    async def _process_query(self, user_query: str, batch: Optional[BatchContext] = None) -> Dict[str, Any]:
+        timer = StageTimer()
+        try:
+            sql, db_result, next_cursor, meta, notice = None, None, None, {}, None
+            async for event, payload in self._run_stages(user_query, batch, timer):
+                if event == "response":
+                    return self._with_timings(payload, timer)
+                if event == "sql":
+                    sql = payload["sql"]
+                    if payload.get("prompt_tokens"):
+                        meta["prompt_tokens"] = payload["prompt_tokens"]
+                    if payload.get("plan"):
+                        meta["plan"] = payload["plan"]
+                    if payload.get("rollup"):
+                        meta["rollup"] = payload["rollup"]
+                    notice = payload.get("notice")
+                elif event == "result":
+                    db_result, next_cursor = payload["result"], payload["next_cursor"]
+                
+            # 11. Generate Response
+            try:
+                with timer.stage("response"):
+                    natural_response = await generate_natural_response(user_query, sql, db_result)
+                record_outcome("answered")
+            except (Overloaded, LLMTimeoutError) as e:
+                # The data is already in hand: return it without the prose rather than failing the request
+                app_logger.warning("Skipping natural response under load: %s", e)
+                natural_response = BUSY_RESPONSE
+                record_outcome("degraded")
+            if notice:
+                # The planner narrowed the question; say so rather than leave it to the metadata
+                natural_response = f"{notice}\n\n{natural_response}"
+            
+            return self._with_timings(self._final_response(sql, db_result, natural_response, next_cursor, meta), timer)
+            
+        except Overloaded as e:
+            record_outcome("shed")
+            app_logger.warning("Query shed under load: %s", e)
+            raise
+        except Exception as e:
+            record_outcome("error")
+            app_logger.error("Error processing query: %s", e)
+            raise
+
+    async def process_batch(self, user_queries: List[str]) -> List[Dict[str, Any]]:
+        """
+        Process many questions against one schema snapshot. Identical questions
+        (after normalisation) run once and identical SQL executes once; at most
+        BATCH_CONCURRENCY questions are in flight. Results come back in input
+        order, and a failing question (including one shed by the admission
+        gates) yields an item with an "error" field instead of failing the batch.
+        Each question is admitted on its own, with its own request deadline;
+        Overloaded is raised only when every question was shed.
+        """
+        app_logger.info("Processing batch of %s queries", len(user_queries))
+        try:
+            snapshot = await self.schema_registry.get_snapshot_async()
+        except Exception as schema_error:
+            # Let each item report the schema error through the normal path
+            app_logger.error("Error fetching schema for batch: %s", schema_error)
+            snapshot = None
+        batch = BatchContext(snapshot, settings.BATCH_DB_CONCURRENCY)
+        semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+        shed: List[Overloaded] = []
+
+        async def run_one(user_query: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    # Each question holds a request slot only while it runs, so a large batch can't outlive one deadline
+                    async with admit_request():
+                        return await self.process_query(user_query, batch)
+                except Overloaded as e:
+                    shed.append(e)
+                    return {"sql": None, "result": None, "natural_response": None, "error": str(e)}
+                except Exception as e:
+                    return {"sql": None, "result": None, "natural_response": None, "error": str(e)}
+
+        unique: Dict[str, asyncio.Task] = {}
+        tasks = []
+        for user_query in user_queries:
+            key = normalize_question(user_query) if isinstance(user_query, str) else repr(user_query)
+            if key not in unique:
+                unique[key] = asyncio.ensure_future(run_one(user_query))
+            tasks.append(unique[key])
+
+        try:
+            await asyncio.gather(*unique.values())
+        except asyncio.CancelledError:
+            # Shared executions are shielded from individual waiters; stop them with the batch
+            batch.cancel()
+            raise
+        if unique and len(shed) == len(unique):
+            raise shed[0]
+        app_logger.info("Batch completed: %s queries, %s distinct", len(user_queries), len(unique))
+        return [dict(task.result()) for task in tasks]
+
+    async def stream_query(self, user_query: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Process a natural language query, yielding (event, payload) pairs as each
+        stage finishes, then the answer token by token and a final "done" event
+        carrying the same payload process_query would return
+        """
+        async with admit_request():
+            async for event, payload in self._stream_query(user_query):
+                yield event, payload
+
+    async def _stream_query(self, user_query: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        timer = StageTimer()
+        try:
+            sql, db_result, next_cursor, meta, notice = None, None, None, {}, None
+            async for event, payload in self._run_stages(user_query, timer=timer):
+                if event == "response":
+                    yield "done", self._with_timings(payload, timer)
+                    return
+                yield event, payload
+                if event == "sql":
+                    sql = payload["sql"]
+                    if payload.get("prompt_tokens"):
+                        meta["prompt_tokens"] = payload["prompt_tokens"]
+                    if payload.get("plan"):
+                        meta["plan"] = payload["plan"]
+                    if payload.get("rollup"):
+                        meta["rollup"] = payload["rollup"]
+                    notice = payload.get("notice")
+                elif event == "result":
+                    db_result, next_cursor = payload["result"], payload["next_cursor"]
+            
+            parts = []
+            if notice:
+                # The planner narrowed the question; say so rather than leave it to the metadata
+                parts.append(f"{notice}\n\n")
+                yield "answer_token", {"text": parts[0]}
+            started = time.perf_counter()
+            try:
+                async for token in stream_natural_response(user_query, sql, db_result):
+                    parts.append(token)
+                    yield "answer_token", {"text": token}
+                app_logger.info("Natural response streamed successfully")
+                record_outcome("answered")
+            except (Overloaded, LLMTimeoutError) as e:
+                # Raised before any text was sent: answer with the data alone
+                app_logger.warning("Skipping natural response under load: %s", e)
+                parts = parts[:1] if notice else []
+                parts.append(BUSY_RESPONSE)
+                yield "answer_token", {"text": BUSY_RESPONSE}
+                record_outcome("degraded")
+            # Includes time the client took to read the tokens
+            timer.record("response", time.perf_counter() - started)
+            
+            response = self._final_response(sql, db_result, "".join(parts).strip(), next_cursor, meta)
+            yield "done", self._with_timings(response, timer)
+            
+        except Overloaded as e:
+            record_outcome("shed")
+            app_logger.warning("Query shed under load: %s", e)
+            raise
+        except Exception as e:
+            record_outcome("error")
+            app_logger.error("Error streaming query: %s", e)
+            raise
 
-    async def process_query(self, user_query: str) -> Dict[str, Any]:
+    async def fetch_page(self, cursor: str) -> Dict[str, Any]:
+        """
+        Resume a truncated result from its cursor token. Raises ValueError for
+        tokens that are invalid or whose SQL no longer passes validation.
         """
-        Process a natural language query and return the results
+        payload = decode_cursor(cursor)
+        validated = await self._validate_cursor_sql(payload)
+        offset, page_size = int(payload["offset"]), int(payload["page_size"])
+        rows, has_more = await fetch_page(validated, offset, page_size)
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor({"sql": validated.canonical_sql, "offset": offset + len(rows), "page_size": page_size})
+        return {
+            "sql": validated.canonical_sql,
+            "result": rows,
+            "next_cursor": next_cursor
+        }
+
+    async def open_export(self, cursor: str):
         """
-        app_logger.info(f"Processing query: {user_query}")
+        Column-chunk stream of the full result of the query a cursor token
+        belongs to, from its first row. Raises ValueError like fetch_page(),
+        and Overloaded if no DB slot frees up in time.
+        """
+        validated = await self._validate_cursor_sql(decode_cursor(cursor))
+        chunks = stream_columns(validated, settings.EXPORT_CHUNK_SIZE, settings.EXPORT_MAX_ROWS, settings.EXPORT_TIMEOUT)
+        # Start the statement now, so a shed export is reported before the response begins
+        first = await chunks.__anext__()
+        return self._resumed(first, chunks)
+
+    @staticmethod
+    async def _resumed(first, chunks):
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _validate_cursor_sql(self, payload: Dict[str, Any]):
+        # Tokens are signed, but the safety rules may have tightened since one was issued
+        is_safe, message, validated = await run_blocking(validate_query, payload.get("sql", ""))
+        if not is_safe:
+            raise ValueError(f"Cursor query is no longer allowed: {message}")
+        return validated
+
+    @staticmethod
+    def _with_timings(response: Dict[str, Any], timer: StageTimer) -> Dict[str, Any]:
+        timer.finish()
+        breakdown = timer.breakdown_ms()
+        # One structured record per question carries the per-stage timings
+        app_logger.info("Query completed in %.1f ms", breakdown["total"], extra={"timings_ms": breakdown})
+        if settings.RESPONSE_TIMINGS_ENABLED:
+            response.setdefault("meta", {})["timings_ms"] = breakdown
+        return response
+
+    @staticmethod
+    def _final_response(sql, db_result, natural_response, next_cursor=None, meta=None) -> Dict[str, Any]:
+        response = {
+            "sql": sql,
+            "result": db_result,
+            "natural_response": natural_response
+        }
+        if next_cursor is not None:
+            response["next_cursor"] = next_cursor
+        if meta:
+            response["meta"] = meta
+        return response
+
+    async def _run_stages(self, user_query: str, batch: Optional[BatchContext] = None,
+                          timer: Optional[StageTimer] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Run every stage up to query execution, yielding (event, payload) as each
+        one completes: "schema", "sql", "execution" (row count) and "result".
+        Paths that end early (invalid input, clarification, safety block,
+        execution error) yield a single "response" event with the final answer.
+        """
+        app_logger.info("Processing query: %.200s", user_query)
+        timer = timer or StageTimer()
         
         # Validate input
         if not validate_query_input(user_query):
-            app_logger.warning(f"Invalid query input: {user_query}")
-            return {
+            app_logger.warning("Invalid query input: %s", user_query)
+            record_outcome("invalid_input")
+            yield "response", {
                 "sql": None,
                 "result": None,
                 "natural_response": "Invalid query input. Please provide a valid natural language question."
             }
+            return
         
+        # 1. Get the current schema snapshot (shared across a batch) and its fitted retriever
         try:
-            # 1. Fetch current schema and create retriever
-            try:
-                schema_snippets = fetch_schema()
-                retriever = SchemaRetriever(schema_snippets)
-                app_logger.info(f"Schema fetched with {len(schema_snippets)} tables for query processing")
-            except Exception as schema_error:
-                app_logger.error(f"Error fetching schema: {str(schema_error)}")
-                return {
-                    "sql": None,
-                    "result": None,
-                    "natural_response": f"Database connection error: Unable to fetch schema information. Please check database connectivity. Error: {str(schema_error)}"
-                }
-            
-            # 2. Retrieve relevant schema (RAG)
-            relevant_schema = retriever.retrieve(user_query, k=3)
-            app_logger.debug(f"Retrieved relevant schema: {relevant_schema[:100]}...")
-            
-            # 3. Get Time Context
-            time_context = get_time_context()
-            app_logger.debug("Time context retrieved")
+            snapshot = batch.snapshot if batch is not None and batch.snapshot is not None else None
+            if snapshot is None:
+                with timer.stage("schema"):
+                    snapshot = await self.schema_registry.get_snapshot_async()
+            retriever = snapshot.retriever
+            app_logger.debug("Using schema version %s with %s tables for query processing", snapshot.version, len(snapshot.snippets))
+        except Exception as schema_error:
+            app_logger.error("Error fetching schema: %s", schema_error)
+            record_outcome("schema_error")
+            yield "response", {
+                "sql": None,
+                "result": None,
+                "natural_response": f"Database connection error: Unable to fetch schema information. Please check database connectivity. Error: {str(schema_error)}"
+            }
+            return
+        yield "schema", {"version": snapshot.version, "tables": len(snapshot.snippets)}
+        
+        # 2. Get Time Context
+        time_context = get_time_context()
+        app_logger.debug("Time context retrieved")
+        
+        # 3. Look up previously generated SQL for this question, schema version and date window
+        sql = sql_cache.get(user_query, snapshot.fingerprint, time_context)
+        cached = sql is not None
+        prompt_tokens = None
+        if cached:
+            app_logger.info("SQL cache hit: %s...", sql[:100])
+        else:
+            # 4. Retrieve relevant schema (RAG), ranked per table, and generate SQL from the budgeted prompt
+            with timer.stage("retrieval"):
+                schema_sections = await run_blocking(retriever.retrieve_sections, user_query, k=3)
+                prompt = build_sql_prompt(user_query, schema_sections, time_context)
+            app_logger.debug("Retrieved schema for %s tables", len(schema_sections))
+            prompt_tokens = prompt.stats()
             
-            # 4. Generate SQL
-            sql = generate_sql(user_query, relevant_schema, time_context)
-            app_logger.info(f"Generated SQL: {sql[:100]}...")
+            with timer.stage("sql_generation"):
+                sql = await generate_sql(prompt)
+            sql_cache.put(user_query, snapshot.fingerprint, time_context, sql)
+            app_logger.info("Generated SQL: %s...", sql[:100])
+        
+        # 5. Handle non-SQL outputs
+        if sql == "__NEED_CLARIFICATION__":
+            app_logger.info("Query needs clarification")
+            record_outcome("clarification")
+            yield "response", {
+                "sql": None,
+                "result": None,
+                "natural_response": "I need more clarification to answer this question accurately."
+            }
+            return
+        if sql == "__NOT_DB__":
+            app_logger.info("Query is not related to database")
+            record_outcome("not_db")
+            yield "response", {
+                "sql": None,
+                "result": None,
+                "natural_response": "This question does not seem to be related to the available business data."
+            }
+            return
             
-            # 5. Handle non-SQL outputs
-            if sql == "__NEED_CLARIFICATION__":
-                app_logger.info("Query needs clarification")
-                return {
-                    "sql": None,
-                    "result": None,
-                    "natural_response": "I need more clarification to answer this question accurately."
-                }
-            if sql == "__NOT_DB__":
-                app_logger.info("Query is not related to database")
-                return {
-                    "sql": None,
-                    "result": None,
-                    "natural_response": "This question does not seem to be related to the available business data."
-                }
-                
-            # 6. SQL Safety Guard
-            is_safe, message = validate_sql(sql)
-            if not is_safe:
-                app_logger.warning(f"SQL validation failed: {message}")
-                return {
-                    "sql": None,
+        # 6. SQL Safety Guard
+        with timer.stage("validation"):
+            is_safe, message, validated = await run_blocking(validate_query, sql)
+        if not is_safe:
+            app_logger.warning("SQL validation failed: %s", message)
+            record_outcome("safety_block")
+            yield "response", {
+                "sql": None,
+                "result": None,
+                "natural_response": f"Safety Block: {message}. Query attempt: {sql}"
+            }
+            return
+        
+        # 7. Result cache: a result already in hand needs no rollup lookup or plan
+        with timer.stage("result_cache"):
+            db_result, rollup = await cached_result(validated, settings.QUERY_ROW_LIMIT), None
+        if db_result is not MISS:
+            app_logger.info("Query result served from cache")
+
+        # 8. Rollups: aggregates a pre-aggregated rollup can answer don't reach MySQL at all
+        if settings.ROLLUP_ENABLED and db_result is MISS:
+            with timer.stage("rollup"):
+                rewritten = await run_blocking(rollup_store.rewrite, validated)
+                if rewritten is not None:
+                    db_result = await rollup_store.execute(rewritten, settings.QUERY_ROW_LIMIT, validated.canonical_sql)
+            if db_result is not MISS:
+                rollup = rewritten.rollup.name
+
+        # 9. Cost guard: EXPLAIN the query, then reject it, rewrite it or send it to the slow queue
+        slow, plan, notice = False, None, None
+        if settings.PLANNER_ENABLED and db_result is MISS:
+            try:
+                with timer.stage("planning"):
+                    planned = await query_planner.plan(validated, settings.QUERY_ROW_LIMIT)
+            except QueryTooExpensive as e:
+                record_outcome("cost_block")
+                yield "response", {
+                    "sql": sql,
                     "result": None,
-                    "natural_response": f"Safety Block: {message}. Query attempt: {sql}"
+                    "natural_response": f"Cost Block: {e}",
+                    "meta": {"plan": {**e.plan.to_dict(), "decision": "rejected"}}
                 }
-                
-            # 7. Execute SQL
+                return
+            if planned.rewrite:
+                validated, sql = planned.query, planned.query.canonical_sql
+            slow, plan, notice = planned.slow, planned.meta(), planned.notice
+        yield "sql", {
+            "sql": sql, "cached": cached, "prompt_tokens": prompt_tokens, "plan": plan, "rollup": rollup, "notice": notice
+        }
+            
+        # 10. Execute SQL
+        if db_result is MISS:
             try:
-                db_result = execute_query(sql)
-                app_logger.info("SQL query executed successfully")
+                with timer.stage("execution"):
+                    if batch is not None:
+                        db_result = await batch.execute(validated, slow)
+                    else:
+                        db_result = await execute_query(validated, limit=settings.QUERY_ROW_LIMIT, slow=slow)
+            except Overloaded:
+                # Shed rather than reported as a failed query, so the client knows to retry
+                raise
             except Exception as e:
-                app_logger.error(f"SQL execution error: {str(e)}")
-                return {
+                app_logger.error("SQL execution error: %s", e)
+                record_outcome("execution_error")
+                yield "response", {
                     "sql": sql,
                     "result": None,
                     "natural_response": f"Execution Error: {str(e)}"
                 }
-                
-            # 8. Generate Response
-            natural_response = generate_natural_response(user_query, sql, db_result)
-            app_logger.info("Natural response generated successfully")
-            
-            return {
-                "sql": sql,
-                "result": db_result,
-                "natural_response": natural_response
-            }
-            
-        except Exception as e:
-            app_logger.error(f"Error processing query: {str(e)}")
-            raise
\ No newline at end of file
+                return
+        
+        row_count = len(db_result) if isinstance(db_result, list) else (0 if db_result is None else 1)
+        
+        # A full page may have more rows behind it: hand out a cursor to continue from
+        next_cursor = None
+        if isinstance(db_result, list) and row_count >= settings.QUERY_ROW_LIMIT:
+            next_cursor = encode_cursor({
+                "sql": validated.canonical_sql,
+                "offset": row_count,
+                "page_size": settings.QUERY_ROW_LIMIT
+            })
+        yield "execution", {"row_count": row_count}
+        yield "result", {"result": db_result, "next_cursor": next_cursor}
@@ -1,19 +1,185 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import math
+from typing import Any, Awaitable, List
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from app.api.controllers.query_controller import QueryController
+from app.config.settings import settings
+from app.services.llm_client import LLMTimeoutError
+from app.utils.admission import Overloaded
+from app.utils.logger import app_logger
+from app.utils.metrics import METRICS_CONTENT_TYPE, render_metrics
+from app.utils.warmup import warmup
+from app.views.export_view import EXPORT_ENCODERS, EXPORT_MEDIA_TYPES
+from app.views.stream_view import format_sse_event
 
 router = APIRouter()
 
-# Initialize the controller
-query_controller = QueryController()
+_query_controller = None
+
+def get_query_controller():
+    """
+    The controller, built on first use: importing it loads the whole query
+    pipeline, which the startup warm-up does off the event loop
+    """
+    global _query_controller
+    if _query_controller is None:
+        from app.api.controllers.query_controller import QueryController
+        _query_controller = QueryController()
+    return _query_controller
+
+async def run_until_disconnected(http_request: Request, work: Awaitable[Any]) -> Any:
+    """
+    Await `work`, cancelling it if the client disconnects first; cancellation
+    reaches the executor, which kills the running statement
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                app_logger.warning("Client disconnected, cancelling query processing")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def overload_error(e: Overloaded) -> HTTPException:
+    """
+    429/503 with Retry-After for work shed by admission control
+    """
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+    )
 
 class QueryRequest(BaseModel):
     query: str
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+
+class PageRequest(BaseModel):
+    cursor: str
+
+class ExportRequest(BaseModel):
+    cursor: str
+    format: str = "ndjson"
+
 @router.post("/ask")
-async def ask(request: QueryRequest):
+async def ask(request: QueryRequest, http_request: Request):
     try:
-        result = await query_controller.process_query(request.query)
+        result = await run_until_disconnected(http_request, get_query_controller().process_query(request.query))
         return result
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overload_error(e)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ask/batch")
+async def ask_batch(request: BatchQueryRequest, http_request: Request):
+    if len(request.queries) > settings.BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch may contain at most {settings.BATCH_MAX_SIZE} queries"
+        )
+    try:
+        results = await run_until_disconnected(http_request, get_query_controller().process_batch(request.queries))
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overload_error(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ask/stream")
+async def ask_stream(request: QueryRequest):
+    events = get_query_controller().stream_query(request.query)
+    # Admission happens before the first event, so a shed request still gets a plain 429/503
+    try:
+        first = await events.__anext__()
+    except Overloaded as e:
+        raise overload_error(e)
+
+    async def event_source():
+        try:
+            yield format_sse_event(*first)
+            async for event, payload in events:
+                yield format_sse_event(event, payload)
+        except Overloaded as e:
+            app_logger.warning("/ask/stream shed under load: %s", e)
+            yield format_sse_event("error", {"detail": str(e), "retry_after": math.ceil(e.retry_after)})
+        except Exception as e:
+            # Headers are already sent, so failures are reported in-band
+            app_logger.error("Error in /ask/stream: %s", e)
+            yield format_sse_event("error", {"detail": str(e)})
+        finally:
+            # Releases the request slot even if the client went away mid-stream
+            await events.aclose()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/ask/page")
+async def ask_page(request: PageRequest, http_request: Request):
+    try:
+        return await run_until_disconnected(http_request, get_query_controller().fetch_page(request.cursor))
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overload_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/export")
+async def export(request: ExportRequest):
+    if request.format not in EXPORT_ENCODERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format '{request.format}'. Use one of: {', '.join(EXPORT_ENCODERS)}"
+        )
+    if request.format == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Arrow export requires the pyarrow package")
+    try:
+        chunks = await get_query_controller().open_export(request.cursor)
+    except Overloaded as e:
+        raise overload_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        EXPORT_ENCODERS[request.format](chunks),
+        media_type=EXPORT_MEDIA_TYPES[request.format],
+        headers={"Content-Disposition": f"attachment; filename=export.{request.format}"}
+    )
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness: answered on the event loop, so a blocked loop fails it
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@router.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +12,220 @@ class Settings:
     DB_NAME: str = os.getenv("DB_NAME", "your_db_name")
     DB_PORT: int = int(os.getenv("DB_PORT", "3306"))
     GROQ_API_KEY: str = os.getenv("GROQ_API_KEY")
+
+    # LLM client: backend ("groq" or "fake" for offline runs), model, sampling and HTTP behaviour
+    LLM_BACKEND: str = os.getenv("LLM_BACKEND", "groq")
+    LLM_MODEL: str = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+    LLM_SQL_TEMPERATURE: float = float(os.getenv("LLM_SQL_TEMPERATURE", "0"))
+    LLM_RESPONSE_TEMPERATURE: float = float(os.getenv("LLM_RESPONSE_TEMPERATURE", "0.3"))
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+    LLM_READ_TIMEOUT: float = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+    # Per-call LLM deadlines (seconds, retries and hedges included; 0 disables). Streams apply them to the first chunk.
+    LLM_SQL_TIMEOUT: float = float(os.getenv("LLM_SQL_TIMEOUT", "20"))
+    LLM_RESPONSE_TIMEOUT: float = float(os.getenv("LLM_RESPONSE_TIMEOUT", "15"))
+    # Hedging: resend a completion still pending after this percentile of recent latencies for the
+    # same kind of call (never sooner than the minimum delay), once enough samples are in the window
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+    LLM_HEDGE_MIN_DELAY: float = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+    LLM_HEDGE_WINDOW: int = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+    # Smaller, faster model that writes the answer when the main model times out or is unavailable
+    # (empty disables), and its deadline
+    LLM_RESPONSE_FALLBACK_MODEL: str = os.getenv("LLM_RESPONSE_FALLBACK_MODEL", "")
+    LLM_RESPONSE_FALLBACK_TIMEOUT: float = float(os.getenv("LLM_RESPONSE_FALLBACK_TIMEOUT", "8"))
+
+    # Generated-SQL cache: capacity, TTLs (seconds) for SQL and for clarification/not-db outcomes,
+    # and whether a question differing only in filler words ("show me", "the", ...) counts as a hit
+    SQL_CACHE_MAX_ENTRIES: int = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1024"))
+    SQL_CACHE_TTL: int = int(os.getenv("SQL_CACHE_TTL", "3600"))
+    SQL_CACHE_NEGATIVE_TTL: int = int(os.getenv("SQL_CACHE_NEGATIVE_TTL", "600"))
+    SQL_CACHE_NEAR_MATCH: bool = os.getenv("SQL_CACHE_NEAR_MATCH", "false").lower() == "true"
+
+    # Query result cache: default TTL (seconds), per-table TTLs (an entry lives for the shortest TTL
+    # of the tables it reads), approximate memory budget, and how often a background task probes table
+    # UPDATE_TIMEs to drop results of tables written to since (0 disables the probe)
+    RESULT_CACHE_TTL: int = int(os.getenv("RESULT_CACHE_TTL", "60"))
+    RESULT_CACHE_TABLE_TTLS: Dict[str, int] = {
+        "data_so_summary": 60,
+        "data_so_details": 60,
+        "data_company_info": 600,
+        "data_prod_variant": 600
+    }
+    RESULT_CACHE_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESULT_CACHE_PROBE_INTERVAL: int = int(os.getenv("RESULT_CACHE_PROBE_INTERVAL", "10"))
+
+    # /ask/batch: maximum questions per request, questions in flight, and concurrent DB executions per batch
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "200"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    BATCH_DB_CONCURRENCY: int = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+
+    # Number of recent SQL texts whose validation verdict is remembered
+    SQL_VALIDATION_CACHE_SIZE: int = int(os.getenv("SQL_VALIDATION_CACHE_SIZE", "512"))
+
+    # Server-side execution timeouts (seconds) per query class, plus the extra time the client waits
+    # before killing a statement the server did not stop itself
+    QUERY_TIMEOUTS: Dict[str, float] = {
+        "lookup": float(os.getenv("QUERY_TIMEOUT_LOOKUP", "10")),
+        "aggregate": float(os.getenv("QUERY_TIMEOUT_AGGREGATE", "20")),
+        "heavy": float(os.getenv("QUERY_TIMEOUT_HEAVY", "45"))
+    }
+    QUERY_TIMEOUT_GRACE: float = float(os.getenv("QUERY_TIMEOUT_GRACE", "2"))
+    # How often (seconds) /ask checks whether the client is still connected
+    DISCONNECT_POLL_INTERVAL: float = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+    # Rows returned by /ask (and per /ask/page page)
+    QUERY_ROW_LIMIT: int = int(os.getenv("QUERY_ROW_LIMIT", "100"))
+
+    # Result paging and export: secret signing cursor tokens (must be shared by all workers),
+    # rows per server-side fetch, row cap and execution timeout (seconds) for exports
+    CURSOR_SECRET: str = os.getenv("CURSOR_SECRET", "")
+    EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+    EXPORT_MAX_ROWS: int = int(os.getenv("EXPORT_MAX_ROWS", "10000000"))
+    EXPORT_TIMEOUT: float = float(os.getenv("EXPORT_TIMEOUT", "900"))
+
+    # Approximate token budget for the query result passed to the natural-language response call
+    RESPONSE_DIGEST_TOKEN_BUDGET: int = int(os.getenv("RESPONSE_DIGEST_TOKEN_BUDGET", "1500"))
+
+    # Answer simple results (single value, one row, top-N, time series) from local templates instead of the LLM
+    ANSWER_TEMPLATES_ENABLED: bool = os.getenv("ANSWER_TEMPLATES_ENABLED", "true").lower() == "true"
+
+    # Schema retrieval: columns kept per query across the retrieved tables, and the floor per table
+    RAG_TOP_COLUMNS: int = int(os.getenv("RAG_TOP_COLUMNS", "15"))
+    RAG_MIN_COLUMNS_PER_TABLE: int = int(os.getenv("RAG_MIN_COLUMNS_PER_TABLE", "4"))
+
+    # Token budget for the SQL-generation prompt; the lowest-ranked schema sections are dropped to fit
+    SQL_PROMPT_TOKEN_BUDGET: int = int(os.getenv("SQL_PROMPT_TOKEN_BUDGET", "6000"))
+
+    # Add a per-stage timing breakdown (meta.timings_ms) to every /ask response
+    RESPONSE_TIMINGS_ENABLED: bool = os.getenv("RESPONSE_TIMINGS_ENABLED", "false").lower() == "true"
+
+    # Admission control. Requests: questions (or batches) processed at once, how many more may queue,
+    # the longest a request waits for a slot, and the deadline (seconds from admission) after which it
+    # may no longer wait for LLM or DB capacity. A limit of 0 disables that gate.
+    ADMISSION_MAX_REQUESTS: int = int(os.getenv("ADMISSION_MAX_REQUESTS", "32"))
+    ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+    ADMISSION_REQUEST_DEADLINE: float = float(os.getenv("ADMISSION_REQUEST_DEADLINE", "30"))
+    # LLM calls in flight, queue length and wait, plus the provider quota as a token bucket
+    # (requests per minute and burst; 0 RPM disables it). 30 RPM is Groq's free-tier limit for the default model.
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_QUEUE_SIZE: int = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+    LLM_QUEUE_TIMEOUT: float = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+    LLM_RATE_LIMIT_RPM: float = float(os.getenv("LLM_RATE_LIMIT_RPM", "30"))
+    LLM_RATE_LIMIT_BURST: float = float(os.getenv("LLM_RATE_LIMIT_BURST", "5"))
+    # Statements running on the analytics pools at once (keep at or below their combined size plus overflow), queue and wait
+    DB_MAX_CONCURRENCY: int = int(os.getenv("DB_MAX_CONCURRENCY", "10"))
+    DB_QUEUE_SIZE: int = int(os.getenv("DB_QUEUE_SIZE", "100"))
+    DB_QUEUE_TIMEOUT: float = float(os.getenv("DB_QUEUE_TIMEOUT", "10"))
+    # Slow queue for statements the planner found expensive: they also take one of these few slots
+    DB_SLOW_MAX_CONCURRENCY: int = int(os.getenv("DB_SLOW_MAX_CONCURRENCY", "2"))
+    DB_SLOW_QUEUE_SIZE: int = int(os.getenv("DB_SLOW_QUEUE_SIZE", "20"))
+    DB_SLOW_QUEUE_TIMEOUT: float = float(os.getenv("DB_SLOW_QUEUE_TIMEOUT", "30"))
+
+    # Logging: level, record format ("json" or "text"), log file (empty disables it) rotated at LOG_MAX_BYTES,
+    # or on the LOG_ROTATE_WHEN schedule when that is 0, and rotated files kept. Records wait in a queue of
+    # LOG_QUEUE_SIZE for the writer thread and are dropped when it is full. Below WARNING, only the
+    # LOG_SAMPLE_RATE share of requests is logged, and each message is capped at LOG_RATE_LIMIT lines per
+    # second (0 disables the cap).
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    LOG_FILE: str = os.getenv("LOG_FILE", "logs/app.log")
+    LOG_MAX_BYTES: int = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+    LOG_ROTATE_WHEN: str = os.getenv("LOG_ROTATE_WHEN", "midnight")
+    LOG_BACKUP_COUNT: int = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+    LOG_RATE_LIMIT: int = int(os.getenv("LOG_RATE_LIMIT", "50"))
+
+    # Connection pools. Metadata (INFORMATION_SCHEMA) queries get a small pool of their own; analytics queries get a
+    # larger one per host, spread round-robin over DB_REPLICA_HOSTS ("host:port,host:port"; empty uses the primary)
+    # with hosts probed every DB_REPLICA_HEALTH_INTERVAL seconds. Connections are recycled after DB_POOL_RECYCLE
+    # seconds, checkouts wait at most DB_POOL_TIMEOUT, and sessions only allow READ ONLY transactions.
+    METADATA_POOL_SIZE: int = int(os.getenv("METADATA_POOL_SIZE", "2"))
+    METADATA_MAX_OVERFLOW: int = int(os.getenv("METADATA_MAX_OVERFLOW", "1"))
+    ANALYTICS_POOL_SIZE: int = int(os.getenv("ANALYTICS_POOL_SIZE", "10"))
+    ANALYTICS_MAX_OVERFLOW: int = int(os.getenv("ANALYTICS_MAX_OVERFLOW", "5"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    DB_REPLICA_HOSTS: str = os.getenv("DB_REPLICA_HOSTS", "")
+    DB_REPLICA_HEALTH_INTERVAL: float = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "10"))
+    DB_SESSION_READ_ONLY: bool = os.getenv("DB_SESSION_READ_ONLY", "true").lower() == "true"
+
+    # Startup warm-up, run in the background once the server listens (/readyz answers 503 until it is done):
+    # timeout in seconds per step, and analytics connections opened per host ahead of the first query
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_STEP_TIMEOUT: float = float(os.getenv("WARMUP_STEP_TIMEOUT", "30"))
+    WARMUP_DB_CONNECTIONS: int = int(os.getenv("WARMUP_DB_CONNECTIONS", "2"))
+
+    # Pre-execution cost guard: generated SQL is EXPLAINed first (plans cached per statement for the TTL).
+    # Statements estimated to examine more than PLANNER_MAX_ROWS rows are rejected, more than PLANNER_SLOW_ROWS
+    # go to the slow queue, as do full scans, filesorts and temporary tables over PLANNER_LARGE_TABLE_ROWS rows
+    PLANNER_ENABLED: bool = os.getenv("PLANNER_ENABLED", "true").lower() == "true"
+    PLANNER_MAX_ROWS: float = float(os.getenv("PLANNER_MAX_ROWS", "50000000"))
+    PLANNER_SLOW_ROWS: float = float(os.getenv("PLANNER_SLOW_ROWS", "1000000"))
+    PLANNER_LARGE_TABLE_ROWS: float = float(os.getenv("PLANNER_LARGE_TABLE_ROWS", "100000"))
+    PLANNER_EXPLAIN_TIMEOUT: float = float(os.getenv("PLANNER_EXPLAIN_TIMEOUT", "5"))
+    PLANNER_CACHE_SIZE: int = int(os.getenv("PLANNER_CACHE_SIZE", "1024"))
+    PLANNER_CACHE_TTL: int = int(os.getenv("PLANNER_CACHE_TTL", "600"))
+    # Before rejecting, an over-budget query is retried restricted to the last PLANNER_REWRITE_WINDOW_DAYS days
+    # (0 disables) of each table listed here with its date column
+    PLANNER_REWRITE_WINDOW_DAYS: int = int(os.getenv("PLANNER_REWRITE_WINDOW_DAYS", "365"))
+    PLANNER_DATE_COLUMNS: Dict[str, str] = {
+        "data_so_summary": "so_date"
+    }
+
+    # Pre-aggregated rollups kept in a local SQLite file and refreshed incrementally every ROLLUP_REFRESH_INTERVAL
+    # seconds, re-reading the last ROLLUP_LOOKBACK_DAYS days; rebuilt in full every ROLLUP_REBUILD_INTERVAL seconds.
+    # Aggregate queries they can answer read them instead of MySQL while they are under ROLLUP_MAX_STALENESS old.
+    # Incremental refreshes miss updates and deletes of older rows, so unless a rollup is marked insert_only it is
+    # also only served while its last full build is under ROLLUP_REBUILD_INTERVAL + ROLLUP_MAX_STALENESS old:
+    # that is how late such changes can show up in answers
+    ROLLUP_ENABLED: bool = os.getenv("ROLLUP_ENABLED", "true").lower() == "true"
+    ROLLUP_DB_PATH: str = os.getenv("ROLLUP_DB_PATH", "snapshots/rollups.sqlite")
+    ROLLUP_REFRESH_INTERVAL: int = int(os.getenv("ROLLUP_REFRESH_INTERVAL", "300"))
+    ROLLUP_LOOKBACK_DAYS: int = int(os.getenv("ROLLUP_LOOKBACK_DAYS", "3"))
+    ROLLUP_REBUILD_INTERVAL: int = int(os.getenv("ROLLUP_REBUILD_INTERVAL", "3600"))
+    ROLLUP_MAX_STALENESS: int = int(os.getenv("ROLLUP_MAX_STALENESS", "900"))
+    ROLLUP_REFRESH_TIMEOUT: float = float(os.getenv("ROLLUP_REFRESH_TIMEOUT", "120"))
+    # Full builds read the source ROLLUP_CHUNK_DAYS days at a time, failing on chunks over ROLLUP_CHUNK_MAX_ROWS rows
+    ROLLUP_CHUNK_DAYS: int = int(os.getenv("ROLLUP_CHUNK_DAYS", "31"))
+    ROLLUP_CHUNK_MAX_ROWS: int = int(os.getenv("ROLLUP_CHUNK_MAX_ROWS", "1000000"))
+    # Each rollup: a FROM clause, the columns it groups by, the expressions it sums/counts/bounds, and the date
+    # and primary key columns incremental refresh follows; "insert_only": True for sources whose rows never change
+    ROLLUP_DEFINITIONS: Dict[str, Dict[str, Any]] = {
+        "daily_client_sales": {
+            "source": "data_so_summary AS s",
+            "dimensions": ["s.so_date", "s.client_id"],
+            "measures": ["s.total_cost", "s.price"],
+            "date_column": "s.so_date",
+            "key_column": "s.dsosu_id"
+        },
+        "daily_sku_sales": {
+            "source": "data_so_details AS d JOIN data_so_summary AS s ON d.so_id = s.dsosu_id",
+            "dimensions": ["s.so_date", "d.sku_id"],
+            "measures": ["d.quantity", "d.unit_price", "d.quantity * d.unit_price"],
+            "date_column": "s.so_date",
+            "key_column": "s.dsosu_id"
+        }
+    }
+    # Small tables copied whole into the rollup store so rewritten queries can join them (names, cities, brands)
+    ROLLUP_DIMENSION_TABLES: List[str] = ["data_company_info", "data_prod_variant"]
+    ROLLUP_DIMENSION_MAX_ROWS: int = int(os.getenv("ROLLUP_DIMENSION_MAX_ROWS", "200000"))
+
+    # Size of the bounded thread pool used for CPU-bound and blocking work off the event loop
+    CPU_EXECUTOR_WORKERS: int = int(os.getenv("CPU_EXECUTOR_WORKERS", "4"))
+
+    # Schema registry: how often to probe for DDL drift, and the maximum age of a snapshot (seconds)
+    SCHEMA_REFRESH_INTERVAL: int = int(os.getenv("SCHEMA_REFRESH_INTERVAL", "60"))
+    SCHEMA_TTL: int = int(os.getenv("SCHEMA_TTL", "3600"))
+    # Local file the schema snapshot (snippets + fitted retriever) is persisted to; empty disables it
+    SCHEMA_SNAPSHOT_PATH: str = os.getenv("SCHEMA_SNAPSHOT_PATH", "snapshots/schema_snapshot.pkl")
     
     TABLE_MAPPING: Dict[str, str] = {
         "Sales": "data_so_summary",
@@ -27,6 +241,15 @@ class Settings:
         "id_columns": ["id", "_id", "pk", "so_id", "sos_id", "order_id", "client_id", "dci_id", "customer_id", "product_id", "sku_id"],
         "amount_columns": ["total", "total_amount", "amount", "price", "cost", "value", "revenue", "sum", "quantity"]
     }
+
+    # Columns holding rupee amounts: results are shown in ₹ only when computed from one of these
+    CURRENCY_COLUMNS: List[str] = ["total_cost", "price", "unit_price"]
+    
+    # Join keys between tables, used when the database declares no foreign key for them
+    SCHEMA_JOINS: List[Tuple[str, str]] = [
+        ("data_so_summary.client_id", "data_company_info.dci_id"),
+        ("data_so_details.so_id", "data_so_summary.dsosu_id")
+    ]
     
     ALLOWED_TABLES: List[str] = list(TABLE_MAPPING.values())
     
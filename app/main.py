@@ -1,9 +1,106 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api.router import router
+from app.api.router import get_query_controller, router
+from app.config.settings import settings
+from app.utils.logger import RequestContextMiddleware
+from app.utils.warmup import warmup
 
-app = FastAPI(title="Natural Language Analytics Interface")
+# Services are imported inside the functions below: importing them pulls in sqlglot, SQLAlchemy, numpy and
+# the LLM SDK, which the warm-up does in the background so the server starts listening straight away.
+
+
+async def warm_schema():
+    from app.services.schema_registry import schema_registry
+    from app.utils.concurrency import run_blocking
+    schema_registry.start()
+    snapshot = await schema_registry.get_snapshot_async()
+    # One retrieval so the first question doesn't pay for the scoring code paths
+    await run_blocking(snapshot.retriever.retrieve, "warm up", 1)
+
+
+async def warm_database():
+    from app.models.database.connection import analytics
+    await analytics.warm_up(settings.WARMUP_DB_CONNECTIONS)
+
+
+async def warm_llm():
+    from app.services.llm_client import get_llm_client
+    from app.utils.concurrency import run_blocking
+    # Building the client imports the provider SDK
+    client = await run_blocking(get_llm_client)
+    await client.warm_up()
+
+
+async def build_controller():
+    get_query_controller()
+
+
+async def start_result_cache_probe():
+    from app.models.database.connection import get_async_connection
+    from app.models.query.result_cache import result_cache
+    # Table writes invalidate cached results from here on, off the request path
+    result_cache.start(get_async_connection)
+
+
+async def start_rollups():
+    from app.models.rollup.store import rollup_store
+    # Refreshes in the background from here on; queries use MySQL until a rollup is fresh
+    rollup_store.start()
+
+
+warmup.preload(
+    "app.api.controllers.query_controller",
+    "app.models.database.connection",
+    "app.services.schema_registry"
+)
+# The schema and the pipeline are needed for every answer; the DB and LLM connect lazily if warming them fails
+warmup.add_step("schema", warm_schema, required=True)
+warmup.add_step("pipeline", build_controller, required=True)
+warmup.add_step("database", warm_database)
+warmup.add_step("llm", warm_llm)
+warmup.add_step("result_cache", start_result_cache_probe)
+if settings.ROLLUP_ENABLED:
+    warmup.add_step("rollups", start_rollups)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(warmup.run())
+    else:
+        from app.services.schema_registry import schema_registry
+        schema_registry.start()
+        await start_result_cache_probe()
+        if settings.ROLLUP_ENABLED:
+            await start_rollups()
+        warmup.mark_ready()
+        warmup_task = None
+    try:
+        yield
+    finally:
+        if warmup_task is not None and not warmup_task.done():
+            warmup_task.cancel()
+            try:
+                await warmup_task
+            except asyncio.CancelledError:
+                pass
+        from app.models.database.connection import analytics
+        from app.models.query.result_cache import result_cache
+        from app.models.rollup.store import rollup_store
+        from app.services.llm_client import close_llm_client
+        from app.services.schema_registry import schema_registry
+        schema_registry.stop()
+        await rollup_store.stop()
+        await result_cache.stop()
+        await close_llm_client()
+        await analytics.dispose()
+
+
+app = FastAPI(title="Natural Language Analytics Interface", lifespan=lifespan)
 
 app.include_router(router)
+app.add_middleware(RequestContextMiddleware)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,8 +1,209 @@
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from app.config.settings import settings
+from app.utils.logger import app_logger
+
+
+def _db_url(driver: str, host: str, port: int) -> str:
+    return f"mysql+{driver}://{settings.DB_USER}:{settings.DB_PASSWORD}@{host}:{port}/{settings.DB_NAME}"
+
+
+def _read_only_sessions(sync_engine):
+    """
+    Make every new connection of the engine start READ ONLY transactions, so
+    the server rejects writes whatever gets past SQL validation
+    """
+    if not settings.DB_SESSION_READ_ONLY:
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_read_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        cursor.close()
+
+
+def parse_hosts(value: str) -> List[Tuple[str, int]]:
+    """
+    "host1:3306,host2" -> [("host1", 3306), ("host2", DB_PORT)]
+    """
+    hosts = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port) if port else settings.DB_PORT))
+    return hosts
+
+
+# Small dedicated pool for INFORMATION_SCHEMA metadata, so heavy analytics can't starve schema refresh
+DB_URL = _db_url("mysqlconnector", settings.DB_HOST, settings.DB_PORT)
+engine = create_engine(
+    DB_URL,
+    pool_pre_ping=True,
+    pool_size=settings.METADATA_POOL_SIZE,
+    max_overflow=settings.METADATA_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_timeout=settings.DB_POOL_TIMEOUT
+)
+_read_only_sessions(engine)
+
+
+class AnalyticsHost:
+    """
+    One analytics server (the primary or a read replica) with its own async pool
+    """
+    def __init__(self, host: str, port: int):
+        self.name = f"{host}:{port}"
+        self.engine: AsyncEngine = create_async_engine(
+            _db_url("aiomysql", host, port),
+            pool_pre_ping=True,
+            pool_size=settings.ANALYTICS_POOL_SIZE,
+            max_overflow=settings.ANALYTICS_MAX_OVERFLOW,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_timeout=settings.DB_POOL_TIMEOUT
+        )
+        _read_only_sessions(self.engine.sync_engine)
+        self.healthy = True
+
+
+class AnalyticsRouter:
+    """
+    Hands out analytics connections round-robin across the hosts that passed
+    their last health check. A host that fails to connect is taken out of
+    rotation; a background probe (SELECT 1, at most every health_interval
+    seconds) puts it back once it answers. If every host is down, all of
+    them are tried anyway rather than failing outright.
+    """
+    def __init__(self, hosts: List[Tuple[str, int]], health_interval: float):
+        self.hosts = [AnalyticsHost(host, port) for host, port in hosts]
+        self.health_interval = health_interval
+        self._counter = itertools.count()
+        self._last_check = time.monotonic()
+        self._check_task = None
+
+    def _candidates(self) -> List[AnalyticsHost]:
+        healthy = [host for host in self.hosts if host.healthy] or self.hosts
+        start = next(self._counter) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def _maybe_check_health(self):
+        if self.health_interval <= 0 or time.monotonic() - self._last_check < self.health_interval:
+            return
+        if self._check_task is None or self._check_task.done():
+            self._last_check = time.monotonic()
+            self._check_task = asyncio.ensure_future(self.check_health())
+
+    async def _probe(self, host: AnalyticsHost) -> bool:
+        try:
+            async with host.engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), settings.DB_POOL_TIMEOUT)
+            return True
+        except Exception as e:
+            app_logger.warning("Analytics host %s failed its health check: %s", host.name, e)
+            return False
+
+    async def check_health(self):
+        """
+        Probe every host and update which ones are in rotation
+        """
+        results = await asyncio.gather(*(self._probe(host) for host in self.hosts))
+        for host, healthy in zip(self.hosts, results):
+            if healthy and not host.healthy:
+                app_logger.info("Analytics host %s is back in rotation", host.name)
+            host.healthy = healthy
+
+    @asynccontextmanager
+    async def connect(self) -> AsyncIterator[AsyncConnection]:
+        """
+        A connection to the next healthy host; failing hosts are skipped
+        """
+        self._maybe_check_health()
+        last_error = None
+        for host in self._candidates():
+            try:
+                conn = await host.engine.connect().start()
+            except Exception as e:
+                last_error = e
+                if host.healthy and len(self.hosts) > 1:
+                    app_logger.warning("Analytics host %s is unreachable, taking it out of rotation: %s", host.name, e)
+                host.healthy = False
+                continue
+            try:
+                yield conn
+            finally:
+                await conn.close()
+            return
+        raise last_error
+
+    async def warm_up(self, connections: int):
+        """
+        Open up to `connections` pooled connections per host ahead of the
+        first query. A host none of them reach is taken out of rotation;
+        raises only when no host can be reached.
+        """
+        connections = max(1, min(connections, settings.ANALYTICS_POOL_SIZE))
+
+        async def prime(host: AnalyticsHost):
+            async with host.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+
+        # Concurrent, so each host opens `connections` sockets rather than reusing one
+        results = await asyncio.gather(
+            *(prime(host) for host in self.hosts for _ in range(connections)), return_exceptions=True
+        )
+        errors = []
+        for i, host in enumerate(self.hosts):
+            failures = [r for r in results[i * connections:(i + 1) * connections] if isinstance(r, Exception)]
+            if len(failures) == connections:
+                app_logger.warning("Analytics host %s is unreachable at startup: %s", host.name, failures[0])
+                host.healthy = False
+                errors.append(failures[0])
+        if len(errors) == len(self.hosts):
+            raise errors[0]
+
+    async def dispose(self):
+        for host in self.hosts:
+            await host.engine.dispose()
+
+
+# Analytics queries go to the read replicas when configured, otherwise to the primary
+analytics = AnalyticsRouter(
+    parse_hosts(settings.DB_REPLICA_HOSTS) or [(settings.DB_HOST, settings.DB_PORT)],
+    settings.DB_REPLICA_HEALTH_INTERVAL
+)
+
+
+def _pool_stats(pool) -> Dict[str, int]:
+    if not hasattr(pool, "checkedout"):
+        return {}
+    return {
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "capacity": pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    }
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Occupancy of every pool, keyed "metadata" and "analytics:<host>"
+    """
+    stats = {"metadata": _pool_stats(engine.pool)}
+    for host in analytics.hosts:
+        stats[f"analytics:{host.name}"] = {**_pool_stats(host.engine.sync_engine.pool), "healthy": host.healthy}
+    return stats
 
-DB_URL = f"mysql+mysqlconnector://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
-engine = create_engine(DB_URL, pool_pre_ping=True)
 
 def get_connection():
     return engine.connect()
+
+def get_async_connection():
+    return analytics.connect()
@@ -1,33 +1,324 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import sqlglot
 from sqlalchemy import text
-from app.models.database.connection import engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlglot import exp
+from app.config.settings import settings
+from app.models.database.connection import analytics
+from app.models.query.result_cache import MISS, result_cache
+from app.services.safety_service import ValidatedQuery
+from app.utils.admission import db_gate, db_slot
 from app.utils.logger import app_logger
+from app.utils.single_flight import SingleFlight
+
+# Tables whose scans are expensive enough to put a query in the "heavy" class
+HEAVY_TABLES = {"data_so_details"}
+
+# In-flight executions keyed by row-limited canonical SQL
+_query_flight = SingleFlight("execute_query")
+
+# MySQL ER_QUERY_TIMEOUT: statement interrupted by MAX_EXECUTION_TIME
+ER_QUERY_TIMEOUT = 3024
+
+# Column type codes in the cursor description (MySQL protocol field types), by the kind of value
+# the driver returns. Codes not listed (BIT, GEOMETRY) are left for the consumer to infer.
+COLUMN_TYPES = {
+    **dict.fromkeys([1, 2, 3, 8, 9, 13], "int"),
+    **dict.fromkeys([4, 5], "float"),
+    **dict.fromkeys([0, 246], "decimal"),
+    **dict.fromkeys([10, 14], "date"),
+    **dict.fromkeys([7, 12], "datetime"),
+    11: "time",
+    6: "null",
+    **dict.fromkeys([15, 245, 247, 248, 249, 250, 251, 252, 253, 254], "string")
+}
+
+
+class QueryTimeoutError(Exception):
+    """
+    Raised when a query runs past its execution deadline and was killed
+    """
+
+
+def apply_row_limit(ast: exp.Expression, limit: int) -> exp.Expression:
+    """
+    Return a copy of the SELECT whose LIMIT is at most `limit`, so the server
+    stops producing rows instead of us discarding them after the fact
+    """
+    current = ast.args.get("limit")
+    if current is not None:
+        value = current.expression
+        if isinstance(value, exp.Literal) and not value.is_string and int(value.this) <= limit:
+            return ast
+    return ast.copy().limit(limit)
+
+
+def _literal_int(node: Optional[exp.Expression], clause: str) -> Optional[int]:
+    if node is None:
+        return None
+    value = node.expression
+    if not (isinstance(value, exp.Literal) and not value.is_string):
+        raise ValueError(f"Cannot page a query with a non-literal {clause}")
+    return int(value.this)
+
+
+def paginate(ast: exp.Expression, offset: int, count: int) -> Optional[exp.Expression]:
+    """
+    Return a copy of the SELECT restricted to rows [offset, offset + count)
+    of its own result, honouring any LIMIT/OFFSET it already has, or None if
+    offset is past its end. Pages are only stable if the query has an ORDER BY.
+    """
+    cap = _literal_int(ast.args.get("limit"), "LIMIT")
+    base_offset = _literal_int(ast.args.get("offset"), "OFFSET") or 0
+    if cap is not None:
+        if offset >= cap:
+            return None
+        count = min(count, cap - offset)
+    paged = ast.copy()
+    paged.set("offset", None)
+    paged = paged.limit(count)
+    if base_offset + offset:
+        paged = paged.offset(base_offset + offset)
+    return paged
+
+
+def classify_query(ast: exp.Expression, tables: List[str]) -> str:
+    """
+    Bucket a query for timeout purposes: "heavy" (reads order details or joins
+    three or more tables), "aggregate" (aggregates or GROUP BY) or "lookup"
+    """
+    if HEAVY_TABLES.intersection(tables) or len(tables) >= 3:
+        return "heavy"
+    if ast.args.get("group") is not None or ast.find(exp.AggFunc) is not None:
+        return "aggregate"
+    return "lookup"
+
+
+def _prepare(query, limit: int) -> Tuple[str, Optional[List[str]], str]:
+    """
+    Resolve what to run: the row-limited SQL, the tables it reads (None when
+    the SQL could not be parsed, which bypasses the result cache) and its class
+    """
+    if isinstance(query, ValidatedQuery):
+        ast, tables = query.ast, query.tables
+    else:
+        try:
+            ast = sqlglot.parse_one(query, read="mysql")
+        except Exception:
+            return query, None, "heavy"
+        tables = sorted({table.name.lower() for table in ast.find_all(exp.Table)})
+    if isinstance(ast, exp.Select):
+        ast = apply_row_limit(ast, limit)
+    return ast.sql(dialect="mysql"), tables, classify_query(ast, tables)
+
+
+async def _kill_query(engine: AsyncEngine, connection_id: int):
+    # Must run on the server executing the statement, which may be one of several replicas
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+        app_logger.warning("Killed running query on connection %s", connection_id)
+    except Exception as e:
+        app_logger.error("Failed to kill query on connection %s: %s", connection_id, e)
+
+
+async def _prepare_session(conn, deadline: float) -> int:
+    """
+    Apply the execution timeout to a connection and return its server-side id.
+    Both are cached on the pooled connection so repeat checkouts skip the round-trips.
+    """
+    if "connection_id" not in conn.info:
+        conn.info["connection_id"] = (await conn.execute(text("SELECT CONNECTION_ID()"))).scalar()
+    timeout_ms = int(deadline * 1000)
+    if conn.info.get("max_execution_time") != timeout_ms:
+        await conn.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}"))
+        conn.info["max_execution_time"] = timeout_ms
+    return conn.info["connection_id"]
+
+
+async def _run(conn, sql: str, limit: int):
+    result = await conn.execute(text(sql))
+
+    # Fetch rows up to limit
+    rows = result.fetchmany(limit)
+
+    # Convert to list of dicts
+    keys = list(result.keys())
+    return keys, [dict(zip(keys, row)) for row in rows]
+
 
-def execute_query(sql, timeout=30, limit=100):
-    app_logger.info(f"Executing SQL query: {sql[:100]}...")
-    # Ensure limit is applied if not already there (optional but safe)
-    # Most generated queries will have their own limits if requested
-    
+def _is_server_timeout(e: Exception) -> bool:
+    error_args = getattr(getattr(e, "orig", None), "args", ())
+    return bool(error_args) and error_args[0] == ER_QUERY_TIMEOUT
+
+
+async def _execute(sql: str, deadline: float, limit: int):
+    """
+    Run one statement under the execution deadline, killing it on timeout or cancellation
+    """
+    async with analytics.connect() as conn:
+        connection_id = await _prepare_session(conn, deadline)
+        try:
+            # The client-side deadline is a backstop in case the server ignores the limit
+            return await asyncio.wait_for(_run(conn, sql, limit), deadline + settings.QUERY_TIMEOUT_GRACE)
+        except asyncio.TimeoutError:
+            await asyncio.shield(_kill_query(conn.engine, connection_id))
+            await conn.invalidate()
+            raise QueryTimeoutError(f"Query exceeded the {deadline}s execution limit")
+        except asyncio.CancelledError:
+            await asyncio.shield(_kill_query(conn.engine, connection_id))
+            await conn.invalidate()
+            raise
+
+
+async def execute_query(query, timeout=None, limit=100, slow=False):
+    """
+    Execute a ValidatedQuery or a raw SQL string.
+
+    The row limit is pushed into the SQL and the statement runs under a
+    server-side MAX_EXECUTION_TIME picked by query class (QUERY_TIMEOUTS,
+    tightened by `timeout` when given). If the deadline passes or the caller
+    is cancelled (e.g. the HTTP client went away), the running statement is
+    stopped with KILL QUERY so it doesn't keep holding a pool connection.
+    Statements first wait for a slot at the DB admission gate and raise
+    Overloaded when it is saturated. `slow` (set by the planner for expensive
+    plans) runs the statement in the slow queue with the heavy timeout.
+    """
+    sql, tables, query_class = _prepare(query, limit)
+    if slow:
+        query_class = "heavy"
+    deadline = settings.QUERY_TIMEOUTS.get(query_class, settings.QUERY_TIMEOUTS["heavy"])
+    if timeout is not None:
+        deadline = min(deadline, timeout)
+    app_logger.debug("Executing %s SQL query (timeout %ss): %s...", query_class, deadline, sql[:100])
+
+    # Serve repeat queries from the result cache
+    cached = await _from_cache(sql, tables, limit)
+    if cached is not MISS:
+        app_logger.info("Query result served from cache")
+        return cached
+
+    # Identical statements already running are joined rather than run again
+    return await _query_flight.do((sql, limit, deadline), lambda: _execute_and_cache(sql, tables, deadline, limit, slow))
+
+
+async def _from_cache(sql: str, tables: Optional[List[str]], limit: int):
+    if tables is None:
+        return MISS
+    return result_cache.get(sql, limit)
+
+
+async def cached_result(query: ValidatedQuery, limit: int = 100):
+    """
+    The result execute_query() would serve from the result cache for this
+    query and row limit, or MISS; nothing is run
+    """
+    sql, tables, _ = _prepare(query, limit)
+    return await _from_cache(sql, tables, limit)
+
+
+async def execute_scan(sql: str, timeout: float, limit: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Run a statement the application built itself (not generated SQL, e.g. a
+    rollup's source read) as a long scan: it waits in the slow DB queue,
+    runs under `timeout` and bypasses the result cache. Returns the column
+    names and up to `limit` rows.
+    """
+    async with db_slot(slow=True):
+        return await _execute(sql, timeout, limit)
+
+
+async def _execute_and_cache(sql: str, tables: Optional[List[str]], deadline: float, limit: int, slow: bool = False):
+    try:
+        async with db_slot(slow):
+            keys, data = await _execute(sql, deadline, limit)
+
+        # If single result, return value, else return data
+        if len(data) == 1 and len(keys) == 1:
+            result_value = list(data[0].values())[0]
+            app_logger.info("Query executed successfully, returned single value: %s", result_value)
+            if tables is not None:
+                result_cache.put(sql, limit, tables, result_value)
+            return result_value
+
+        app_logger.info("Query executed successfully, returned %s rows", len(data))
+        if tables is not None:
+            result_cache.put(sql, limit, tables, data)
+        return data
+    except Exception as e:
+        if _is_server_timeout(e):
+            # The server enforced the limit itself
+            app_logger.error("Query timed out after %ss: %s...", deadline, sql[:100])
+            raise QueryTimeoutError(f"Query exceeded the {deadline}s execution limit") from e
+        app_logger.error("Error executing query '%s...': %s", sql[:100], e)
+        raise
+
+
+async def fetch_page(query: ValidatedQuery, offset: int, page_size: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Fetch one page of a validated query's result as rows, plus whether more
+    rows follow. One extra row is requested to answer the latter.
+    """
+    paged = paginate(query.ast, offset, page_size + 1)
+    if paged is None:
+        return [], False
+    query_class = classify_query(paged, query.tables)
+    deadline = settings.QUERY_TIMEOUTS.get(query_class, settings.QUERY_TIMEOUTS["heavy"])
+    sql = paged.sql(dialect="mysql")
+    app_logger.info("Fetching page at offset %s (%s rows): %s...", offset, page_size, sql[:100])
     try:
-        with engine.connect() as conn:
-            # Some DB drivers support execution options for timeout
-            # For mysql-connector, we rely on the DB user being read-only as primary defense
-            result = conn.execute(text(sql))
-            
-            # Fetch rows up to limit
-            rows = result.fetchmany(limit)
-            
-            # Convert to list of dicts
-            keys = result.keys()
-            data = [dict(zip(keys, row)) for row in rows]
-            
-            # If single result, return value, else return data
-            if len(data) == 1 and len(keys) == 1:
-                result_value = list(data[0].values())[0]
-                app_logger.info(f"Query executed successfully, returned single value: {result_value}")
-                return result_value
-                
-            app_logger.info(f"Query executed successfully, returned {len(data)} rows")
-            return data
+        async with db_gate.slot():
+            _, rows = await _execute(sql, deadline, page_size + 1)
     except Exception as e:
-        app_logger.error(f"Error executing query '{sql[:100]}...': {str(e)}")
+        if _is_server_timeout(e):
+            raise QueryTimeoutError(f"Query exceeded the {deadline}s execution limit") from e
+        app_logger.error("Error fetching page for '%s...': %s", sql[:100], e)
         raise
+    return rows[:page_size], len(rows) > page_size
+
+
+def _column_types(result) -> List[Optional[str]]:
+    # SQLAlchemy's async result doesn't expose the cursor; None for every column if it can't be read
+    try:
+        description = result._real_result.cursor.description
+        return [COLUMN_TYPES.get(column[1]) for column in description]
+    except Exception:
+        return [None] * len(result.keys())
+
+
+async def stream_columns(query: ValidatedQuery, chunk_size: int, max_rows: Optional[int] = None,
+                         timeout: Optional[float] = None) -> AsyncIterator[Tuple[List[str], List[Optional[str]], List[list]]]:
+    """
+    Stream a validated query's full result from an unbuffered server-side
+    cursor as column-oriented chunks: (column names, column types, one list
+    per column). Column types are COLUMN_TYPES values taken from the cursor,
+    or None where unknown. The first chunk carries the names and types with
+    empty columns, so callers can write headers even for empty results. Memory use is bounded by
+    chunk_size whatever the result size. Abandoning the iteration (e.g. on
+    client disconnect) kills the statement.
+    """
+    ast = apply_row_limit(query.ast, max_rows) if max_rows else query.ast
+    sql = ast.sql(dialect="mysql")
+    deadline = timeout or settings.QUERY_TIMEOUTS["heavy"]
+    app_logger.info("Streaming SQL query (timeout %ss): %s...", deadline, sql[:100])
+
+    async with db_gate.slot(), analytics.connect() as conn:
+        connection_id = await _prepare_session(conn, deadline)
+        completed = False
+        try:
+            result = await conn.stream(text(sql))
+            keys = list(result.keys())
+            types = _column_types(result)
+            yield keys, types, [[] for _ in keys]
+            row_count = 0
+            async for rows in result.partitions(chunk_size):
+                row_count += len(rows)
+                yield keys, types, [list(column) for column in zip(*rows)]
+            completed = True
+            app_logger.info("Streamed %s rows", row_count)
+        finally:
+            if not completed:
+                await asyncio.shield(_kill_query(conn.engine, connection_id))
+                await conn.invalidate()
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlglot import exp
+from app.config.settings import settings
+from app.models.database.connection import analytics
+from app.models.query.query_executor import apply_row_limit
+from app.services.safety_service import ValidatedQuery
+from app.utils.admission import Overloaded, db_gate
+from app.utils.logger import app_logger
+from app.utils.metrics import PLANNER_DECISIONS
+from app.utils.single_flight import SingleFlight
+from app.utils.time_utils import current_date
+
+# Access types that read the whole table or the whole index
+FULL_SCAN_ACCESS = {"ALL", "index"}
+
+
+class QueryTooExpensive(Exception):
+    """
+    Raised when the plan of a statement is over the cost budget and no rewrite brings it under
+    """
+    def __init__(self, message: str, plan: "QueryPlan"):
+        super().__init__(message)
+        self.plan = plan
+
+
+def _number(value: Any) -> float:
+    # EXPLAIN JSON reports some figures as strings ("filtered": "10.00")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class QueryPlan:
+    """
+    What EXPLAIN FORMAT=JSON says a statement will do: the optimizer's cost,
+    the rows it examines (in a nested loop each table is scanned once per row
+    the tables before it produce), the tables it reads in full with their
+    rows per scan, and whether it sorts or builds temporary tables
+    """
+    def __init__(self):
+        self.cost = 0.0
+        self.rows_examined = 0.0
+        self.full_scans: Dict[str, float] = {}
+        self.filesort = False
+        self.temporary = False
+
+    @classmethod
+    def from_explain(cls, explain: Dict[str, Any]) -> "QueryPlan":
+        plan = cls()
+        plan._walk(explain)
+        return plan
+
+    def _table(self, table: Dict[str, Any], scans: float):
+        per_scan = _number(table.get("rows_examined_per_scan"))
+        self.rows_examined += scans * per_scan
+        if table.get("access_type") in FULL_SCAN_ACCESS:
+            name = table.get("table_name", "?")
+            self.full_scans[name] = max(self.full_scans.get(name, 0.0), per_scan)
+        # Derived tables and subqueries attached to the table are planned on their own
+        self._walk(table)
+
+    def _walk(self, node: Any):
+        if isinstance(node, list):
+            for item in node:
+                self._walk(item)
+            return
+        if not isinstance(node, dict):
+            return
+        if node.get("using_filesort"):
+            self.filesort = True
+        if node.get("using_temporary_table"):
+            self.temporary = True
+        for key, value in node.items():
+            if key == "cost_info" and isinstance(value, dict) and "query_cost" in value:
+                # The outermost block's cost covers the statement; nested blocks report their share
+                self.cost = max(self.cost, _number(value["query_cost"]))
+            elif key == "nested_loop" and isinstance(value, list):
+                scans = 1.0
+                for item in value:
+                    table = item.get("table") if isinstance(item, dict) else None
+                    if isinstance(table, dict):
+                        self._table(table, scans)
+                        # rows_produced_per_join counts the rows joined so far
+                        scans = max(_number(table.get("rows_produced_per_join")), 1.0)
+                    else:
+                        self._walk(item)
+            elif key == "table" and isinstance(value, dict):
+                self._table(value, 1.0)
+            elif isinstance(value, (dict, list)):
+                self._walk(value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "cost": round(self.cost, 2),
+            "rows_examined": int(self.rows_examined),
+            "full_scans": sorted(self.full_scans),
+            "filesort": self.filesort,
+            "temporary": self.temporary
+        }
+
+
+class PlannedQuery:
+    """
+    The planner's verdict on a validated query: what to run (the query
+    itself or a rewrite of it), whether it goes to the slow queue, and the
+    plan behind the decision (None when the query could not be planned).
+    A rewrite that changes the answer comes with a notice for the user.
+    """
+    def __init__(self, query: ValidatedQuery, plan: Optional[QueryPlan], decision: str,
+                 slow: bool = False, rewrite: Optional[str] = None, notice: Optional[str] = None):
+        self.query = query
+        self.plan = plan
+        self.decision = decision
+        self.slow = slow
+        self.rewrite = rewrite
+        self.notice = notice
+
+    def meta(self) -> Optional[Dict[str, Any]]:
+        if self.plan is None:
+            return None
+        meta = {**self.plan.to_dict(), "decision": self.decision}
+        if self.rewrite:
+            meta["rewrite"] = self.rewrite
+        return meta
+
+
+def window_dates(ast: exp.Expression, date_columns: Dict[str, str],
+                 since: date) -> Tuple[Optional[exp.Expression], List[str]]:
+    """
+    Copy of the SELECT with `<date column> >= since` added for each table in
+    its FROM and JOINs that has a date column, and the tables restricted;
+    (None, []) when there are none. The bound goes in the WHERE clause for
+    the FROM table and inner joins, and in the ON clause of a LEFT JOIN, so
+    outer rows are kept. Tables a RIGHT or FULL JOIN NULL-extends are left alone.
+    """
+    if not isinstance(ast, exp.Select) or ast.args.get("from") is None:
+        return None, []
+    select = ast.copy()
+    joins = select.args.get("joins") or []
+    sides = [""] + [(join.args.get("side") or "").upper() for join in joins]
+    sources = [select.args["from"].this] + [join.this for join in joins]
+    # Everything before the last RIGHT (or FULL) JOIN may be NULL-extended by it
+    last_right = max((i for i, side in enumerate(sides) if side in ("RIGHT", "FULL")), default=0)
+    conditions, tables = [], []
+    for i, source in enumerate(sources):
+        if not isinstance(source, exp.Table) or source.name.lower() not in date_columns:
+            continue
+        if i < last_right or sides[i] == "FULL":
+            continue
+        column = exp.column(date_columns[source.name.lower()], table=source.alias_or_name)
+        condition = column >= exp.Literal.string(since.isoformat())
+        if sides[i] == "LEFT":
+            join = joins[i - 1]
+            if join.args.get("on") is None:
+                continue
+            join.set("on", exp.and_(join.args["on"], condition))
+        else:
+            conditions.append(condition)
+        tables.append(source.name.lower())
+    if not tables:
+        return None, []
+    if conditions:
+        select = select.where(exp.and_(*conditions), copy=False)
+    return select, tables
+
+
+async def _explain(sql: str) -> Dict[str, Any]:
+    async with db_gate.slot(), analytics.connect() as conn:
+        try:
+            result = await asyncio.wait_for(
+                conn.execute(text(f"EXPLAIN FORMAT=JSON {sql}")), settings.PLANNER_EXPLAIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            await conn.invalidate()
+            raise
+        return json.loads(result.scalar())
+
+
+class QueryPlanner:
+    """
+    Cost guard between validation and execution. Each statement is EXPLAINed
+    with the row limit the executor will add, and its plan cached per SQL
+    for `cache_ttl` seconds (concurrent requests for the same SQL share one
+    EXPLAIN). Then:
+
+    - over max_rows examined: retried restricted to the last window_days
+      days of the tables in date_columns, and rejected with
+      QueryTooExpensive if that is still over budget;
+    - over slow_rows, or a full scan of a table with at least large_rows
+      rows, or a filesort or temporary table over that many rows examined:
+      sent to the slow queue;
+    - otherwise run as usual.
+
+    A query whose plan can't be obtained runs unguarded: the executor's
+    timeouts still apply.
+    """
+    def __init__(self, max_rows: float, slow_rows: float, large_rows: float, date_columns: Dict[str, str],
+                 window_days: int, cache_size: int = 1024, cache_ttl: float = 600):
+        self.max_rows = max_rows
+        self.slow_rows = slow_rows
+        self.large_rows = large_rows
+        self.date_columns = {table.lower(): column for table, column in date_columns.items()}
+        self.window_days = window_days
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._plans: "OrderedDict[str, Tuple[float, QueryPlan]]" = OrderedDict()
+        self._flight = SingleFlight("explain")
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, sql: str) -> Optional[QueryPlan]:
+        entry = self._plans.get(sql)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self._plans.move_to_end(sql)
+        self.hits += 1
+        return entry[1]
+
+    async def explain(self, ast: exp.Expression, limit: int) -> QueryPlan:
+        """
+        Plan of the statement as the executor will run it, from the cache when fresh
+        """
+        if isinstance(ast, exp.Select):
+            ast = apply_row_limit(ast, limit)
+        sql = ast.sql(dialect="mysql")
+        plan = self._cached(sql)
+        if plan is None:
+            plan = QueryPlan.from_explain(await self._flight.do(sql, lambda: _explain(sql)))
+            if self.cache_size > 0:
+                self._plans[sql] = (time.monotonic() + self.cache_ttl, plan)
+                self._plans.move_to_end(sql)
+                while len(self._plans) > self.cache_size:
+                    self._plans.popitem(last=False)
+        return plan
+
+    def _is_slow(self, plan: QueryPlan) -> bool:
+        if plan.rows_examined > self.slow_rows:
+            return True
+        if any(rows >= self.large_rows for rows in plan.full_scans.values()):
+            return True
+        return (plan.filesort or plan.temporary) and plan.rows_examined >= self.large_rows
+
+    def _rewrite(self, query: ValidatedQuery) -> Tuple[Optional[ValidatedQuery], List[str], Optional[date]]:
+        if self.window_days <= 0:
+            return None, [], None
+        since = current_date() - timedelta(days=self.window_days)
+        ast, tables = window_dates(query.ast, self.date_columns, since)
+        if ast is None:
+            return None, [], None
+        canonical = ast.sql(dialect="mysql")
+        # Only a date bound on tables it already read was added, so it stays valid
+        return ValidatedQuery(canonical, ast, canonical, query.tables), tables, since
+
+    async def plan(self, query: ValidatedQuery, limit: int) -> PlannedQuery:
+        """
+        Decide how to run a validated query; raises QueryTooExpensive to reject it
+        """
+        try:
+            plan = await self.explain(query.ast, limit)
+        except Overloaded:
+            # DB saturated: shed like the execution would be
+            raise
+        except Exception as e:
+            app_logger.warning("Could not plan query, running it unguarded: %s", e)
+            PLANNER_DECISIONS.labels(decision="unplanned").inc()
+            return PlannedQuery(query, None, "unplanned")
+
+        if plan.rows_examined <= self.max_rows:
+            slow = self._is_slow(plan)
+            decision = "slow" if slow else "ok"
+            PLANNER_DECISIONS.labels(decision=decision).inc()
+            return PlannedQuery(query, plan, decision, slow)
+
+        rewritten, tables, since = self._rewrite(query)
+        if rewritten is not None:
+            try:
+                rewritten_plan = await self.explain(rewritten.ast, limit)
+            except Overloaded:
+                raise
+            except Exception as e:
+                app_logger.warning("Could not plan the rewritten query: %s", e)
+                rewritten_plan = None
+            if rewritten_plan is not None and rewritten_plan.rows_examined <= self.max_rows:
+                note = (
+                    f"Restricted {', '.join(tables)} to rows since {since}: the full query would examine "
+                    f"about {plan.rows_examined:,.0f} rows"
+                )
+                notice = (
+                    f"Note: this answer only covers data since {since}. The full date range is too large to query "
+                    f"at once; ask about a specific period for anything earlier."
+                )
+                app_logger.warning("Query over the cost budget rewritten: %s", note)
+                PLANNER_DECISIONS.labels(decision="rewritten").inc()
+                return PlannedQuery(
+                    rewritten, rewritten_plan, "rewritten", self._is_slow(rewritten_plan), note, notice
+                )
+
+        PLANNER_DECISIONS.labels(decision="rejected").inc()
+        app_logger.warning(
+            "Query rejected by the cost guard (%.0f rows examined, full scans %s): %s...",
+            plan.rows_examined, sorted(plan.full_scans), query.canonical_sql[:100]
+        )
+        raise QueryTooExpensive(
+            f"This query would examine about {plan.rows_examined:,.0f} rows, over the limit of "
+            f"{self.max_rows:,.0f}. Try narrowing it down, for example to a shorter date range.",
+            plan
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._plans)}
+
+
+query_planner = QueryPlanner(
+    settings.PLANNER_MAX_ROWS,
+    settings.PLANNER_SLOW_ROWS,
+    settings.PLANNER_LARGE_TABLE_ROWS,
+    settings.PLANNER_DATE_COLUMNS,
+    settings.PLANNER_REWRITE_WINDOW_DAYS,
+    settings.PLANNER_CACHE_SIZE,
+    settings.PLANNER_CACHE_TTL
+)
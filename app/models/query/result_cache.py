@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.config.settings import settings
+from app.utils.logger import app_logger
+
+# Returned by ResultCache.get on a miss, since None is a valid cached result
+MISS = object()
+
+
+def _estimate_size(value: Any) -> int:
+    # Rough byte estimate; precise accounting would cost more than the cache saves
+    return len(repr(value))
+
+
+class _ResultEntry:
+    def __init__(self, value: Any, tables: List[str], expires_at: float, size: int):
+        self.value = value
+        self.tables = tables
+        self.expires_at = expires_at
+        self.size = size
+
+
+class ResultCache:
+    """
+    Query result cache keyed by canonical SQL (regenerated from the sqlglot
+    AST, so formatting differences share an entry) and row limit.
+
+    Each entry is tagged with the tables it reads. Its TTL is the smallest
+    per-table TTL among them, the cache is bounded by an approximate byte
+    budget (LRU eviction), and invalidate_tables() drops only the entries
+    that touch the given tables. A background task started with start()
+    compares each table's INFORMATION_SCHEMA.TABLES.UPDATE_TIME with the last
+    probe every probe_interval seconds and invalidates tables that have been
+    written to, so lookups never wait on the probe.
+    """
+    def __init__(self, default_ttl: float = 60, table_ttls: Optional[Dict[str, float]] = None,
+                 max_bytes: int = 64 * 1024 * 1024, probe_interval: float = 10):
+        self.default_ttl = default_ttl
+        self.table_ttls = {t.lower(): ttl for t, ttl in (table_ttls or {}).items()}
+        self.max_bytes = max_bytes
+        self.probe_interval = probe_interval
+        self._entries: "OrderedDict[Tuple[str, int], _ResultEntry]" = OrderedDict()
+        self._by_table: Dict[str, Set[Tuple[str, int]]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._table_versions: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def ttl_for(self, tables: Iterable[str]) -> float:
+        return min([self.table_ttls.get(t, self.default_ttl) for t in tables] or [self.default_ttl])
+
+    def get(self, canonical_sql: str, limit: int) -> Any:
+        key = (canonical_sql, limit)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, canonical_sql: str, limit: int, tables: List[str], value: Any):
+        ttl = self.ttl_for(tables)
+        if ttl <= 0:
+            return
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        key = (canonical_sql, limit)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _ResultEntry(value, tables, time.time() + ttl, size)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Tuple[str, int]):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def invalidate_tables(self, tables: Iterable[str]) -> int:
+        """
+        Drop every cached result that reads any of the given tables
+        """
+        tables = [t.lower() for t in tables]
+        removed = 0
+        with self._lock:
+            for table in tables:
+                for key in list(self._by_table.get(table, ())):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            self.invalidations += removed
+        if removed:
+            app_logger.info("Result cache invalidated %s entries for tables %s", removed, tables)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    async def refresh_freshness(self, conn_factory):
+        """
+        Probe table UPDATE_TIMEs and invalidate tables changed since the
+        previous probe. conn_factory returns an async connection context
+        manager.
+        """
+        table_placeholders = ", ".join([f"'{t}'" for t in settings.ALLOWED_TABLES])
+        query = text(f"""
+            SELECT TABLE_NAME, UPDATE_TIME
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = :db_name AND TABLE_NAME IN ({table_placeholders})
+        """)
+        try:
+            async with conn_factory() as conn:
+                try:
+                    # MySQL 8 otherwise serves UPDATE_TIME from a statistics cache that is
+                    # refreshed only every information_schema_stats_expiry seconds (a day by default)
+                    await conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+                except Exception:
+                    # Older servers have no such cache
+                    pass
+                rows = (await conn.execute(query, {"db_name": settings.DB_NAME})).fetchall()
+        except Exception as e:
+            # Fall back to TTL expiry until the next probe
+            app_logger.warning("Result cache freshness probe failed: %s", e)
+            return
+
+        changed = []
+        for table, update_time in rows:
+            table = table.lower()
+            previous = self._table_versions.get(table)
+            if previous is not None and update_time is not None and update_time != previous:
+                changed.append(table)
+            if update_time is not None:
+                self._table_versions[table] = update_time
+        if changed:
+            self.invalidate_tables(changed)
+
+    async def _run(self, conn_factory):
+        while True:
+            await self.refresh_freshness(conn_factory)
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self, conn_factory):
+        """
+        Probe in the background every probe_interval seconds; a probe_interval
+        of 0 leaves entries to expire by TTL alone
+        """
+        if self.probe_interval <= 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._run(conn_factory))
+        app_logger.info("Result cache freshness probe started (interval %ss)", self.probe_interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+result_cache = ResultCache(
+    settings.RESULT_CACHE_TTL,
+    settings.RESULT_CACHE_TABLE_TTLS,
+    settings.RESULT_CACHE_MAX_BYTES,
+    settings.RESULT_CACHE_PROBE_INTERVAL
+)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+
+def resolve_columns(expression: exp.Expression, aliases: Dict[str, str], default_table: Optional[str]) -> Optional[str]:
+    """
+    The expression's MySQL text with every column qualified by its real
+    (lower-case) table name instead of an alias, so the same expression
+    written against different aliases compares equal. None when a column's
+    table can't be told.
+    """
+    resolved = expression.copy()
+    for column in resolved.find_all(exp.Column):
+        table = aliases.get(column.table.lower()) if column.table else default_table
+        if table is None:
+            return None
+        column.set("table", exp.to_identifier(table))
+        column.set("db", None)
+        column.set("this", exp.to_identifier(column.name.lower()))
+    return resolved.sql(dialect="mysql")
+
+
+class RollupDefinition:
+    """
+    One materialized aggregate: a FROM clause (a table, or tables joined on
+    fixed keys), the columns it is grouped by, and the expressions it
+    measures. Each measure is stored as SUM, COUNT, MIN and MAX, enough to
+    answer SUM, COUNT, AVG, MIN and MAX of it; COUNT(*) comes from the stored
+    row count. date_column and key_column (the primary key of the table the
+    date belongs to) are the high-water marks incremental refresh follows.
+    source_columns lists every (table, column) the rollup reads. insert_only
+    declares that source rows are never updated or deleted, which is what
+    lets incremental refreshes alone keep the rollup exact.
+    """
+    def __init__(self, name: str, source: str, dimensions: List[str], measures: List[str],
+                 date_column: str, key_column: str, insert_only: bool = False):
+        self.name = name
+        self.insert_only = insert_only
+        self.table = f"rollup_{name}"
+        self.source = source
+        self.date_column = date_column
+        self.key_column = key_column
+
+        parsed = sqlglot.parse_one(f"SELECT 1 FROM {source}", read="mysql")
+        self.aliases = {table.alias_or_name.lower(): table.name.lower() for table in parsed.find_all(exp.Table)}
+        self.tables = frozenset(self.aliases.values())
+        default_table = next(iter(self.tables)) if len(self.tables) == 1 else None
+        self.join_keys = set()
+        for join in parsed.args.get("joins") or []:
+            keys = equality_keys(join.args.get("on"), self.aliases, default_table)
+            if keys is None:
+                raise ValueError(f"Rollup {name}: joins must be column equalities")
+            self.join_keys |= keys
+
+        # Resolved "table.column" -> column name in the rollup table
+        self.dimensions: Dict[str, str] = {}
+        self.dimension_sql: List[str] = []
+        for dimension in dimensions:
+            column = sqlglot.parse_one(dimension, read="mysql")
+            key = resolve_columns(column, self.aliases, default_table)
+            if not isinstance(column, exp.Column) or key is None:
+                raise ValueError(f"Rollup {name}: dimension {dimension} is not a column of its source")
+            if column.name.lower() in self.dimensions.values():
+                raise ValueError(f"Rollup {name}: two dimensions are named {column.name}")
+            self.dimensions[key] = column.name.lower()
+            self.dimension_sql.append(dimension)
+
+        # Resolved measure expression -> index in the m<i>_* columns
+        self.measures: Dict[str, int] = {}
+        self.measure_sql = list(measures)
+        for i, measure in enumerate(measures):
+            key = resolve_columns(sqlglot.parse_one(measure, read="mysql"), self.aliases, default_table)
+            if key is None:
+                raise ValueError(f"Rollup {name}: measure {measure} has an ambiguous column")
+            self.measures[key] = i
+
+        date_key = resolve_columns(sqlglot.parse_one(date_column, read="mysql"), self.aliases, default_table)
+        if date_key not in self.dimensions:
+            raise ValueError(f"Rollup {name}: the date column must be one of its dimensions")
+        self.date_dimension = self.dimensions[date_key]
+
+        self.source_columns: FrozenSet[Tuple[str, str]] = frozenset()
+        for sql in [f"SELECT 1 FROM {source}", *dimensions, *measures, date_column, key_column]:
+            for column in sqlglot.parse_one(sql, read="mysql").find_all(exp.Column):
+                table = self.aliases.get(column.table.lower()) if column.table else default_table
+                if table is None:
+                    raise ValueError(f"Rollup {name}: column {column.sql()} has no table")
+                self.source_columns |= {(table, column.name.lower())}
+        self.fingerprint = hashlib.sha256(json.dumps(
+            [source, dimensions, measures, date_column, key_column]
+        ).encode("utf-8")).hexdigest()
+
+    @property
+    def columns(self) -> List[str]:
+        names = list(self.dimensions.values())
+        for i in range(len(self.measure_sql)):
+            names += [f"m{i}_sum", f"m{i}_count", f"m{i}_min", f"m{i}_max"]
+        return names + ["row_count"]
+
+    def aggregate_sql(self, condition: str) -> str:
+        """
+        MySQL statement computing the rollup rows for source rows matching `condition`
+        """
+        selected = [f"{sql} AS {name}" for sql, name in zip(self.dimension_sql, self.dimensions.values())]
+        for i, measure in enumerate(self.measure_sql):
+            selected += [
+                f"SUM({measure}) AS m{i}_sum", f"COUNT({measure}) AS m{i}_count",
+                f"MIN({measure}) AS m{i}_min", f"MAX({measure}) AS m{i}_max"
+            ]
+        selected.append("COUNT(*) AS row_count")
+        return (
+            f"SELECT {', '.join(selected)} FROM {self.source} WHERE {condition} "
+            f"GROUP BY {', '.join(self.dimension_sql)}"
+        )
+
+    def bounds_sql(self) -> str:
+        """
+        MySQL statement returning the source's highest key, and its first and last dates
+        """
+        return (
+            f"SELECT MAX({self.key_column}) AS max_key, MIN({self.date_column}) AS min_date, "
+            f"MAX({self.date_column}) AS max_date FROM {self.source}"
+        )
+
+
+def equality_keys(condition: Optional[exp.Expression], aliases: Dict[str, str],
+                  default_table: Optional[str]) -> Optional[FrozenSet]:
+    """
+    A join condition made only of ANDed column equalities, as a set of
+    unordered pairs of resolved columns; None for anything else
+    """
+    if condition is None:
+        return None
+    terms = list(condition.flatten()) if isinstance(condition, exp.And) else [condition]
+    keys = set()
+    for term in terms:
+        if not (isinstance(term, exp.EQ) and isinstance(term.left, exp.Column) and isinstance(term.right, exp.Column)):
+            return None
+        left = resolve_columns(term.left, aliases, default_table)
+        right = resolve_columns(term.right, aliases, default_table)
+        if left is None or right is None:
+            return None
+        keys.add(frozenset((left, right)))
+    return frozenset(keys)
+
+
+def build_definitions(config: Dict[str, Dict[str, Any]]) -> List[RollupDefinition]:
+    return [RollupDefinition(name, **spec) for name, spec in config.items()]
@@ -0,0 +1,210 @@
+import re
+from typing import Collection, Dict, List, Optional, Tuple
+
+from sqlglot import exp
+from app.models.rollup.definitions import RollupDefinition, equality_keys, resolve_columns
+
+# DATE_FORMAT reaches the AST as a strftime format. Only numeric directives translate back exactly: sqlglot maps
+# MySQL's %W (weekday name) to %a, and names and week numbers follow the locale or other rules in SQLite.
+_EXACT_FORMAT_RE = re.compile(r"(?:%[YmdyjHMS]|[^%])*")
+
+
+def _sources(select: exp.Select) -> Optional[List[Tuple[exp.Table, Optional[exp.Join]]]]:
+    from_ = select.args.get("from")
+    if from_ is None or not isinstance(from_.this, exp.Table):
+        return None
+    sources = [(from_.this, None)]
+    for join in select.args.get("joins") or []:
+        if not isinstance(join.this, exp.Table) or join.args.get("on") is None:
+            return None
+        sources.append((join.this, join))
+    return sources
+
+
+def _is_inner(join: exp.Join) -> bool:
+    return not join.args.get("side") and join.args.get("kind") in (None, "", "INNER")
+
+
+def _is_aggregate(select: exp.Select) -> bool:
+    return bool(select.args.get("group") or select.args.get("distinct") or select.find(exp.AggFunc))
+
+
+class _Rewriter:
+    """
+    Rewrites one SELECT against one rollup. Every row of the rollup stands
+    for a group of source rows sharing the same dimension values, so the
+    query can read it as long as it only filters, groups and joins on
+    dimensions, and every aggregate over source columns can be rebuilt from
+    the stored partial aggregates.
+    """
+    def __init__(self, rollup: RollupDefinition, aliases: Dict[str, str], default_table: Optional[str],
+                 rollup_alias: str, output_names: Collection[str]):
+        self.rollup = rollup
+        self.aliases = aliases
+        self.default_table = default_table
+        self.alias = rollup_alias
+        self.output_names = output_names
+        self.failed = False
+
+    def _table_of(self, column: exp.Column) -> Optional[str]:
+        if column.table:
+            return self.aliases.get(column.table.lower())
+        return self.default_table
+
+    def _stored(self, name: str) -> exp.Column:
+        return exp.column(name, table=self.alias)
+
+    def _dimension(self, column: exp.Column) -> Optional[exp.Column]:
+        key = resolve_columns(column, self.aliases, self.default_table)
+        name = self.rollup.dimensions.get(key)
+        return self._stored(name) if name is not None else None
+
+    def _only_dimensions(self, node: exp.Expression) -> bool:
+        for column in node.find_all(exp.Column):
+            table = self._table_of(column)
+            if table is None or (table in self.rollup.tables and self._dimension(column) is None):
+                return False
+        return True
+
+    def _aggregate(self, node: exp.AggFunc) -> Optional[exp.Expression]:
+        argument = node.this
+        if isinstance(node, exp.Count) and isinstance(argument, exp.Star):
+            return exp.func("COALESCE", exp.func("SUM", self._stored("row_count")), exp.Literal.number(0))
+        if isinstance(argument, exp.Distinct):
+            # Distinct values of dimensions are the same in the rollup as in the source
+            if isinstance(node, exp.Count) and self._only_dimensions(argument):
+                return node
+            return None
+        if not isinstance(node, (exp.Sum, exp.Count, exp.Avg, exp.Min, exp.Max)) or argument is None:
+            return None
+        if isinstance(node, (exp.Min, exp.Max)) and self._only_dimensions(argument):
+            return node
+        i = self.rollup.measures.get(resolve_columns(argument, self.aliases, self.default_table))
+        if i is None:
+            return None
+        if isinstance(node, exp.Sum):
+            return exp.func("SUM", self._stored(f"m{i}_sum"))
+        if isinstance(node, exp.Count):
+            return exp.func("COALESCE", exp.func("SUM", self._stored(f"m{i}_count")), exp.Literal.number(0))
+        if isinstance(node, exp.Avg):
+            # Written for SQLite, the division is made a float one
+            return exp.Div(this=exp.func("SUM", self._stored(f"m{i}_sum")), expression=exp.func("SUM", self._stored(f"m{i}_count")))
+        if isinstance(node, exp.Min):
+            return exp.func("MIN", self._stored(f"m{i}_min"))
+        return exp.func("MAX", self._stored(f"m{i}_max"))
+
+    def __call__(self, node: exp.Expression) -> exp.Expression:
+        if self.failed:
+            return node
+        if isinstance(node, exp.AggFunc):
+            rewritten = self._aggregate(node)
+            if rewritten is None:
+                self.failed = True
+                return node
+            return rewritten
+        if isinstance(node, exp.Star):
+            self.failed = True
+        elif isinstance(node, exp.TimeToStr):
+            fmt = node.args.get("format")
+            if not (isinstance(fmt, exp.Literal) and fmt.is_string and _EXACT_FORMAT_RE.fullmatch(fmt.this)):
+                self.failed = True
+        elif isinstance(node, exp.Column):
+            table = self._table_of(node)
+            if not node.table and node.name.lower() in self.output_names and self._dimension(node) is None:
+                # ORDER BY / HAVING on a result column's alias
+                return node
+            if table is None:
+                self.failed = True
+            elif table in self.rollup.tables:
+                dimension = self._dimension(node)
+                if dimension is None:
+                    self.failed = True
+                    return node
+                return dimension
+        return node
+
+
+def _rewrite_with(select: exp.Select, rollup: RollupDefinition, sources: List[Tuple[exp.Table, Optional[exp.Join]]],
+                  aliases: Dict[str, str], dimension_tables: Collection[str]) -> Optional[exp.Select]:
+    fact = [(table, join) for table, join in sources if table.name.lower() in rollup.tables]
+    if len(fact) != len(rollup.tables) or {table.name.lower() for table, _ in fact} != rollup.tables:
+        return None
+    if any(table.name.lower() not in dimension_tables for table, _ in sources if table.name.lower() not in rollup.tables):
+        return None
+    default_table = sources[0][0].name.lower() if len(sources) == 1 else None
+
+    # Outer joins are only safe when the rollup is the preserved side: a NULL-extended rollup row has no row count
+    fact_first = sources[0][0].name.lower() in rollup.tables
+    for table, join in sources[1:]:
+        if table.name.lower() in rollup.tables:
+            if not _is_inner(join):
+                return None
+        elif not (_is_inner(join) or (fact_first and join.args.get("side") == "LEFT")):
+            return None
+
+    # The fact tables collapse into the rollup table, which takes the place of the first of them;
+    # the joins between them must be exactly the rollup's own
+    first_table = fact[0][0]
+    fact_join_keys = set()
+    for table, join in fact[1:]:
+        keys = equality_keys(join.args.get("on"), aliases, default_table)
+        if keys is None:
+            return None
+        fact_join_keys |= keys
+    if fact_join_keys != rollup.join_keys:
+        return None
+
+    output_names = {e.alias.lower() for e in select.expressions if isinstance(e, exp.Alias)}
+    rewriter = _Rewriter(rollup, aliases, default_table, first_table.alias_or_name, output_names)
+    removed = {id(join) for _, join in fact[1:]}
+    rewritten = select.copy()
+    rewritten.set("joins", [
+        join for original, join in zip(select.args.get("joins") or [], rewritten.args.get("joins") or [])
+        if id(original) not in removed
+    ] or None)
+    # Result columns keep the names MySQL would give them rather than the rewritten expression's
+    rewritten.set("expressions", [
+        e if isinstance(e, (exp.Alias, exp.Column)) else exp.alias_(e, e.sql(dialect="mysql"), quoted=True)
+        for e in rewritten.expressions
+    ])
+    rewritten = rewritten.transform(rewriter)
+    if rewriter.failed:
+        return None
+
+    for table in rewritten.find_all(exp.Table):
+        if table.name.lower() == first_table.name.lower():
+            table.replace(exp.Table(this=exp.to_identifier(rollup.table), alias=exp.TableAlias(this=exp.to_identifier(rewriter.alias))))
+        else:
+            # The rollup store has no databases: dimension copies are addressed by name alone
+            table.set("db", None)
+    return rewritten
+
+
+def rewrite_for_rollup(ast: exp.Expression, rollups: List[RollupDefinition],
+                       dimension_tables: Collection[str]) -> Optional[Tuple[RollupDefinition, exp.Select]]:
+    """
+    Rewrite a validated SELECT to read one of the rollups instead of the
+    source tables, or return None if no rollup gives the same answer. Only
+    flat aggregate queries qualify: one SELECT without subqueries, CTEs,
+    unions or window functions, grouping, filtering and joining only on the
+    rollup's dimensions and on tables copied into the store, with SUM,
+    COUNT, AVG, MIN and MAX of measured expressions (and MIN, MAX or
+    COUNT(DISTINCT) of dimensions). Columns must be qualified when the query
+    reads more than one table.
+    """
+    if not isinstance(ast, exp.Select) or ast.args.get("with") or not _is_aggregate(ast):
+        return None
+    if any(node is not ast for node in ast.find_all(exp.Select)) or ast.find(exp.Window, exp.Subquery):
+        return None
+    sources = _sources(ast)
+    if sources is None:
+        return None
+    aliases = {table.alias_or_name.lower(): table.name.lower() for table, _ in sources}
+    if len(aliases) != len(sources) or len({table.name.lower() for table, _ in sources}) != len(sources):
+        # Self-joins and reused aliases
+        return None
+    for rollup in rollups:
+        rewritten = _rewrite_with(ast, rollup, sources, aliases, dimension_tables)
+        if rewritten is not None:
+            return rollup, rewritten
+    return None
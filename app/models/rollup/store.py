@@ -0,0 +1,543 @@
+import asyncio
+import calendar
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlglot import exp
+from app.config.settings import settings
+from app.models.query.query_executor import apply_row_limit, execute_scan
+from app.models.query.result_cache import MISS
+from app.models.rollup.definitions import RollupDefinition, build_definitions
+from app.models.rollup.rewriter import rewrite_for_rollup
+from app.services.safety_service import ValidatedQuery
+from app.services.schema_registry import schema_registry
+from app.utils.concurrency import run_blocking
+from app.utils.logger import app_logger
+from app.utils.metrics import ROLLUP_QUERIES
+from app.utils.time_utils import current_date
+
+STATE_TABLE = "rollup_state"
+
+# Marks a statement the rewriter has already turned down in the rewrite cache
+_NO_ROLLUP = object()
+
+
+def _date_part(fmt: str):
+    def extract(value):
+        if value is None:
+            return None
+        return int(datetime.date.fromisoformat(str(value)[:10]).strftime(fmt))
+    return extract
+
+
+def _time_to_str(value, fmt):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(str(value)).strftime(fmt)
+
+
+def _to_sqlite(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _as_date(value: Any) -> Optional[datetime.date]:
+    if value is None:
+        return None
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _column_types(keys: List[str], rows: List[tuple]) -> List[str]:
+    """
+    SQLite type per column, from the first non-NULL value: with a declared
+    type, comparisons against literals coerce the way MySQL's do
+    """
+    types = []
+    for i in range(len(keys)):
+        value = next((row[i] for row in rows if row[i] is not None), None)
+        if isinstance(value, int):
+            types.append("INTEGER")
+        elif isinstance(value, float):
+            types.append("REAL")
+        elif isinstance(value, str):
+            types.append("TEXT")
+        else:
+            types.append("")
+    return types
+
+
+def _shift(day: datetime.date, amount: int, unit: str) -> Optional[datetime.date]:
+    if unit in ("DAY", "WEEK"):
+        return day + datetime.timedelta(days=amount * (7 if unit == "WEEK" else 1))
+    if unit in ("MONTH", "QUARTER", "YEAR"):
+        months = day.year * 12 + day.month - 1 + amount * {"MONTH": 1, "QUARTER": 3, "YEAR": 12}[unit]
+        year, month = divmod(months, 12)
+        # MySQL clamps to the end of shorter months
+        return datetime.date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+    return None
+
+
+def _date_literal(node: Optional[exp.Expression]) -> Optional[datetime.date]:
+    if isinstance(node, exp.Literal) and node.is_string:
+        try:
+            return datetime.date.fromisoformat(node.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _fold_dates(ast: exp.Expression, today: datetime.date) -> exp.Expression:
+    """
+    Replace CURDATE() and date arithmetic on dates with the resulting date
+    literals: SQLite has neither, and rollup dates are stored as ISO text
+    """
+    def today_literal(node):
+        if isinstance(node, exp.CurrentDate) or (isinstance(node, exp.Anonymous) and node.name.upper() == "CURDATE"):
+            return exp.Literal.string(today.isoformat())
+        return node
+
+    def arithmetic(node):
+        if isinstance(node, (exp.DateAdd, exp.DateSub)):
+            amount, unit = node.expression, node.args.get("unit")
+        elif isinstance(node, (exp.Add, exp.Sub)) and isinstance(node.expression, exp.Interval):
+            amount, unit = node.expression.this, node.expression.args.get("unit")
+        else:
+            return node
+        day = _date_literal(node.this)
+        if day is None or not isinstance(amount, exp.Literal) or unit is None:
+            return node
+        try:
+            amount = int(amount.this)
+        except ValueError:
+            return node
+        if isinstance(node, (exp.DateSub, exp.Sub)):
+            amount = -amount
+        shifted = _shift(day, amount, unit.name.upper())
+        return exp.Literal.string(shifted.isoformat()) if shifted is not None else node
+
+    return ast.transform(today_literal).transform(arithmetic)
+
+
+class RollupQuery:
+    """
+    A validated query rewritten to read a rollup
+    """
+    def __init__(self, rollup: RollupDefinition, ast: exp.Expression):
+        self.rollup = rollup
+        self.ast = ast
+
+
+class RollupStore:
+    """
+    Pre-aggregated copies of the busiest aggregates, kept in a local SQLite
+    file and served in place of MySQL.
+
+    Each rollup is built in full the first time, when its definition
+    changes and every `rebuild_interval` seconds, reading the source
+    `chunk_days` days at a time. In between, every `refresh_interval`
+    seconds, it is refreshed from its high-water marks: the buckets of the
+    last `lookback_days` days before the newest date are recomputed, and
+    rows with a key above the last one seen but an older date (late
+    inserts) are added as extra buckets. Updates and deletes of older rows
+    only show up at the next full build, so a rollup whose source is not
+    insert-only is served only while its last full build is under
+    `rebuild_interval + max_staleness` seconds old. Small dimension tables are copied whole
+    so rewritten queries can join them. Before each refresh, rollups and
+    dimension tables are checked against the schema snapshot: any that read
+    a table or column the database doesn't have are skipped (and reported
+    once) until the schema has it.
+
+    A query is answered from a rollup only if the rewriter can prove the
+    result is the same as of the last refresh, and the rollup is fresh: refreshed
+    within `max_staleness` seconds and, as above, rebuilt recently enough.
+    Otherwise, or if reading it fails, it goes to MySQL.
+    """
+    def __init__(self, path: str, definitions: List[RollupDefinition], dimension_tables: List[str],
+                 refresh_interval: float, lookback_days: int, rebuild_interval: float, max_staleness: float,
+                 cache_size: int = 1024):
+        self.path = path
+        self.definitions = {definition.name: definition for definition in definitions}
+        self.dimension_tables = [table.lower() for table in dimension_tables]
+        self.refresh_interval = refresh_interval
+        self.lookback_days = lookback_days
+        self.rebuild_interval = rebuild_interval
+        self.max_staleness = max_staleness
+        self.cache_size = cache_size
+        self._rewrites: "OrderedDict[str, Any]" = OrderedDict()
+        # rewrite() runs in pool threads and _remember() also on the event loop
+        self._rewrites_lock = threading.Lock()
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        # Tables copied into the store, and when each rollup was last refreshed and built in full (wall clock)
+        self._dimensions_ready: frozenset = frozenset()
+        self._refreshed: Dict[str, float] = {}
+        self._built: Dict[str, float] = {}
+        # Rollups the schema allows, and why the others are skipped
+        self._usable: List[RollupDefinition] = list(self.definitions.values())
+        self._schema_problems: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # MySQL functions dashboards group by that SQLite lacks
+        conn.create_function("YEAR", 1, _date_part("%Y"), deterministic=True)
+        conn.create_function("MONTH", 1, _date_part("%m"), deterministic=True)
+        conn.create_function("DAY", 1, _date_part("%d"), deterministic=True)
+        conn.create_function("TIME_TO_STR", 2, _time_to_str, deterministic=True)
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        # One per pool thread; WAL lets them read while the refresher writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, work, *args):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+                self._writer.execute(
+                    f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (name TEXT PRIMARY KEY, fingerprint TEXT, "
+                    "key_hwm, date_hwm TEXT, refreshed_at REAL, built_at REAL)"
+                )
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn, *args)
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _state(self, conn: sqlite3.Connection, name: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            f"SELECT fingerprint, key_hwm, date_hwm, refreshed_at, built_at FROM {STATE_TABLE} WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("fingerprint", "key_hwm", "date_hwm", "refreshed_at", "built_at"), row))
+
+    def _save_state(self, conn: sqlite3.Connection, rollup: RollupDefinition, key_hwm: Any, date_hwm: Any,
+                    built_at: float):
+        conn.execute(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (rollup.name, rollup.fingerprint, _to_sqlite(key_hwm), _to_sqlite(date_hwm), time.time(), built_at)
+        )
+
+    def _replace_table(self, conn: sqlite3.Connection, table: str, keys: List[str], rows: List[tuple],
+                       index: Optional[str] = None):
+        # Built under a temporary name and swapped in, all in the caller's transaction
+        building = f"{table}__build"
+        types = _column_types(keys, rows)
+        conn.execute(f"DROP TABLE IF EXISTS {building}")
+        conn.execute(f"CREATE TABLE {building} ({', '.join(f'{k} {t}'.strip() for k, t in zip(keys, types))})")
+        conn.executemany(f"INSERT INTO {building} VALUES ({', '.join('?' * len(keys))})", rows)
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"ALTER TABLE {building} RENAME TO {table}")
+        if index is not None:
+            conn.execute(f"CREATE INDEX {table}_{index} ON {table} ({index})")
+
+    async def _source(self, sql: str, limit: int) -> List[tuple]:
+        # Rollup reads are long scans: they queue with the other slow statements
+        keys, data = await execute_scan(sql, settings.ROLLUP_REFRESH_TIMEOUT, limit + 1)
+        if len(data) > limit:
+            raise RuntimeError(f"more than {limit} rows from: {sql[:100]}...")
+        return [tuple(_to_sqlite(row[key]) for key in keys) for row in data]
+
+    def _report(self, name: str, problem: Optional[str]):
+        # Logged when the problem first appears or changes, not on every refresh
+        if problem != self._schema_problems.get(name):
+            if problem is not None:
+                app_logger.warning("Rollup store skips %s: %s", name, problem)
+            else:
+                app_logger.info("Rollup store resumes %s: it matches the schema again", name)
+        if problem is not None:
+            self._schema_problems[name] = problem
+        else:
+            self._schema_problems.pop(name, None)
+
+    def _check_schema(self, snapshot) -> Tuple[List[RollupDefinition], List[str]]:
+        """
+        The rollups and dimension tables whose tables and columns all exist in the schema snapshot
+        """
+        schema = {
+            snippet["table_name"].lower(): {column["name"].lower() for column in snippet.get("columns") or []}
+            for snippet in snapshot.snippets
+        }
+        rollups = []
+        for rollup in self.definitions.values():
+            missing = sorted({
+                table if table not in schema else f"{table}.{column}"
+                for table, column in rollup.source_columns
+                # Snapshots without column metadata can only vouch for the table
+                if table not in schema or (schema[table] and column not in schema[table])
+            })
+            self._report(f"rollup {rollup.name}", f"{', '.join(missing)} not in the schema" if missing else None)
+            if not missing:
+                rollups.append(rollup)
+        tables = []
+        for table in self.dimension_tables:
+            self._report(f"dimension table {table}", None if table in schema else "not in the schema")
+            if table in schema:
+                tables.append(table)
+        return rollups, tables
+
+    async def _refresh_dimensions(self, tables: List[str]) -> bool:
+        ready = set()
+        for table in tables:
+            try:
+                keys, data = await execute_scan(
+                    f"SELECT * FROM {table}", settings.ROLLUP_REFRESH_TIMEOUT, settings.ROLLUP_DIMENSION_MAX_ROWS + 1
+                )
+                if len(data) > settings.ROLLUP_DIMENSION_MAX_ROWS:
+                    raise RuntimeError(f"over {settings.ROLLUP_DIMENSION_MAX_ROWS} rows")
+                rows = [tuple(_to_sqlite(row[key]) for key in keys) for row in data]
+                await run_blocking(self._write, self._replace_table, table, [k.lower() for k in keys], rows)
+                ready.add(table)
+            except Exception as e:
+                app_logger.error("Could not copy %s into the rollup store: %s", table, e)
+                if table in self._dimensions_ready:
+                    # The previous copy is still there
+                    ready.add(table)
+        changed = frozenset(ready) != self._dimensions_ready
+        self._dimensions_ready = frozenset(ready)
+        return changed
+
+    async def _build(self, rollup: RollupDefinition, bounds: Dict[str, Any]):
+        rows: List[tuple] = []
+        condition = f"{rollup.key_column} <= {bounds['max_key']}" if bounds["max_key"] is not None else "1 = 0"
+        if bounds["min_date"] is not None:
+            start, end = _as_date(bounds["min_date"]), _as_date(bounds["max_date"])
+            while start <= end:
+                stop = start + datetime.timedelta(days=settings.ROLLUP_CHUNK_DAYS)
+                rows += await self._source(rollup.aggregate_sql(
+                    f"{condition} AND {rollup.date_column} >= '{start}' AND {rollup.date_column} < '{stop}'"
+                ), settings.ROLLUP_CHUNK_MAX_ROWS)
+                start = stop
+        rows += await self._source(
+            rollup.aggregate_sql(f"{condition} AND {rollup.date_column} IS NULL"), settings.ROLLUP_CHUNK_MAX_ROWS
+        )
+
+        def swap(conn):
+            self._replace_table(conn, rollup.table, rollup.columns, rows, rollup.date_dimension)
+            self._save_state(conn, rollup, bounds["max_key"], bounds["max_date"], time.time())
+
+        await run_blocking(self._write, swap)
+        self._built[rollup.name] = time.time()
+        app_logger.info("Rollup %s built: %s rows", rollup.name, len(rows))
+
+    async def _increment(self, rollup: RollupDefinition, state: Dict[str, Any], bounds: Dict[str, Any]):
+        date_hwm = _as_date(state["date_hwm"]) or _as_date(bounds["min_date"])
+        if bounds["max_key"] is None or date_hwm is None:
+            await self._build(rollup, bounds)
+            return
+        since = date_hwm - datetime.timedelta(days=self.lookback_days)
+        upper = f"{rollup.key_column} <= {bounds['max_key']}"
+        recent = await self._source(
+            rollup.aggregate_sql(f"{upper} AND {rollup.date_column} >= '{since}'"), settings.ROLLUP_CHUNK_MAX_ROWS
+        )
+        late = []
+        if state["key_hwm"] is not None:
+            # Added since the last refresh but dated before the window: kept as extra partial buckets
+            late = await self._source(rollup.aggregate_sql(
+                f"{upper} AND {rollup.key_column} > {state['key_hwm']} "
+                f"AND ({rollup.date_column} < '{since}' OR {rollup.date_column} IS NULL)"
+            ), settings.ROLLUP_CHUNK_MAX_ROWS)
+        placeholders = ", ".join("?" * len(rollup.columns))
+
+        def apply(conn):
+            conn.execute(f"DELETE FROM {rollup.table} WHERE {rollup.date_dimension} >= ?", (since.isoformat(),))
+            conn.executemany(f"INSERT INTO {rollup.table} VALUES ({placeholders})", recent + late)
+            newest = max(filter(None, (_as_date(bounds["max_date"]), date_hwm)))
+            self._save_state(conn, rollup, bounds["max_key"], newest, state["built_at"])
+
+        await run_blocking(self._write, apply)
+        app_logger.info(
+            "Rollup %s refreshed since %s: %s recent and %s late buckets", rollup.name, since, len(recent), len(late)
+        )
+
+    async def _bounds(self, rollup: RollupDefinition) -> Tuple[List[str], List[Dict[str, Any]]]:
+        return await execute_scan(rollup.bounds_sql(), settings.ROLLUP_REFRESH_TIMEOUT, 1)
+
+    async def refresh_rollup(self, rollup: RollupDefinition):
+        keys, data = await self._bounds(rollup)
+        bounds = dict(zip(("max_key", "min_date", "max_date"), (_to_sqlite(data[0][key]) for key in keys)))
+        state = await run_blocking(self._write, self._state, rollup.name)
+        if (state is None or state["fingerprint"] != rollup.fingerprint
+                or time.time() - (state["built_at"] or 0) > self.rebuild_interval):
+            await self._build(rollup, bounds)
+        else:
+            await self._increment(rollup, state, bounds)
+        self._refreshed[rollup.name] = time.time()
+
+    async def refresh(self):
+        """
+        Copy the dimension tables and bring every rollup up to date; a rollup
+        that fails keeps its previous contents until it goes stale
+        """
+        try:
+            snapshot = await schema_registry.get_snapshot_async()
+        except Exception as e:
+            app_logger.error("Rollup refresh skipped, the schema is unavailable: %s", e)
+            return
+        rollups, tables = self._check_schema(snapshot)
+        usable_changed = [r.name for r in rollups] != [r.name for r in self._usable]
+        self._usable = rollups
+        if await self._refresh_dimensions(tables) or usable_changed:
+            with self._rewrites_lock:
+                self._rewrites.clear()
+        for rollup in rollups:
+            started = time.perf_counter()
+            try:
+                await self.refresh_rollup(rollup)
+            except Exception as e:
+                app_logger.error("Refreshing rollup %s failed: %s", rollup.name, e)
+            else:
+                app_logger.info("Rollup %s up to date in %.1f ms", rollup.name, (time.perf_counter() - started) * 1000)
+
+    async def load(self):
+        """
+        Pick up rollups left by a previous run, so they serve before the first refresh
+        """
+        def read(conn):
+            states = {name: self._state(conn, name) for name in self.definitions}
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            return states, tables
+
+        states, tables = await run_blocking(self._write, read)
+        for name, state in states.items():
+            if state is not None and state["fingerprint"] == self.definitions[name].fingerprint:
+                self._refreshed[name] = state["refreshed_at"]
+                self._built[name] = state["built_at"]
+        self._dimensions_ready = frozenset(tables.intersection(self.dimension_tables))
+
+    async def _run(self):
+        try:
+            await self.load()
+        except Exception as e:
+            app_logger.error("Could not open the rollup store: %s", e)
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+        app_logger.info("Rollup refresher started (interval %ss)", self.refresh_interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def rewrite(self, query: ValidatedQuery) -> Optional[RollupQuery]:
+        """
+        The query rewritten to read a rollup, or None. Decisions are cached per statement.
+        """
+        key = query.canonical_sql
+        with self._rewrites_lock:
+            cached = self._rewrites.get(key)
+            if cached is not None:
+                self._rewrites.move_to_end(key)
+                self.hits += 1
+                return None if cached is _NO_ROLLUP else cached
+            self.misses += 1
+        # Rewritten outside the lock; a concurrent miss on the same statement just computes it twice
+        result = rewrite_for_rollup(query.ast, self._usable, self._dimensions_ready)
+        rewritten = RollupQuery(*result) if result is not None else None
+        self._remember(key, rewritten)
+        return rewritten
+
+    def _remember(self, key: str, rewritten: Optional[RollupQuery]):
+        if self.cache_size <= 0:
+            return
+        with self._rewrites_lock:
+            self._rewrites[key] = rewritten if rewritten is not None else _NO_ROLLUP
+            self._rewrites.move_to_end(key)
+            while len(self._rewrites) > self.cache_size:
+                self._rewrites.popitem(last=False)
+
+    def _read(self, sql: str, limit: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+        cursor = self._reader().execute(sql)
+        rows = cursor.fetchmany(limit)
+        keys = [d[0] for d in cursor.description]
+        # SQLite sums in binary floating point; round off the noise
+        return keys, [dict(zip(keys, (round(v, 6) if isinstance(v, float) else v for v in row))) for row in rows]
+
+    async def execute(self, query: RollupQuery, limit: int = 100, key: Optional[str] = None):
+        """
+        Run a rewritten query on the store. Returns the result in the shape
+        execute_query does, or MISS when the rollup is stale or reading it
+        failed (the statement `key` is then no longer rewritten).
+        """
+        name = query.rollup.name
+        if not self.is_fresh(query.rollup):
+            ROLLUP_QUERIES.labels(rollup=name, result="stale").inc()
+            return MISS
+        try:
+            ast = apply_row_limit(query.ast, limit)
+            sql = _fold_dates(ast, current_date()).sql(dialect="sqlite")
+            keys, data = await run_blocking(self._read, sql, limit)
+        except Exception as e:
+            app_logger.warning("Rollup %s could not answer the query, using MySQL: %s", name, e)
+            ROLLUP_QUERIES.labels(rollup=name, result="error").inc()
+            if key is not None:
+                self._remember(key, None)
+            return MISS
+        ROLLUP_QUERIES.labels(rollup=name, result="hit").inc()
+        app_logger.info("Query answered from rollup %s, returned %s rows", name, len(data))
+        if len(data) == 1 and len(keys) == 1:
+            return data[0][keys[0]]
+        return data
+
+    def is_fresh(self, rollup: RollupDefinition) -> bool:
+        now = time.time()
+        refreshed, built = self._refreshed.get(rollup.name), self._built.get(rollup.name)
+        if refreshed is None or now - refreshed > self.max_staleness:
+            return False
+        # Incremental refreshes miss changes to older rows: only a recent full build vouches for them
+        return rollup.insert_only or (built is not None and now - built <= self.rebuild_interval + self.max_staleness)
+
+    def ages(self) -> Dict[str, float]:
+        now = time.time()
+        return {name: round(now - refreshed, 1) for name, refreshed in self._refreshed.items()}
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._rewrites)}
+
+
+rollup_store = RollupStore(
+    settings.ROLLUP_DB_PATH,
+    build_definitions(settings.ROLLUP_DEFINITIONS),
+    settings.ROLLUP_DIMENSION_TABLES,
+    settings.ROLLUP_REFRESH_INTERVAL,
+    settings.ROLLUP_LOOKBACK_DAYS,
+    settings.ROLLUP_REBUILD_INTERVAL,
+    settings.ROLLUP_MAX_STALENESS
+)
@@ -3,10 +3,15 @@ from app.models.database.connection import engine
 from app.config.settings import settings
 from app.utils.logger import app_logger
 
+def _table_placeholders():
+    return ", ".join([f"'{t}'" for t in settings.ALLOWED_TABLES])
+
 def fetch_schema():
     app_logger.info("Fetching database schema...")
     schema_info = {}
-    table_placeholders = ", ".join([f"'{t}'" for t in settings.ALLOWED_TABLES])
+    # Structured column metadata (name, type, nullability, comment, PK/FK) kept alongside the text
+    column_meta = {}
+    table_placeholders = _table_placeholders()
     query = text(f"""
         SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_COMMENT, IS_NULLABLE
         FROM INFORMATION_SCHEMA.COLUMNS
@@ -26,9 +31,18 @@ def fetch_schema():
                 
                 if table not in schema_info:
                     schema_info[table] = []
+                    column_meta[table] = []
                 
                 col_info = f"{col} ({dtype}, {'nullable' if nullable == 'YES' else 'not null'}) {comment}".strip()
                 schema_info[table].append(col_info)
+                column_meta[table].append({
+                    "name": col,
+                    "type": dtype,
+                    "nullable": nullable == "YES",
+                    "comment": comment,
+                    "primary_key": False,
+                    "references": None
+                })
                 
         # Also fetch primary and foreign key information
         pk_query = text(f"""
@@ -36,7 +50,9 @@ def fetch_schema():
                 k.TABLE_NAME,
                 k.COLUMN_NAME,
                 k.CONSTRAINT_NAME,
-                t.CONSTRAINT_TYPE
+                t.CONSTRAINT_TYPE,
+                k.REFERENCED_TABLE_NAME,
+                k.REFERENCED_COLUMN_NAME
             FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
             JOIN INFORMATION_SCHEMA.TABLE_CONSTRAINTS t
                 ON k.CONSTRAINT_NAME = t.CONSTRAINT_NAME
@@ -54,8 +70,17 @@ def fetch_schema():
                 col = row[1]
                 constraint_name = row[2]
                 constraint_type = row[3]
+                referenced_table = row[4]
+                referenced_column = row[5]
                 
                 if table in schema_info:
+                    for meta in column_meta[table]:
+                        if meta["name"] == col:
+                            if constraint_type == "PRIMARY KEY":
+                                meta["primary_key"] = True
+                            elif referenced_table:
+                                meta["references"] = f"{referenced_table}.{referenced_column}"
+
                     # Add PK/FK information to the appropriate column
                     for i, col_info in enumerate(schema_info[table]):
                         if col_info.startswith(f"{col} "):
@@ -73,13 +98,42 @@ def fetch_schema():
             snippet = f"Table: {table}\n\nAll Column Names:\n{column_list}\n\nDetailed Column Information:\n{detailed_info}\n"
             snippets.append({
                 "table_name": table,
-                "content": snippet
+                "content": snippet,
+                "columns": column_meta[table]
             })
         
-        app_logger.info(f"Schema fetched successfully for {len(snippets)} tables")
+        app_logger.info("Schema fetched successfully for %s tables", len(snippets))
         return snippets
     except Exception as e:
-        app_logger.error(f"Error fetching schema: {str(e)}")
+        app_logger.error("Error fetching schema: %s", e)
+        raise
+
+def fetch_schema_signature():
+    """
+    Cheap DDL drift probe: column count, a checksum over the column definitions
+    and the latest table create time for the allowed tables
+    """
+    table_placeholders = _table_placeholders()
+    query = text(f"""
+        SELECT
+            COUNT(*),
+            COALESCE(SUM(CRC32(CONCAT_WS('|', c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE,
+                                         c.IS_NULLABLE, c.COLUMN_KEY, c.COLUMN_COMMENT))), 0),
+            (
+                SELECT MAX(t.CREATE_TIME)
+                FROM INFORMATION_SCHEMA.TABLES t
+                WHERE t.TABLE_SCHEMA = :db_name AND t.TABLE_NAME IN ({table_placeholders})
+            )
+        FROM INFORMATION_SCHEMA.COLUMNS c
+        WHERE c.TABLE_SCHEMA = :db_name AND c.TABLE_NAME IN ({table_placeholders})
+    """)
+
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(query, {"db_name": settings.DB_NAME}).fetchone()
+        return f"{row[0]}:{row[1]}:{row[2]}"
+    except Exception as e:
+        app_logger.error("Error fetching schema signature: %s", e)
         raise
 
 if __name__ == "__main__":
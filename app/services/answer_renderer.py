@@ -0,0 +1,439 @@
+import calendar
+import datetime
+import re
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from sqlglot import exp
+
+from app.config.settings import settings
+from app.services.result_digest import format_value, is_currency_expression, money_aliases
+from app.services.safety_service import validate_query
+from app.services.schema_registry import schema_registry
+from app.utils.time_utils import current_date
+
+DATE_TYPES = {"date", "datetime", "timestamp"}
+
+# Largest top-N list and time series rendered locally; anything longer goes to the LLM
+MAX_TEMPLATE_ROWS = 36
+
+# Questions that want explanation or comparison rather than a figure
+_PROSE_RE = re.compile(
+    r"\b(why|how come|compare|compared|comparison|versus|vs|explain|insights?|analy[sz]e|analysis|"
+    r"recommend|suggest|should|growth|grow|increase|decrease|decline|change|difference|percent|percentage|share)\b",
+    re.IGNORECASE
+)
+
+_MONTHS = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+
+# Period phrases echoed back verbatim when the SQL's date filter covers exactly that period. A bare year only
+# counts after a preposition ("sales in 2024"), so "top 2000 clients" or "sku 2024" are not periods.
+_PERIOD_RE = re.compile(
+    r"\b(today|yesterday|(?:this|last|previous|current) (?:week|month|quarter|year|financial year|fy)"
+    r"|(?:last|past|previous) \d+ (?:days|weeks|months|years)"
+    r"|year to date|month to date|ytd|mtd"
+    r"|" + _MONTHS + r"(?:,? \d{4})?"
+    r"|q[1-4](?: fy ?\d{2,4}(?:-\d{2,4})?| \d{4})?"
+    r"|fy ?\d{2,4}(?:-\d{2,4})?"
+    r"|(?:(?<=\bin )|(?<=\bfor )|(?<=\bduring )|(?<=\bof )|(?<=\byear ))(?:19|20)\d{2})\b",
+    re.IGNORECASE
+)
+_MONTH_NAMES = {name.lower()[:3]: i for i, name in enumerate(calendar.month_name) if name}
+
+_AGGREGATE_LABELS = {
+    exp.Sum: "Total",
+    exp.Avg: "Average",
+    exp.Max: "Highest",
+    exp.Min: "Lowest"
+}
+
+# Date functions whose presence in a projection or GROUP BY makes it a time bucket
+_DATE_FUNCS = (
+    exp.Year, exp.Month, exp.Day, exp.Week, exp.WeekOfYear, exp.DayOfWeek,
+    exp.DayOfMonth, exp.DayOfYear, exp.Date, exp.TimeToStr, exp.DateTrunc, exp.TimestampTrunc
+)
+
+
+def _humanize(name: str) -> str:
+    words = name.replace("_", " ").strip()
+    return words[:1].upper() + words[1:]
+
+
+@lru_cache(maxsize=4)
+def _date_columns_of(fingerprint: str) -> FrozenSet[str]:
+    snapshot = schema_registry.get_snapshot()
+    columns = [column for snippet in snapshot.snippets for column in snippet.get("columns") or []]
+    if not columns:
+        # Snapshots without column metadata fall back to the configured date column names
+        return frozenset(settings.COMMON_COLUMN_PATTERNS["date_columns"])
+    return frozenset(column["name"].lower() for column in columns if str(column.get("type", "")).lower() in DATE_TYPES)
+
+
+def _date_columns() -> FrozenSet[str]:
+    """
+    Names of the DATE/DATETIME/TIMESTAMP columns in the current schema
+    """
+    return _date_columns_of(schema_registry.get_snapshot().fingerprint)
+
+
+def _is_date_column(column: exp.Column) -> bool:
+    return column.name.lower() in _date_columns()
+
+
+def _is_date_expression(node: exp.Expression) -> bool:
+    if isinstance(node, exp.Alias):
+        node = node.this
+    if isinstance(node, exp.Column):
+        return _is_date_column(node)
+    return isinstance(node, _DATE_FUNCS) and any(_is_date_column(c) for c in node.find_all(exp.Column))
+
+
+def _conjuncts(node: Optional[exp.Expression]) -> List[exp.Expression]:
+    if node is None:
+        return []
+    if isinstance(node, exp.Paren):
+        return _conjuncts(node.this)
+    if isinstance(node, exp.And):
+        return _conjuncts(node.left) + _conjuncts(node.right)
+    return [node]
+
+
+def _entity_values(condition: exp.Expression) -> Optional[List[str]]:
+    """
+    The literal a plain equality, LIKE or IN filter selects on, e.g. "Acme"
+    for company_name = 'Acme', or None if the condition is anything else
+    """
+    if isinstance(condition, (exp.EQ, exp.Like, exp.ILike)):
+        column, value = condition.this, condition.expression
+        if isinstance(column, exp.Lower) or isinstance(column, exp.Upper):
+            column = column.this
+        if isinstance(column, exp.Column) and isinstance(value, exp.Literal) and value.is_string:
+            return [value.this.strip("%")]
+    if isinstance(condition, exp.In) and isinstance(condition.this, exp.Column):
+        values = condition.expressions
+        if values and all(isinstance(v, exp.Literal) and v.is_string for v in values):
+            return [v.this for v in values]
+    return None
+
+
+def _describe_filters(select: exp.Select) -> Optional[Tuple[List[str], List[exp.Expression]]]:
+    """
+    Split the WHERE clause into entity filters (described by their literals)
+    and conditions on date columns. Returns None when any condition is
+    neither, since a template could not state it.
+    """
+    entities, dates = [], []
+    for condition in _conjuncts(select.args.get("where") and select.args["where"].this):
+        if condition.find(exp.Select) is not None:
+            return None
+        if any(_is_date_column(c) for c in condition.find_all(exp.Column)):
+            dates.append(condition)
+            continue
+        values = _entity_values(condition)
+        if values is None:
+            return None
+        entities.extend(values)
+    return entities, dates
+
+
+def _literal_date(node: exp.Expression) -> Optional[datetime.date]:
+    if isinstance(node, exp.Literal) and node.is_string:
+        try:
+            return datetime.date.fromisoformat(node.this[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def _literal_int(node: exp.Expression) -> Optional[int]:
+    if isinstance(node, exp.Literal) and not node.is_string:
+        try:
+            return int(node.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _date_range(conditions: List[exp.Expression]) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """
+    The inclusive range of days the date conditions select, from literal
+    bounds (BETWEEN, comparisons, =) and YEAR()/MONTH() equalities on a
+    single date column. An open upper end runs to today. None when a
+    condition is anything else.
+    """
+    lower, upper = datetime.date.min, current_date()
+    year = month = None
+    columns = set()
+    for condition in conditions:
+        if isinstance(condition, exp.Between) and isinstance(condition.this, exp.Column):
+            start, end = _literal_date(condition.args.get("low")), _literal_date(condition.args.get("high"))
+            if start is None or end is None:
+                return None
+            columns.add(condition.this.name.lower())
+            lower, upper = max(lower, start), min(upper, end)
+            continue
+        if not isinstance(condition, (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE)):
+            return None
+        left, right = condition.this, condition.expression
+        if isinstance(left, (exp.Year, exp.Month)) and isinstance(condition, exp.EQ):
+            column, value = left.find(exp.Column), _literal_int(right)
+            if column is None or value is None:
+                return None
+            columns.add(column.name.lower())
+            if isinstance(left, exp.Year):
+                year = value
+            else:
+                month = value
+            continue
+        day = _literal_date(right)
+        if not isinstance(left, exp.Column) or day is None:
+            return None
+        columns.add(left.name.lower())
+        if isinstance(condition, (exp.EQ, exp.GTE)):
+            lower = max(lower, day)
+        if isinstance(condition, (exp.EQ, exp.LTE)):
+            upper = min(upper, day)
+        if isinstance(condition, exp.GT):
+            lower = max(lower, day + datetime.timedelta(days=1))
+        if isinstance(condition, exp.LT):
+            upper = min(upper, day - datetime.timedelta(days=1))
+    if len(columns) != 1 or (month is not None and year is None):
+        return None
+    if year is not None:
+        if month is not None and not 1 <= month <= 12:
+            return None
+        start = datetime.date(year, month or 1, 1)
+        end = datetime.date(year, month or 12, calendar.monthrange(year, month or 12)[1])
+        lower, upper = max(lower, start), min(upper, end)
+    return lower, upper
+
+
+def _months_back(day: datetime.date, months: int) -> datetime.date:
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return datetime.date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def _period_ranges(period: str, today: datetime.date) -> List[Tuple[datetime.date, datetime.date]]:
+    """
+    The day ranges a period phrase can mean, resolved the way the SQL prompt's
+    date context defines them (weeks run Monday to Sunday; "last 7 days" may
+    or may not include today's partial day). Empty when the phrase is not
+    resolved here (quarters, financial years), which keeps it out of templates.
+    """
+    one = datetime.timedelta(days=1)
+    week_start = today - datetime.timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    phrase = " ".join(period.lower().replace(",", " ").split())
+    if phrase == "today":
+        return [(today, today)]
+    if phrase == "yesterday":
+        return [(today - one, today - one)]
+    if phrase in ("this week", "current week"):
+        return [(week_start, today)]
+    if phrase in ("this month", "current month", "month to date", "mtd"):
+        return [(month_start, today)]
+    if phrase in ("this year", "current year", "year to date", "ytd"):
+        return [(year_start, today)]
+    if phrase in ("last week", "previous week"):
+        return [(week_start - 7 * one, week_start - one)]
+    if phrase in ("last month", "previous month"):
+        start = (month_start - one).replace(day=1)
+        return [(start, month_start - one)]
+    if phrase in ("last year", "previous year"):
+        return [(year_start.replace(year=today.year - 1), year_start - one)]
+    match = re.fullmatch(r"(?:last|past|previous) (\d+) (days|weeks|months|years)", phrase)
+    if match:
+        count, unit = int(match.group(1)), match.group(2)
+        if unit == "days":
+            start = today - count * one
+        elif unit == "weeks":
+            start = today - 7 * count * one
+        else:
+            start = _months_back(today, count * (12 if unit == "years" else 1))
+        return [(start, today), (start + one, today), (start, today - one)]
+    match = re.fullmatch(r"([a-z]+)(?: (\d{4}))?", phrase)
+    if match and match.group(1)[:3] in _MONTH_NAMES:
+        month = _MONTH_NAMES[match.group(1)[:3]]
+        # A month without a year is its latest occurrence
+        year = int(match.group(2)) if match.group(2) else (today.year if month <= today.month else today.year - 1)
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        return [(start, min(end, today))]
+    if re.fullmatch(r"\d{4}", phrase):
+        year = int(phrase)
+        return [(datetime.date(year, 1, 1), min(datetime.date(year, 12, 31), today))]
+    return []
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _projection_names(node: exp.Expression) -> List[str]:
+    """
+    The ways an ORDER BY can refer to a projection: its full text, the bare expression or its alias
+    """
+    names = [node.sql(dialect="mysql"), node.unalias().sql(dialect="mysql")]
+    if node.alias:
+        names.append(exp.column(node.alias).sql(dialect="mysql"))
+    return names
+
+
+def _metric_label(node: exp.Expression) -> str:
+    """
+    Readable name for a projection: its alias, else e.g. "Total total cost" for SUM(total_cost)
+    """
+    if isinstance(node, exp.Alias):
+        return _humanize(node.alias)
+    if isinstance(node, exp.Count):
+        target = node.this
+        if isinstance(target, exp.Distinct):
+            columns = list(target.find_all(exp.Column))
+            return f"Number of distinct {_humanize(columns[0].name).lower()}" if columns else "Number of records"
+        return "Number of records"
+    for agg_type, label in _AGGREGATE_LABELS.items():
+        if isinstance(node, agg_type):
+            column = node.find(exp.Column)
+            if column is None:
+                return label
+            name = _humanize(column.name).lower()
+            # SUM(total_cost) reads "Total cost", not "Total total cost"
+            if name.startswith(label.lower() + " "):
+                return _humanize(name)
+            return f"{label} {name}"
+    if isinstance(node, exp.Column):
+        return _humanize(node.name)
+    return _humanize(node.sql(dialect="mysql"))
+
+
+def _qualifier(entities: List[str], period: Optional[str]) -> str:
+    text = f" for {', '.join(entities)}" if entities else ""
+    if period:
+        text += f" ({period})"
+    return text
+
+
+def _label_value(value: Any) -> str:
+    # Labels are names, ids and periods: no digit grouping
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return format_value(value)
+
+
+def _period_label(row: Dict[str, Any], keys: List[str], projections: Dict[str, exp.Expression]) -> str:
+    if len(keys) == 1 and isinstance(projections[keys[0]].unalias(), exp.Month):
+        value = row.get(keys[0])
+        if isinstance(value, int) and 1 <= value <= 12:
+            return calendar.month_name[value]
+    parts = []
+    for i, key in enumerate(keys):
+        value = row.get(key)
+        # Zero-pad month/day numbers that follow a year: 2024-03
+        if i and isinstance(value, int) and not isinstance(value, bool) and value < 100:
+            parts.append(f"{value:02d}")
+        else:
+            parts.append(_label_value(value))
+    return "-".join(parts)
+
+
+def render_answer(question: str, sql: str, result: Any) -> Optional[str]:
+    """
+    Phrase simple results without an LLM call: a single value, one row, a
+    top-N list or a time series, recognised from the validated SQL AST
+    (aggregates, GROUP BY, ORDER BY/LIMIT and WHERE filters) and the question.
+    Returns None when no template states the result faithfully, in which
+    case the caller falls back to the LLM.
+    """
+    if not settings.ANSWER_TEMPLATES_ENABLED:
+        return None
+    if result is None or result == []:
+        return "No matching records were found."
+    if _PROSE_RE.search(question):
+        return None
+
+    is_safe, _, validated = validate_query(sql)
+    if not is_safe:
+        return None
+    select = validated.ast
+    if select.args.get("with") is not None or select.args.get("having") is not None:
+        return None
+    if any(isinstance(e, exp.Star) for e in select.expressions):
+        return None
+
+    filters = _describe_filters(select)
+    if filters is None:
+        return None
+    entities, date_filters = filters
+    periods = _PERIOD_RE.findall(question)
+    if len(periods) > 1 or bool(periods) != bool(date_filters):
+        return None
+    period = periods[0].lower() if periods else None
+    if period is not None:
+        # Name the period only when the SQL's date range is exactly that period
+        sql_range = _date_range(date_filters)
+        if sql_range is None or sql_range not in _period_ranges(period, current_date()):
+            return None
+    qualifier = _qualifier(entities, period)
+    aliases = money_aliases(select)
+
+    # Scalar: the executor collapsed a one-row, one-column result
+    if not isinstance(result, list):
+        if len(select.expressions) != 1:
+            return None
+        node = select.expressions[0]
+        value = format_value(result, is_currency_expression(node, aliases))
+        return f"{_metric_label(node)}{qualifier}: {value}"
+
+    keys = list(result[0].keys())
+    if len(keys) != len(select.expressions) or len(result) > MAX_TEMPLATE_ROWS:
+        return None
+    projections = dict(zip(keys, select.expressions))
+    measures = [k for k in keys if projections[k].find(exp.AggFunc) is not None]
+    buckets = [k for k in keys if k not in measures and _is_date_expression(projections[k])]
+    labels = [k for k in keys if k not in measures and k not in buckets]
+
+    # Time series: grouped by a date bucket with a single measure
+    group = select.args.get("group")
+    if group is not None and buckets and len(measures) == 1 and not labels:
+        measure = measures[0]
+        currency = is_currency_expression(projections[measure], aliases)
+        bucket_name = _humanize(buckets[0]).lower() if len(buckets) == 1 else "period"
+        lines = [f"{_metric_label(projections[measure])} by {bucket_name}{qualifier}:"]
+        lines.extend(
+            f"- {_period_label(row, buckets, projections)}: {format_value(row.get(measure), currency)}" for row in result
+        )
+        return "\n".join(lines)
+
+    # Top-N: ordered by one numeric column and limited, with labels for each row
+    order = select.args.get("order")
+    if order is not None and select.args.get("limit") is not None and len(keys) >= 2:
+        ordered = order.expressions[0]
+        target = ordered.this.sql(dialect="mysql")
+        measure = next((k for k in keys if target in _projection_names(projections[k])), None)
+        others = [k for k in keys if k != measure]
+        if (measure is not None and all(_is_number(row.get(measure)) for row in result)
+                and not any(k in measures for k in others)):
+            node = projections[measure]
+            currency = is_currency_expression(node, aliases)
+            direction = "Top" if ordered.args.get("desc") else "Bottom"
+            label_name = " / ".join(_humanize(k).lower() for k in others)
+            lines = [f"{direction} {len(result)} {label_name} by {_metric_label(node).lower()}{qualifier}:"]
+            lines.extend(
+                f"{i}. {' / '.join(_label_value(row.get(k)) for k in others)}: {format_value(row.get(measure), currency)}"
+                for i, row in enumerate(result, 1)
+            )
+            return "\n".join(lines)
+
+    # Single row: one line per column
+    if len(result) == 1 and group is None:
+        row = result[0]
+        lines = [f"Result{qualifier}:"]
+        lines.extend(
+            f"- {_metric_label(projections[k])}: {format_value(row.get(k), is_currency_expression(projections[k], aliases))}"
+            for k in keys
+        )
+        return "\n".join(lines)
+
+    return None
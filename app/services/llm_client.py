@@ -0,0 +1,438 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from app.config.settings import settings
+from app.utils.admission import Overloaded, llm_has_capacity, llm_slot
+from app.utils.logger import app_logger
+from app.utils.metrics import LLM_HEDGES, LLM_REQUESTS, record_llm_usage
+
+
+class LLMCompletion:
+    """
+    Backend-neutral result of a chat completion
+    """
+    def __init__(self, content: str, model: str, usage: Optional[Dict[str, int]] = None):
+        self.content = content
+        self.model = model
+        self.usage = usage or {}
+
+
+class LLMRetryableError(Exception):
+    """
+    Transient backend failure (429, 5xx, connection/timeout) worth retrying
+    """
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(headers) -> Optional[float]:
+    if headers is None:
+        return None
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP-date form is not used by the provider; fall back to our own backoff
+        return None
+
+
+class GroqBackend:
+    """
+    Groq chat completions over one pooled keep-alive HTTP client. SDK retries
+    are disabled; LLMClient owns retry policy.
+    """
+    name = "groq"
+
+    def __init__(self):
+        if not settings.GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY is not set in environment variables")
+        # Imported here so the fake backend works without the SDK installed, and startup stays fast
+        import groq
+        import httpx
+        self._groq = groq
+
+        self.timeout = httpx.Timeout(settings.LLM_READ_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+        self.http_client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+        self.client = groq.AsyncGroq(
+            api_key=settings.GROQ_API_KEY,
+            http_client=self.http_client,
+            timeout=self.timeout,
+            max_retries=0
+        )
+
+    async def complete(self, messages: List[Dict[str, str]], model: str, temperature: float) -> LLMCompletion:
+        groq = self._groq
+        try:
+            completion = await self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature
+            )
+        except groq.RateLimitError as e:
+            raise LLMRetryableError(str(e), _parse_retry_after(e.response.headers)) from e
+        except groq.APIStatusError as e:
+            if e.status_code >= 500:
+                raise LLMRetryableError(str(e), _parse_retry_after(e.response.headers)) from e
+            raise
+        except (groq.APIConnectionError, groq.APITimeoutError) as e:
+            raise LLMRetryableError(str(e)) from e
+
+        usage = {}
+        if completion.usage is not None:
+            usage = {
+                "prompt_tokens": completion.usage.prompt_tokens,
+                "completion_tokens": completion.usage.completion_tokens,
+                "total_tokens": completion.usage.total_tokens
+            }
+        return LLMCompletion(completion.choices[0].message.content, completion.model, usage)
+
+    async def stream(self, messages: List[Dict[str, str]], model: str, temperature: float) -> AsyncIterator[str]:
+        groq = self._groq
+        try:
+            chunks = await self.client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                stream=True
+            )
+        except groq.RateLimitError as e:
+            raise LLMRetryableError(str(e), _parse_retry_after(e.response.headers)) from e
+        except groq.APIStatusError as e:
+            if e.status_code >= 500:
+                raise LLMRetryableError(str(e), _parse_retry_after(e.response.headers)) from e
+            raise
+        except (groq.APIConnectionError, groq.APITimeoutError) as e:
+            raise LLMRetryableError(str(e)) from e
+
+        async for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def warm_up(self):
+        # Listing models costs no tokens but opens the pooled TLS connection
+        await self.client.models.list()
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+
+class FakeBackend:
+    """
+    Offline backend. Replies with the first fixture whose key appears in the
+    last user message (case-insensitive), or with `default`.
+    """
+    name = "fake"
+
+    def __init__(self, fixtures: Optional[Dict[str, str]] = None, default: str = "__NEED_CLARIFICATION__"):
+        self.fixtures = fixtures or {}
+        self.default = default
+
+    async def complete(self, messages: List[Dict[str, str]], model: str, temperature: float) -> LLMCompletion:
+        prompt = messages[-1]["content"] if messages else ""
+        lowered = prompt.lower()
+        content = self.default
+        for key, reply in self.fixtures.items():
+            if key.lower() in lowered:
+                content = reply
+                break
+        usage = {
+            "prompt_tokens": sum(len(m["content"]) for m in messages) // 4,
+            "completion_tokens": len(content) // 4
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return LLMCompletion(content, model, usage)
+
+    async def stream(self, messages: List[Dict[str, str]], model: str, temperature: float) -> AsyncIterator[str]:
+        completion = await self.complete(messages, model, temperature)
+        for word in completion.content.split(" "):
+            yield word + " "
+
+    async def aclose(self):
+        pass
+
+
+_BACKENDS: Dict[str, Callable[[], Any]] = {
+    "groq": GroqBackend,
+    "fake": FakeBackend
+}
+
+
+def register_backend(name: str, factory: Callable[[], Any]):
+    """
+    Make a backend selectable through the LLM_BACKEND setting
+    """
+    _BACKENDS[name] = factory
+
+
+class LLMTimeoutError(Exception):
+    """
+    Raised when an LLM call (retries and hedges included) runs past its deadline
+    """
+
+
+class LatencyTracker:
+    """
+    Recent completion latencies per call purpose, for picking hedge delays
+    """
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, purpose: str, seconds: float):
+        samples = self._samples.get(purpose)
+        if samples is None:
+            samples = self._samples[purpose] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, purpose: str, q: float, min_samples: int) -> Optional[float]:
+        samples = self._samples.get(purpose)
+        if samples is None or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class LLMClient:
+    """
+    Shared entry point for all LLM calls: one backend instance per process,
+    configured model, admission through the LLM rate limiter and concurrency
+    gate, and jittered exponential retry on transient errors that honours the
+    provider's retry-after.
+
+    Calls can carry a deadline. With hedging enabled, a completion still
+    pending after the hedge_percentile latency of recent calls for the same
+    purpose gets a duplicate request, and whichever answers first wins.
+    """
+    def __init__(self, backend, model: str, max_retries: int = 3,
+                 retry_base_delay: float = 0.5, retry_max_delay: float = 8.0,
+                 hedge_percentile: Optional[float] = None, hedge_min_delay: float = 0.5,
+                 hedge_min_samples: int = 20, hedge_window: int = 200):
+        self.backend = backend
+        self.model = model
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyTracker(hedge_window)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.retry_max_delay) + random.uniform(0, self.retry_base_delay)
+        # Full jitter
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+
+    def _unavailable(self, e: LLMRetryableError) -> Overloaded:
+        # The provider is still rate limiting or failing: tell the client when to retry instead of a bare 500
+        return Overloaded(f"LLM provider unavailable: {str(e)}", 503, e.retry_after or self.retry_max_delay)
+
+    def _hedge_delay(self, purpose: str) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        threshold = self.latencies.percentile(purpose, self.hedge_percentile, self.hedge_min_samples)
+        if threshold is None:
+            return None
+        return max(threshold, self.hedge_min_delay)
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float = 0.0,
+                       model: Optional[str] = None, timeout: Optional[float] = None,
+                       purpose: str = "default") -> LLMCompletion:
+        """
+        Run a completion, giving up with LLMTimeoutError after `timeout`
+        seconds. `purpose` groups calls with similar latency (e.g. "sql",
+        "response") for hedging.
+        """
+        model = model or self.model
+        if not timeout:
+            return await self._complete_hedged(messages, temperature, model, purpose)
+        try:
+            return await asyncio.wait_for(self._complete_hedged(messages, temperature, model, purpose), timeout)
+        except asyncio.TimeoutError:
+            LLM_REQUESTS.labels(model=model, result="timeout").inc()
+            app_logger.error("LLM %s call exceeded its %ss deadline", purpose, timeout)
+            raise LLMTimeoutError(f"LLM call exceeded its {timeout}s deadline")
+
+    async def _complete_hedged(self, messages: List[Dict[str, str]], temperature: float, model: str,
+                               purpose: str) -> LLMCompletion:
+        started = time.perf_counter()
+        delay = self._hedge_delay(purpose)
+        if delay is None:
+            completion = await self._complete_with_retry(messages, temperature, model)
+            self.latencies.record(purpose, time.perf_counter() - started)
+            return completion
+
+        primary = asyncio.ensure_future(self._complete_with_retry(messages, temperature, model))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done:
+                if llm_has_capacity():
+                    LLM_HEDGES.labels(purpose=purpose, event="sent").inc()
+                    app_logger.info("LLM %s call pending after %.2fs, sending a hedged request", purpose, delay)
+                    hedge = asyncio.ensure_future(self._complete_with_retry(messages, temperature, model))
+                else:
+                    # A hedge would only queue behind the calls it is meant to overtake
+                    LLM_HEDGES.labels(purpose=purpose, event="skipped").inc()
+            pending = {primary} if hedge is None else {primary, hedge}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer a success; if every request has failed, surface the primary's error
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    # Hedged calls record how long the caller waited, which keeps slow tails in the window
+                    self.latencies.record(purpose, time.perf_counter() - started)
+                    if hedge is not None:
+                        LLM_HEDGES.labels(purpose=purpose, event="hedge_won" if winner is hedge else "primary_won").inc()
+                    return winner.result()
+                if not pending:
+                    raise primary.exception()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _complete_with_retry(self, messages: List[Dict[str, str]], temperature: float,
+                                   model: str) -> LLMCompletion:
+        attempt = 0
+        while True:
+            try:
+                async with llm_slot():
+                    completion = await self.backend.complete(messages, model, temperature)
+                LLM_REQUESTS.labels(model=model, result="ok").inc()
+                record_llm_usage(model, completion.usage)
+                return completion
+            except LLMRetryableError as e:
+                if attempt >= self.max_retries:
+                    LLM_REQUESTS.labels(model=model, result="error").inc()
+                    app_logger.error("LLM call failed after %s attempts: %s", attempt + 1, e)
+                    raise self._unavailable(e) from e
+                LLM_REQUESTS.labels(model=model, result="retry").inc()
+                delay = self._backoff(attempt, e.retry_after)
+                app_logger.warning("LLM call failed (%s), retrying in %.2fs", e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float = 0.0,
+                     model: Optional[str] = None, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Yield completion text as it is produced. Transient failures are retried
+        only until the first chunk arrives; after that they propagate. The
+        `timeout` deadline applies to the first chunk. Streams are not hedged.
+        """
+        model = model or self.model
+        chunks = self._stream_with_retry(messages, temperature, model)
+        try:
+            if timeout:
+                try:
+                    first = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    LLM_REQUESTS.labels(model=model, result="timeout").inc()
+                    app_logger.error("LLM stream produced nothing within its %ss deadline", timeout)
+                    raise LLMTimeoutError(f"LLM stream produced nothing within its {timeout}s deadline")
+                yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _stream_with_retry(self, messages: List[Dict[str, str]], temperature: float,
+                                 model: str) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with llm_slot():
+                    async for chunk in self.backend.stream(messages, model, temperature):
+                        started = True
+                        yield chunk
+                LLM_REQUESTS.labels(model=model, result="ok").inc()
+                return
+            except LLMRetryableError as e:
+                if started or attempt >= self.max_retries:
+                    LLM_REQUESTS.labels(model=model, result="error").inc()
+                    app_logger.error("LLM stream failed after %s attempts: %s", attempt + 1, e)
+                    if started:
+                        raise
+                    raise self._unavailable(e) from e
+                LLM_REQUESTS.labels(model=model, result="retry").inc()
+                delay = self._backoff(attempt, e.retry_after)
+                app_logger.warning("LLM stream failed (%s), retrying in %.2fs", e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def warm_up(self):
+        """
+        Open the backend's connection ahead of the first call, for backends that support it
+        """
+        warm_up = getattr(self.backend, "warm_up", None)
+        if warm_up is not None:
+            await warm_up()
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+def build_llm_client(backend) -> LLMClient:
+    """
+    An LLMClient for `backend` configured from settings
+    """
+    return LLMClient(
+        backend,
+        settings.LLM_MODEL,
+        settings.LLM_MAX_RETRIES,
+        settings.LLM_RETRY_BASE_DELAY,
+        settings.LLM_RETRY_MAX_DELAY,
+        settings.LLM_HEDGE_PERCENTILE if settings.LLM_HEDGE_ENABLED else None,
+        settings.LLM_HEDGE_MIN_DELAY,
+        settings.LLM_HEDGE_MIN_SAMPLES,
+        settings.LLM_HEDGE_WINDOW
+    )
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """
+    Return the process-wide LLM client, creating it on first use
+    """
+    global _llm_client
+    if _llm_client is None:
+        if settings.LLM_BACKEND not in _BACKENDS:
+            raise ValueError(f"Unknown LLM backend: {settings.LLM_BACKEND}")
+        _llm_client = build_llm_client(_BACKENDS[settings.LLM_BACKEND]())
+        app_logger.info("LLM client initialised with backend '%s' and model '%s'", settings.LLM_BACKEND, settings.LLM_MODEL)
+    return _llm_client
+
+
+def set_llm_client(client: Optional[LLMClient]):
+    """
+    Replace the process-wide client (e.g. with a FakeBackend for offline runs)
+    """
+    global _llm_client
+    _llm_client = client
+
+
+async def close_llm_client():
+    """
+    Close the process-wide client's connections, if one was created
+    """
+    global _llm_client
+    client, _llm_client = _llm_client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,117 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Union
+
+from app.utils.logger import app_logger
+
+_TABLE_NAME_RE = re.compile(r"^Table:\s*(\S+)")
+
+_encoder = None
+_encoder_loaded = False
+
+
+def _get_encoder():
+    """
+    tiktoken's cl100k_base when installed (an optional dependency; close
+    enough to the Llama tokenizer for budgeting), otherwise None
+    """
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            app_logger.info("tiktoken not available, estimating prompt tokens from text length")
+    return _encoder
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Token count of text with the local tokenizer. Cached, since the system
+    prompt, schema sections and date context repeat across requests.
+    """
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    # About four characters per token for English, identifiers and numbers
+    return (len(text) + 3) // 4
+
+
+def _table_name(section: str) -> str:
+    match = _TABLE_NAME_RE.match(section)
+    return match.group(1) if match else section
+
+
+class CompiledPrompt:
+    """
+    Chat messages ready for the LLM with the token count of each section
+    ("system", "schema", "date", "question" and "total") and the schema
+    tables dropped to fit the budget
+    """
+    def __init__(self, messages: List[Dict[str, str]], token_counts: Dict[str, int], trimmed_tables: List[str]):
+        self.messages = messages
+        self.token_counts = token_counts
+        self.trimmed_tables = trimmed_tables
+
+    @property
+    def total_tokens(self) -> int:
+        return self.token_counts["total"]
+
+    def stats(self) -> Dict[str, object]:
+        stats = dict(self.token_counts)
+        if self.trimmed_tables:
+            stats["trimmed_tables"] = list(self.trimmed_tables)
+        return stats
+
+
+class PromptCompiler:
+    """
+    Assembles the SQL-generation prompt in a fixed layout: the static system
+    prompt, then the schema, the date context and the question. The schema
+    sections kept are emitted sorted by table name, so the same tables always
+    produce the same bytes whatever their rank and the prompt prefix stays
+    cacheable by the provider. When the prompt exceeds token_budget, the
+    lowest-ranked schema sections are dropped first (the best one always stays).
+    """
+    def __init__(self, system_prompt: str, token_budget: int):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.system_tokens = count_tokens(system_prompt)
+
+    def compile(self, question: str, schema_sections: Union[List[str], str], time_context: str,
+                token_budget: Optional[int] = None) -> CompiledPrompt:
+        """
+        schema_sections are ranked most relevant first
+        """
+        if isinstance(schema_sections, str):
+            schema_sections = [schema_sections] if schema_sections else []
+        budget = token_budget or self.token_budget
+
+        date_text = f"DATE CONTEXT:\n{time_context}\n\n"
+        question_text = f"USER QUESTION: {question}"
+        fixed = self.system_tokens + count_tokens(date_text) + count_tokens(question_text) + count_tokens("SCHEMA CONTEXT:\n\n\n")
+
+        kept = list(schema_sections)
+        section_tokens = [count_tokens(s) for s in kept]
+        trimmed = []
+        while len(kept) > 1 and fixed + sum(section_tokens) > budget:
+            trimmed.append(_table_name(kept.pop()))
+            section_tokens.pop()
+        if trimmed:
+            app_logger.warning("Prompt over the %s-token budget, dropped schema for: %s", budget, ', '.join(trimmed))
+
+        schema_text = "SCHEMA CONTEXT:\n" + "\n\n".join(sorted(kept, key=_table_name)) + "\n\n"
+        token_counts = {
+            "system": self.system_tokens,
+            "schema": count_tokens(schema_text),
+            "date": count_tokens(date_text),
+            "question": count_tokens(question_text)
+        }
+        token_counts["total"] = sum(token_counts.values())
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": schema_text + date_text + question_text}
+        ]
+        return CompiledPrompt(messages, token_counts, trimmed)
@@ -1,30 +1,254 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import math
+import re
+from collections import Counter, deque
+from typing import Dict, List, Optional, Set, Tuple
+
 import numpy as np
+from app.config.settings import settings
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "and", "or", "is", "are", "was", "were",
+    "what", "which", "who", "how", "many", "much", "me", "show", "give", "list", "get", "find",
+    "tell", "all", "each", "per", "with", "from", "my", "our", "do", "does", "did", "i", "we"
+}
+
+# Words a question uses for each column category in Settings.COMMON_COLUMN_PATTERNS
+PATTERN_SYNONYMS = {
+    "date_columns": ["date", "time", "when", "day", "week", "month", "year", "quarter", "today", "yesterday", "recent"],
+    "id_columns": ["id", "identifier", "number"],
+    "amount_columns": ["amount", "total", "value", "revenue", "sales", "cost", "price", "spend", "worth"]
+}
+
+
+# A table within this fraction of the best score for some query term counts as a match for it
+TABLE_SCORE_RATIO = 0.8
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens with identifiers split on "_" and camelCase and a
+    light plural strip, so "Customers", "customer" and "customer_id" share terms
+    """
+    text = _CAMEL_RE.sub(" ", text or "").replace("_", " ").lower()
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        # Bare numbers ("top 5") would match numbered columns rather than mean anything
+        if token in STOP_WORDS or token.isdigit():
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 over small token documents, stored as an inverted index of
+    per-term (document ids, weights) arrays so scoring a query only touches
+    the postings of its terms
+    """
+    def __init__(self, documents: List[List[str]], k1: float = 1.2, b: float = 0.75):
+        self.size = len(documents)
+        lengths = np.array([len(d) for d in documents], dtype=float)
+        average = lengths.mean() if self.size and lengths.sum() else 1.0
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        for doc_id, document in enumerate(documents):
+            norm = k1 * (1 - b + b * lengths[doc_id] / average)
+            for term, tf in Counter(document).items():
+                ids, weights = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                weights.append(tf * (k1 + 1) / (tf + norm))
+        self.postings = {}
+        for term, (ids, weights) in postings.items():
+            idf = math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (np.array(ids, dtype=np.int32), np.array(weights) * idf)
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        scores = np.zeros(self.size)
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if posting is not None:
+                np.add.at(scores, posting[0], posting[1])
+        return scores
+
+
+def _table_terms(table: str) -> List[str]:
+    terms = tokenize(table)
+    for alias, mapped in settings.TABLE_MAPPING.items():
+        if mapped == table:
+            terms.extend(tokenize(alias))
+    return terms
+
+
+def _column_terms(column: Dict) -> List[str]:
+    name = column["name"].lower()
+    terms = tokenize(column["name"]) + tokenize(column.get("type") or "") + tokenize(column.get("comment") or "")
+    for group, patterns in settings.COMMON_COLUMN_PATTERNS.items():
+        if any(name == p or name.endswith(p) or (len(p) > 3 and p in name) for p in patterns):
+            terms.extend(tokenize(" ".join(PATTERN_SYNONYMS.get(group, []))))
+    return terms
+
+
+def _describe_column(column: Dict) -> str:
+    details = [column.get("type") or "", "nullable" if column.get("nullable") else "not null"]
+    if column.get("primary_key"):
+        details.append("primary key")
+    if column.get("references"):
+        details.append(f"references {column['references']}")
+    return f"  - {column['name']} ({', '.join(d for d in details if d)}) {column.get('comment') or ''}".rstrip()
+
 
 class SchemaRetriever:
-    def __init__(self, snippets):
+    """
+    Column-level schema retrieval. Each column is a BM25 document built from
+    its name and identifier tokens, type, comment and category synonyms;
+    each table is one built from its name and TABLE_MAPPING aliases. A query
+    picks the best tables, keeps only their relevant columns (top-k by
+    argpartition, topped up to a minimum per table) and adds the PK/FK
+    columns needed to join them, so the prompt no longer carries every
+    column of every retrieved table.
+    """
+    def __init__(self, snippets, top_columns: Optional[int] = None, min_columns_per_table: Optional[int] = None):
         self.snippets = snippets
-        self.vectorizer = TfidfVectorizer(stop_words='english')
         self.corpus = [s['content'] for s in snippets]
-        if self.corpus:
-            self.tfidf_matrix = self.vectorizer.fit_transform(self.corpus)
-        else:
-            self.tfidf_matrix = None
+        self.top_columns = top_columns or settings.RAG_TOP_COLUMNS
+        self.min_columns_per_table = min_columns_per_table or settings.RAG_MIN_COLUMNS_PER_TABLE
+
+        self.tables = [s['table_name'] for s in snippets]
+        self.table_columns = {s['table_name']: s.get('columns') or [] for s in snippets}
+        self.column_refs: List[Tuple[str, int]] = [
+            (table, i) for table in self.tables for i in range(len(self.table_columns[table]))
+        ]
+        self.table_index = BM25Index([_table_terms(t) for t in self.tables])
+        self.column_index = BM25Index([_column_terms(self.table_columns[t][i]) for t, i in self.column_refs])
+        self.column_table = np.array([self.tables.index(t) for t, _ in self.column_refs], dtype=np.int32)
+        self.column_offsets = {}
+        for i, (table, _) in enumerate(self.column_refs):
+            self.column_offsets.setdefault(table, i)
+        self.joins = self._build_joins()
+
+    def _build_joins(self) -> Dict[str, Dict[str, Tuple[str, str]]]:
+        """
+        Adjacency between tables: joins[a][b] = (column of a, column of b), from
+        FK constraints and the declared SCHEMA_JOINS
+        """
+        pairs = []
+        for table, columns in self.table_columns.items():
+            for column in columns:
+                if column.get("references"):
+                    ref_table, _, ref_column = column["references"].partition(".")
+                    pairs.append((table, column["name"], ref_table, ref_column))
+        for left, right in settings.SCHEMA_JOINS:
+            left_table, _, left_column = left.partition(".")
+            right_table, _, right_column = right.partition(".")
+            pairs.append((left_table, left_column, right_table, right_column))
+
+        joins: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        known = set(self.tables)
+        for table, column, ref_table, ref_column in pairs:
+            if table in known and ref_table in known:
+                joins.setdefault(table, {})[ref_table] = (column, ref_column)
+                joins.setdefault(ref_table, {})[table] = (ref_column, column)
+        return joins
+
+    def _connect(self, chosen: List[str]) -> Tuple[List[str], Set[Tuple[str, str]]]:
+        """
+        Add the tables on the shortest join paths between the chosen ones and
+        return them with the (table, column) pairs those joins use
+        """
+        connected = [chosen[0]]
+        key_columns: Set[Tuple[str, str]] = set()
+        for target in chosen[1:]:
+            if target in connected:
+                continue
+            # Breadth-first search from the already connected set to the target
+            previous = {t: None for t in connected}
+            queue = deque(connected)
+            while queue and target not in previous:
+                current = queue.popleft()
+                for neighbour in self.joins.get(current, {}):
+                    if neighbour not in previous:
+                        previous[neighbour] = current
+                        queue.append(neighbour)
+            if target not in previous:
+                connected.append(target)
+                continue
+            node = target
+            while previous[node] is not None:
+                parent = previous[node]
+                parent_column, node_column = self.joins[parent][node]
+                key_columns.update({(parent, parent_column), (node, node_column)})
+                if node not in connected:
+                    connected.append(node)
+                node = parent
+        return connected, key_columns
 
     def retrieve(self, query, k=3):
-        if self.tfidf_matrix is None or not self.corpus:
-            return ""
-        
-        query_vec = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-        top_indices = np.argsort(similarities)[-k:][::-1]
-        
-        selected_snippets = [self.corpus[i] for i in top_indices if similarities[i] > 0]
-        
-        # If no similarity found by TF-IDF, return all (or top k) if small
-        if not selected_snippets:
-            # Fallback to simple keyword check or just return top k
-            return "\n\n".join(self.corpus[:k])
-            
-        return "\n\n".join(selected_snippets)
+        return "\n\n".join(self.retrieve_sections(query, k))
+
+    def retrieve_sections(self, query, k=3) -> List[str]:
+        """
+        The schema context as one section per table, most relevant first
+        """
+        if not self.corpus:
+            return []
+        if not self.column_refs:
+            return self.corpus[:k]
+
+        terms = sorted(set(tokenize(query)))
+        column_scores = np.zeros(len(self.column_refs))
+        ranking = np.zeros(len(self.tables))
+        needed = np.zeros(len(self.tables), dtype=bool)
+        for term in terms:
+            # Per term, a table scores its own name match plus its best-matching column
+            term_columns = self.column_index.scores([term])
+            term_tables = self.table_index.scores([term])
+            np.maximum.at(term_tables, self.column_table, term_columns + term_tables[self.column_table])
+            column_scores += term_columns
+            ranking += term_tables
+            # The tables that best explain some term are needed (near-ties included)
+            if term_tables.max() > 0:
+                needed |= term_tables >= term_tables.max() * TABLE_SCORE_RATIO
+
+        if not needed.any():
+            # No term matched anything: keep the old behaviour of sending the first k tables whole
+            return self.corpus[:k]
+
+        candidates = np.flatnonzero(needed)
+        chosen = [self.tables[i] for i in candidates[np.argsort(-ranking[candidates], kind="stable")][:k]]
+
+        n = min(self.top_columns, len(column_scores))
+        top = np.argpartition(-column_scores, n - 1)[:n]
+        selected: Dict[str, Set[int]] = {t: set() for t in chosen}
+        for i in top:
+            table, position = self.column_refs[i]
+            if column_scores[i] > 0 and table in selected:
+                selected[table].add(position)
+
+        tables, key_columns = self._connect(chosen)
+        for table in tables:
+            positions = selected.setdefault(table, set())
+            columns = self.table_columns[table]
+            for position, column in enumerate(columns):
+                if column.get("primary_key") or (table, column["name"]) in key_columns:
+                    positions.add(position)
+                elif column.get("references") and column["references"].split(".")[0] in tables:
+                    positions.add(position)
+            # Tables picked by name alone still get their best few columns to work with
+            if table in chosen and len(positions) < self.min_columns_per_table:
+                offset = self.column_offsets.get(table, 0)
+                scores = column_scores[offset:offset + len(columns)]
+                for position in np.argsort(-scores, kind="stable"):
+                    if len(positions) >= self.min_columns_per_table:
+                        break
+                    positions.add(int(position))
+
+        sections = []
+        for table in tables:
+            columns = self.table_columns[table]
+            lines = [_describe_column(columns[p]) for p in sorted(selected[table])]
+            sections.append(f"Table: {table}\nColumns:\n" + "\n".join(lines) + "\n")
+        return sections
@@ -1,43 +1,107 @@
-from groq import Groq
 from app.config.settings import settings
+from app.services.answer_renderer import render_answer
+from app.services.llm_client import LLMTimeoutError, get_llm_client
+from app.services.result_digest import build_result_digest
+from app.utils.admission import Overloaded
 from app.utils.logger import app_logger
+from app.utils.metrics import LLM_FALLBACKS
 
-def get_groq_client():
-    if not settings.GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY is not set in environment variables")
-    return Groq(api_key=settings.GROQ_API_KEY)
-
-def generate_natural_response(query, sql, result):
-    app_logger.info(f"Generating natural response for query: {query[:50]}...")
-    if sql is None:
-        app_logger.warning(f"No SQL provided, returning: {result}")
-        return result # result contains the reason/refusal message
-        
+def _build_messages(query, sql, result):
     prompt = (
         f"USER QUESTION: {query}\n"
         f"SQL EXECUTED: {sql}\n"
-        f"DATABASE RESULT: {result}\n\n"
+        f"DATABASE RESULT:\n{build_result_digest(result, sql)}\n\n"
         "Generate a clear, human-readable business response based ONLY on the database result above.\n"
         "Instructions:\n"
         "1. Do not invent or hallucinate numbers.\n"
-        "2. Use ₹ prefix for currency and format numbers with commas where appropriate.\n"
+        "2. Numbers are already formatted (₹ for currency, Indian digit grouping); quote them exactly as given.\n"
         "3. If the result is 'none' or empty, state that no records were found."
     )
+    return [
+        {"role": "system", "content": "You are a helpful business data assistant. Summarize results accurately."},
+        {"role": "user", "content": prompt}
+    ]
+
+async def generate_natural_response(query, sql, result):
+    app_logger.debug("Generating natural response")
+    if sql is None:
+        app_logger.warning("No SQL provided, returning: %s", result)
+        return result # result contains the reason/refusal message
+    
+    # Simple result shapes are phrased locally, saving the LLM round-trip
+    templated = render_answer(query, sql, result)
+    if templated is not None:
+        app_logger.info("Natural response rendered from template")
+        return templated
     
+    messages = _build_messages(query, sql, result)
     try:
-        client = get_groq_client()
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful business data assistant. Summarize results accurately."},
-                {"role": "user", "content": prompt}
-            ],
-            model="llama-3.3-70b-versatile",
-            temperature=0.3
-        )
+        try:
+            completion = await get_llm_client().complete(
+                messages,
+                temperature=settings.LLM_RESPONSE_TEMPERATURE,
+                timeout=settings.LLM_RESPONSE_TIMEOUT,
+                purpose="response"
+            )
+        except (LLMTimeoutError, Overloaded) as e:
+            if not settings.LLM_RESPONSE_FALLBACK_MODEL:
+                raise
+            app_logger.warning("Answering with %s instead: %s", settings.LLM_RESPONSE_FALLBACK_MODEL, e)
+            LLM_FALLBACKS.labels(purpose="response").inc()
+            completion = await get_llm_client().complete(
+                messages,
+                temperature=settings.LLM_RESPONSE_TEMPERATURE,
+                model=settings.LLM_RESPONSE_FALLBACK_MODEL,
+                timeout=settings.LLM_RESPONSE_FALLBACK_TIMEOUT,
+                purpose="response_fallback"
+            )
         
-        response = completion.choices[0].message.content.strip()
-        app_logger.info(f"Natural response generated successfully")
+        response = completion.content.strip()
+        app_logger.info("Natural response generated successfully")
         return response
     except Exception as e:
-        app_logger.error(f"Error generating natural response: {str(e)}")
+        app_logger.error("Error generating natural response: %s", e)
+        raise
+
+async def stream_natural_response(query, sql, result):
+    """
+    Same answer as generate_natural_response, yielded chunk by chunk as the LLM produces it
+    """
+    app_logger.debug("Streaming natural response")
+    if sql is None:
+        app_logger.warning("No SQL provided, returning: %s", result)
+        yield result
+        return
+    
+    templated = render_answer(query, sql, result)
+    if templated is not None:
+        app_logger.info("Natural response rendered from template")
+        yield templated
+        return
+    
+    messages = _build_messages(query, sql, result)
+    started = False
+    try:
+        try:
+            async for chunk in get_llm_client().stream(
+                messages,
+                temperature=settings.LLM_RESPONSE_TEMPERATURE,
+                timeout=settings.LLM_RESPONSE_TIMEOUT
+            ):
+                started = True
+                yield chunk
+        except (LLMTimeoutError, Overloaded) as e:
+            if started or not settings.LLM_RESPONSE_FALLBACK_MODEL:
+                raise
+            app_logger.warning("Streaming the answer from %s instead: %s", settings.LLM_RESPONSE_FALLBACK_MODEL, e)
+            LLM_FALLBACKS.labels(purpose="response").inc()
+            async for chunk in get_llm_client().stream(
+                messages,
+                temperature=settings.LLM_RESPONSE_TEMPERATURE,
+                model=settings.LLM_RESPONSE_FALLBACK_MODEL,
+                timeout=settings.LLM_RESPONSE_FALLBACK_TIMEOUT
+            ):
+                yield chunk
+    except Exception as e:
+        app_logger.error("Error streaming natural response: %s", e)
         raise
@@ -0,0 +1,212 @@
+import datetime
+import re
+from decimal import Decimal
+from typing import Any, Collection, Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from app.config.settings import settings
+from app.utils.formatters import format_indian_number, format_inr
+
+CURRENCY_COLUMNS = {column.lower() for column in settings.CURRENCY_COLUMNS}
+
+# For results whose SQL can't be read: alias words that mark a rupee figure, and words that rule it out
+_MONEY_WORDS = {"revenue", "sales", "amount", "cost", "price", "spend", "spent", "value", "worth", "inr", "rupees"}
+_NOT_MONEY_WORDS = {
+    "count", "counts", "qty", "quantity", "quantities", "units", "orders", "number", "num", "customers", "clients",
+    "items", "lines", "skus", "products"
+}
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about four characters per token for English and numbers)
+    """
+    return (len(text) + 3) // 4
+
+
+def is_currency_name(name: str) -> bool:
+    """
+    Whether a result column's name alone says it is money: a whole word
+    like "revenue" or "cost", and no word like "count" or "quantity"
+    """
+    words = set(_WORD_RE.findall(name.lower()))
+    return bool(words & _MONEY_WORDS) and not words & _NOT_MONEY_WORDS
+
+
+def is_currency_expression(node: exp.Expression, money_aliases: Collection[str] = ()) -> bool:
+    """
+    Whether an expression yields rupees: a money column (CURRENCY_COLUMNS,
+    or an alias of a money expression in a subquery), SUM/AVG/MIN/MAX of
+    one, or a product, difference or ratio that keeps the unit. COUNTs never do.
+    """
+    if isinstance(node, (exp.Alias, exp.Paren)):
+        return is_currency_expression(node.this, money_aliases)
+    if isinstance(node, exp.Column):
+        return node.name.lower() in CURRENCY_COLUMNS or node.name.lower() in money_aliases
+    if isinstance(node, (exp.Sum, exp.Avg, exp.Min, exp.Max)):
+        argument = node.this
+        if isinstance(argument, exp.Distinct):
+            argument = argument.expressions[0] if argument.expressions else None
+        return argument is not None and is_currency_expression(argument, money_aliases)
+    if isinstance(node, exp.Mul):
+        # quantity * unit_price
+        return is_currency_expression(node.this, money_aliases) or is_currency_expression(node.expression, money_aliases)
+    if isinstance(node, exp.Div):
+        # SUM(total_cost) / COUNT(*) is money, total_cost / price is a ratio
+        return (is_currency_expression(node.this, money_aliases)
+                and not is_currency_expression(node.expression, money_aliases))
+    if isinstance(node, (exp.Add, exp.Sub)):
+        return is_currency_expression(node.this, money_aliases) and is_currency_expression(node.expression, money_aliases)
+    if isinstance(node, (exp.Round, exp.Coalesce, exp.Cast, exp.Abs, exp.Floor, exp.Ceil)):
+        return is_currency_expression(node.this, money_aliases)
+    return False
+
+
+def money_aliases(ast: exp.Expression) -> frozenset:
+    """
+    Aliases of money expressions anywhere in the statement, so an outer
+    query selecting `revenue` from a subquery or CTE knows it is rupees
+    """
+    aliases = set()
+    # Innermost first: an alias may be built from one defined further in
+    for alias in reversed(list(ast.find_all(exp.Alias))):
+        if isinstance(alias.parent, exp.Select) and is_currency_expression(alias.this, aliases):
+            aliases.add(alias.alias.lower())
+    return frozenset(aliases)
+
+
+def currency_columns(sql: Optional[str], columns: List[str]) -> Dict[str, bool]:
+    """
+    Which result columns are rupee amounts, read from the SELECT list that
+    produced them. Names are only used when the SQL can't be parsed.
+    """
+    try:
+        ast = sqlglot.parse_one(sql, read="mysql") if sql else None
+    except Exception:
+        ast = None
+    if not isinstance(ast, exp.Select):
+        return {c: is_currency_name(c) for c in columns}
+
+    aliases = money_aliases(ast)
+    projections = ast.expressions
+    if len(projections) == len(columns) and not any(isinstance(p, exp.Star) for p in projections):
+        return {c: is_currency_expression(p, aliases) for c, p in zip(columns, projections)}
+    by_name = {p.alias_or_name.lower(): p for p in projections if p.alias_or_name}
+    return {
+        c: is_currency_expression(by_name[c.lower()], aliases) if c.lower() in by_name
+        else c.lower() in CURRENCY_COLUMNS or c.lower() in aliases
+        for c in columns
+    }
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def format_value(value: Any, currency: bool = False) -> str:
+    """
+    Render one value compactly: rupee or Indian-grouped numbers, ISO dates, NULL
+    """
+    if value is None:
+        return "NULL"
+    if _is_number(value):
+        if currency:
+            return format_inr(value)
+        return format_indian_number(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def _format_rows(columns: List[str], rows: List[Dict[str, Any]], currency: Dict[str, bool]) -> List[str]:
+    return [" | ".join(format_value(row.get(c), currency[c]) for c in columns) for row in rows]
+
+
+def _aggregates(columns: List[str], rows: List[Dict[str, Any]], currency: Dict[str, bool], top_n: int) -> List[str]:
+    lines = []
+    numeric = [c for c in columns if any(_is_number(r.get(c)) for r in rows)]
+    for column in numeric:
+        values = [r[column] for r in rows if _is_number(r.get(column))]
+        total = sum(Decimal(str(v)) for v in values)
+        if all(isinstance(v, int) for v in values):
+            total = int(total)
+        stats = [total, min(values), max(values), total / len(values)]
+        total_s, min_s, max_s, avg_s = [format_value(v, currency[column]) for v in stats]
+        lines.append(
+            f"{column}: sum {total_s}, min {min_s}, max {max_s}, avg {avg_s} over {len(values)} non-null values"
+        )
+
+    labels = [c for c in columns if c not in numeric]
+    if numeric and labels:
+        label, measure = labels[0], numeric[0]
+        ranked = sorted(
+            (r for r in rows if _is_number(r.get(measure))), key=lambda r: r[measure], reverse=True
+        )[:top_n]
+        lines.append(f"Top {len(ranked)} by {measure}:")
+        lines.extend(
+            f"  {format_value(r.get(label))}: {format_value(r[measure], currency[measure])}" for r in ranked
+        )
+    return lines
+
+
+def build_result_digest(result: Any, sql: Optional[str] = None, token_budget: Optional[int] = None,
+                        top_n: int = 10, row_limit: Optional[int] = None) -> str:
+    """
+    Compact, pre-formatted rendering of a query result for the response prompt.
+
+    Small results are written as a table with the header once and one
+    pipe-separated line per row. When the table would exceed token_budget,
+    the digest carries the row count, per-column sum/min/max/avg, the top-N
+    rows by the first numeric column, and as many leading rows as still fit.
+    A result of row_limit rows or more is flagged as possibly truncated, so
+    the LLM doesn't present it as complete. Amounts are already in ₹ with
+    Indian grouping, so the LLM only has to quote them.
+    """
+    token_budget = token_budget or settings.RESPONSE_DIGEST_TOKEN_BUDGET
+    row_limit = row_limit or settings.QUERY_ROW_LIMIT
+
+    if result is None or result == []:
+        return "No records found."
+
+    if not isinstance(result, list):
+        # Scalar: the executor dropped the column name, so currency comes from the select list alone
+        currency = bool(sql) and currency_columns(sql, [""])[""]
+        return f"Single value: {format_value(result, currency)}"
+
+    columns = list(result[0].keys())
+    currency = currency_columns(sql, columns)
+    header = " | ".join(columns)
+    lines = _format_rows(columns, result, currency)
+    table = "\n".join([header] + lines)
+    # The executor stops at row_limit rows, so a result that reached it may be missing rows
+    truncated = len(result) >= row_limit
+    if estimate_tokens(table) <= token_budget:
+        if truncated:
+            return f"{len(result)} rows (the row limit; the full result may have more rows):\n{table}"
+        return f"{len(result)} rows:\n{table}"
+
+    if truncated:
+        summary = [
+            f"{len(result)} rows (the row limit; the full result may have more rows, and aggregates cover only "
+            f"these first {len(result)} rows)."
+        ]
+    else:
+        summary = [f"{len(result)} rows (too many to list; aggregates are over all rows)."]
+    summary.extend(_aggregates(columns, result, currency, top_n))
+    used = estimate_tokens("\n".join(summary + [header]))
+
+    shown = []
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        shown.append(line)
+        used += cost
+    if shown:
+        summary.append(f"First {len(shown)} of {len(result)} rows:")
+        summary.append(header)
+        summary.extend(shown)
+    return "\n".join(summary)
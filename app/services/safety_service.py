@@ -1,10 +1,16 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
 import sqlglot
 from sqlglot import exp
 from app.config.settings import settings
 from app.utils.logger import app_logger
 
 BANNED_KEYWORDS = [
-    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", 
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE",
     "TRUNCATE", "REPLACE", "GRANT", "REVOKE"
 ]
 
@@ -12,59 +18,171 @@ RISKY_FUNCTIONS = [
     "SLEEP", "BENCHMARK", "LOAD_FILE", "INTO OUTFILE", "INTO DUMPFILE"
 ]
 
-def validate_sql(sql: str):
-    app_logger.info(f"Validating SQL: {sql[:100]}...")
-    if not sql or sql in ["__NEED_CLARIFICATION__", "__NOT_DB__"]:
-        app_logger.warning("SQL validation failed: Not a valid SQL query")
-        return False, "Not a valid SQL query."
-
-    # 1. Basic keyword check with word boundaries to avoid false positives (e.g., "created" containing "create")
-    import re
-    upper_sql = sql.upper()
-    for keyword in BANNED_KEYWORDS:
-        if re.search(rf"\b{keyword}\b", upper_sql):
-            app_logger.warning(f"SQL validation failed: Banned keyword found: {keyword}")
-            return False, f"Banned keyword found: {keyword}"
-            
-    for func in RISKY_FUNCTIONS:
-        if func in upper_sql:
-            app_logger.warning(f"SQL validation failed: Risky function found: {func}")
-            return False, f"Risky function found: {func}"
-
-    # 2. Block multiple statements
-    if ";" in sql:
-        parts = [p.strip() for p in sql.split(";") if p.strip()]
-        if len(parts) > 1:
-            app_logger.warning("SQL validation failed: Multiple SQL statements found")
-            return False, "Multiple SQL statements are not allowed."
-
-    # 3. Block comments
-    if "--" in sql or "/*" in sql:
-        app_logger.warning("SQL validation failed: SQL comments found")
-        return False, "SQL comments are not allowed."
-
-    # 4. AST Validation
-    try:
-        parsed = sqlglot.parse_one(sql, read="mysql")
-        
-        # Must be a SELECT statement
+# Functions rejected wherever they appear in the AST: delays, locks, file and host access, and the
+# session's account, connection and server identity
+BLOCKED_FUNCTIONS = {
+    "SLEEP", "BENCHMARK", "LOAD_FILE", "GET_LOCK", "RELEASE_LOCK", "RELEASE_ALL_LOCKS",
+    "IS_FREE_LOCK", "IS_USED_LOCK", "MASTER_POS_WAIT", "SOURCE_POS_WAIT", "WAIT_FOR_EXECUTED_GTID_SET",
+    "SYS_EXEC", "SYS_EVAL",
+    "USER", "CURRENT_USER", "SESSION_USER", "SYSTEM_USER", "CONNECTION_ID", "DATABASE", "SCHEMA", "VERSION"
+}
+
+# Statement and clause nodes that must never appear anywhere in a query, including nested
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create, exp.AlterTable,
+    exp.Command, exp.Merge, exp.Into, exp.Transaction, exp.Commit, exp.Rollback,
+    exp.Set, exp.Use, exp.LoadData, exp.Lock
+)
+
+# Set operations can splice arbitrary extra result sets onto an otherwise safe query
+_SET_OPERATIONS = (exp.Union, exp.Intersect, exp.Except)
+
+
+class ValidatedQuery:
+    """
+    A query that passed validation: the parsed AST, its canonical MySQL text,
+    the tables it reads and a hash of the canonical text. The AST is shared
+    through the validation cache, so stages that rewrite it must copy() first.
+    """
+    def __init__(self, sql: str, ast: exp.Expression, canonical_sql: str, tables: List[str]):
+        self.sql = sql
+        self.ast = ast
+        self.canonical_sql = canonical_sql
+        self.tables = tables
+        self.fingerprint = hashlib.sha256(canonical_sql.encode("utf-8")).hexdigest()
+
+
+class SQLValidator:
+    """
+    Compiled SQL safety checks. Patterns and the allowed-table set are built
+    once; each query gets a single regex scan for tokens the AST cannot show
+    (banned keywords, risky substrings, comments), one parse, and one AST
+    walk covering statement shapes, tables, functions, subqueries and CTEs.
+    Verdicts for recently seen SQL are kept in a small LRU.
+    """
+    def __init__(self, allowed_tables: List[str], db_name: Optional[str] = None, cache_size: int = 512):
+        self.allowed_tables = frozenset(t.lower() for t in allowed_tables)
+        self.db_name = db_name.lower() if db_name else None
+        self.cache_size = cache_size
+        self._scan_re = re.compile(
+            r"\b(?P<keyword>" + "|".join(BANNED_KEYWORDS) + r")\b"
+            r"|(?P<risky>" + "|".join(re.escape(f) for f in RISKY_FUNCTIONS) + r")"
+            r"|(?P<comment>--|/\*)",
+            re.IGNORECASE
+        )
+        self._cache: "OrderedDict[str, Tuple[bool, str, Optional[ValidatedQuery]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, sql: str) -> Tuple[bool, str, Optional[ValidatedQuery]]:
+        if not sql or sql in ["__NEED_CLARIFICATION__", "__NOT_DB__"]:
+            app_logger.warning("SQL validation failed: Not a valid SQL query")
+            return False, "Not a valid SQL query.", None
+
+        key = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                app_logger.debug("SQL validation result served from cache")
+                return cached
+            self.misses += 1
+
+        verdict = self._validate(sql)
+        with self._lock:
+            self._cache[key] = verdict
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return verdict
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def _reject(self, message: str) -> Tuple[bool, str, None]:
+        app_logger.warning("SQL validation failed: %s", message)
+        return False, message, None
+
+    def _validate(self, sql: str) -> Tuple[bool, str, Optional[ValidatedQuery]]:
+        app_logger.debug("Validating SQL: %s...", sql[:100])
+
+        # 1. Single scan for banned keywords (word boundaries avoid e.g. "created"), risky functions and comments
+        match = self._scan_re.search(sql)
+        if match:
+            if match.group("keyword"):
+                return self._reject(f"Banned keyword found: {match.group('keyword').upper()}")
+            if match.group("risky"):
+                return self._reject(f"Risky function found: {match.group('risky').upper()}")
+            return self._reject("SQL comments are not allowed.")
+
+        # 2. Parse once; more than one statement is rejected
+        try:
+            statements = [s for s in sqlglot.parse(sql, read="mysql") if s is not None]
+        except Exception as e:
+            app_logger.error("SQL validation failed with parsing error: %s", e)
+            return False, f"SQL parsing error: {str(e)}", None
+        if len(statements) != 1:
+            return self._reject("Multiple SQL statements are not allowed." if statements else "Not a valid SQL query.")
+        parsed = statements[0]
+
+        if isinstance(parsed, _SET_OPERATIONS):
+            return self._reject("UNION, INTERSECT and EXCEPT are not allowed.")
         if not isinstance(parsed, exp.Select):
-            app_logger.warning("SQL validation failed: Not a SELECT statement")
-            return False, "Only SELECT queries are allowed."
-            
-        # Check tables used
-        tables = [table.name.lower() for table in parsed.find_all(exp.Table)]
-        for t in tables:
-            if t not in [at.lower() for at in settings.ALLOWED_TABLES]:
+            return self._reject("Only SELECT queries are allowed.")
+
+        # 3. One walk over the whole tree, subqueries and CTE bodies included
+        cte_names = set()
+        tables = []
+        for node in parsed.walk(bfs=False):
+            if node.comments:
+                return self._reject("SQL comments are not allowed.")
+            if isinstance(node, _FORBIDDEN_NODES):
+                return self._reject("Only SELECT queries are allowed.")
+            if isinstance(node, _SET_OPERATIONS):
+                return self._reject("UNION, INTERSECT and EXCEPT are not allowed.")
+            if isinstance(node, exp.SessionParameter):
+                return self._reject("Server variables are not allowed.")
+            if isinstance(node, exp.CTE):
+                cte_names.add(node.alias_or_name.lower())
+            elif isinstance(node, exp.Table):
+                tables.append(node)
+            elif isinstance(node, exp.Func):
+                name = node.name if isinstance(node, exp.Anonymous) else node.sql_name()
+                if name.upper() in BLOCKED_FUNCTIONS:
+                    return self._reject(f"Risky function found: {name.upper()}")
+
+        referenced = set()
+        for table in tables:
+            name = table.name.lower()
+            if not table.db and name in cte_names:
+                continue
+            if table.catalog or (table.db and table.db.lower() != self.db_name):
+                return self._reject(f"Table '{table.sql(dialect='mysql')}' is outside the application database.")
+            if name not in self.allowed_tables:
                 # Sometimes information_schema might be used by LLM? Not allowed by prompt rules.
-                app_logger.warning(f"SQL validation failed: Table '{t}' is not in allowed list")
-                return False, f"Table '{t}' is not in the allowed list."
-                
-        app_logger.info("SQL validation passed")
-        return True, "SQL is safe."
-    except Exception as e:
-        app_logger.error(f"SQL validation failed with parsing error: {str(e)}")
-        return False, f"SQL parsing error: {str(e)}"
+                return self._reject(f"Table '{name}' is not in the allowed list.")
+            referenced.add(name)
+
+        validated = ValidatedQuery(sql, parsed, parsed.sql(dialect="mysql"), sorted(referenced))
+        app_logger.debug("SQL validation passed")
+        return True, "SQL is safe.", validated
+
+
+sql_validator = SQLValidator(settings.ALLOWED_TABLES, settings.DB_NAME, settings.SQL_VALIDATION_CACHE_SIZE)
+
+
+def validate_query(sql: str) -> Tuple[bool, str, Optional[ValidatedQuery]]:
+    """
+    Validate SQL and, when it is safe, return the ValidatedQuery for downstream stages
+    """
+    return sql_validator.validate(sql)
+
+
+def validate_sql(sql: str):
+    is_safe, message, _ = sql_validator.validate(sql)
+    return is_safe, message
 
 if __name__ == "__main__":
     t1 = "SELECT * FROM data_so_summary"
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import settings
+from app.models.schema.schema_manager import fetch_schema, fetch_schema_signature
+from app.services.rag_service import SchemaRetriever
+from app.utils.concurrency import run_blocking
+from app.utils.logger import app_logger
+
+SNAPSHOT_FORMAT_VERSION = 2
+
+
+def compute_fingerprint(snippets: List[Dict[str, Any]]) -> str:
+    """
+    Stable hash of the formatted schema snippets
+    """
+    payload = json.dumps(
+        [[s["table_name"], s["content"]] for s in sorted(snippets, key=lambda s: s["table_name"])],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SchemaSnapshot:
+    """
+    Immutable view of the schema used to answer requests: the formatted
+    snippets, a retriever fitted on them and the version identifying them
+    """
+    def __init__(self, snippets, retriever, fingerprint, version, signature=None, fetched_at=None):
+        self.snippets = snippets
+        self.retriever = retriever
+        self.fingerprint = fingerprint
+        self.version = version
+        self.signature = signature
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def save(self, path: str):
+        """
+        Persist the snapshot, including the fitted retriever, so a new worker
+        can serve before it reaches the database. Written atomically.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        payload = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "fingerprint": self.fingerprint,
+            "version": self.version,
+            "signature": self.signature,
+            "fetched_at": self.fetched_at,
+            "snippets": self.snippets,
+            "retriever": self.retriever
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SchemaSnapshot"]:
+        """
+        Load a snapshot written by save(). Returns None if the file is missing,
+        from another format version, or does not match its own fingerprint.
+        Only ever point this at a file this service wrote: it is a pickle.
+        """
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+        if payload.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return None
+        if compute_fingerprint(payload["snippets"]) != payload["fingerprint"]:
+            return None
+        return cls(
+            payload["snippets"],
+            payload["retriever"],
+            payload["fingerprint"],
+            payload["version"],
+            payload["signature"],
+            payload["fetched_at"]
+        )
+
+
+class SchemaRegistry:
+    """
+    Process-wide holder of the current schema snapshot.
+
+    Readers call get_snapshot() and get back whatever snapshot is current; the
+    reference is swapped atomically on refresh, so reads never take a lock.
+    A background thread probes for DDL drift every refresh_interval seconds and
+    rebuilds the snapshot when the signature changes or the snapshot is older
+    than ttl.
+
+    When snapshot_path is set, every new snapshot is written to disk and a
+    cold process starts from that file, reconciling against the database in
+    the background instead of blocking on it.
+    """
+    def __init__(self, refresh_interval: int = 60, ttl: int = 3600, snapshot_path: Optional[str] = None):
+        self.refresh_interval = refresh_interval
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get_snapshot(self) -> SchemaSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.load_persisted() or self.refresh(force=False)
+        return snapshot
+
+    async def get_snapshot_async(self) -> SchemaSnapshot:
+        """
+        Event-loop friendly get_snapshot(): only the cold path, which has to
+        hit the disk or the database, is moved off the loop
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = await run_blocking(self.get_snapshot)
+        return snapshot
+
+    def load_persisted(self) -> Optional[SchemaSnapshot]:
+        """
+        Install the on-disk snapshot if no snapshot is loaded yet
+        """
+        if not self.snapshot_path:
+            return None
+        with self._refresh_lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            try:
+                snapshot = SchemaSnapshot.load(self.snapshot_path)
+            except Exception as e:
+                app_logger.warning("Ignoring unreadable schema snapshot %s: %s", self.snapshot_path, e)
+                return None
+            if snapshot is None:
+                return None
+            self._snapshot = snapshot
+            app_logger.info(
+                "Schema snapshot version %s loaded from %s (%s tables, %ss old)",
+                snapshot.version, self.snapshot_path, len(snapshot.snippets), int(snapshot.age)
+            )
+            return snapshot
+
+    def _persist(self, snapshot: SchemaSnapshot):
+        if not self.snapshot_path:
+            return
+        try:
+            snapshot.save(self.snapshot_path)
+        except Exception as e:
+            # Persistence only speeds up the next cold start; never fail a refresh over it
+            app_logger.warning("Could not persist schema snapshot to %s: %s", self.snapshot_path, e)
+
+    def refresh(self, force: bool = True) -> SchemaSnapshot:
+        """
+        Fetch the schema and install a new snapshot. Concurrent callers are
+        serialised; with force=False a snapshot installed meanwhile is reused.
+        """
+        with self._refresh_lock:
+            current = self._snapshot
+            if current is not None and not force:
+                return current
+
+            # Take the signature first so a DDL change racing the fetch is caught by the next probe
+            signature = fetch_schema_signature()
+            snippets = fetch_schema()
+            fingerprint = compute_fingerprint(snippets)
+
+            if current is not None and current.fingerprint == fingerprint:
+                # Schema unchanged: keep the fitted retriever, just renew the snapshot
+                snapshot = SchemaSnapshot(
+                    current.snippets, current.retriever, fingerprint, current.version, signature
+                )
+                app_logger.info("Schema unchanged (version %s), snapshot renewed", snapshot.version)
+            else:
+                version = current.version + 1 if current is not None else 1
+                snapshot = SchemaSnapshot(snippets, SchemaRetriever(snippets), fingerprint, version, signature)
+                app_logger.info(
+                    "Schema snapshot version %s installed with %s tables (fingerprint %s)",
+                    version, len(snippets), fingerprint[:12]
+                )
+
+            self._snapshot = snapshot
+            self._persist(snapshot)
+            return snapshot
+
+    def check_for_drift(self) -> bool:
+        """
+        Refresh the snapshot if it has expired or the schema signature changed.
+        Returns True when a refresh happened.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.age > self.ttl:
+            self.refresh()
+            return True
+
+        signature = fetch_schema_signature()
+        if signature != snapshot.signature:
+            app_logger.info("Schema drift detected, refreshing snapshot")
+            self.refresh()
+            return True
+        return False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.load_persisted()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="schema-registry", daemon=True)
+        self._thread.start()
+        app_logger.info("Schema registry refresher started (interval %ss, ttl %ss)", self.refresh_interval, self.ttl)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        # Reconcile a snapshot loaded from disk (or load one) right away rather than after the first interval
+        wait = 0
+        while not self._stop_event.wait(wait):
+            wait = self.refresh_interval
+            try:
+                self.check_for_drift()
+            except Exception as e:
+                # Keep serving the current snapshot; the next probe retries
+                app_logger.error("Schema refresh failed: %s", e)
+
+
+schema_registry = SchemaRegistry(
+    settings.SCHEMA_REFRESH_INTERVAL,
+    settings.SCHEMA_TTL,
+    settings.SCHEMA_SNAPSHOT_PATH
+)
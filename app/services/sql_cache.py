@@ -0,0 +1,164 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.config.settings import settings
+from app.utils.logger import app_logger
+
+# Outcomes of generate_sql that are not SQL; cached like any other answer
+NEGATIVE_OUTCOMES = ("__NEED_CLARIFICATION__", "__NOT_DB__")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[?!.]+$")
+# A whole number grouped the Western (1,234,567) or Indian (12,34,567) way; anything else, such as the list
+# "10,20", keeps its commas. Numbers right after an identifier word ("sku 5,100") are lists, not amounts.
+_GROUPED_NUMBER_RE = re.compile(r"(?<![\d.,])(\d{1,3}(?:,\d{3})+|\d{1,2}(?:,\d{2})*,\d{3})(?!,?\d)")
+_IDENTIFIER_BEFORE_RE = re.compile(r"(?:\b(?:id|ids|no|sku|skus|code|codes) ?|#)$")
+_DECIMAL_ZERO_RE = re.compile(r"\b(\d+)\.0+\b")
+_DMY_DATE_RE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b")
+_YMD_DATE_RE = re.compile(r"\b(\d{4})[/-](\d{1,2})[/-](\d{1,2})\b")
+_TOKEN_RE = re.compile(r"\d{4}-\d{2}-\d{2}|\d+(?:\.\d+)?|[a-z_]+")
+
+_NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "fifteen": "15", "twenty": "20", "fifty": "50", "hundred": "100"
+}
+_NUMBER_WORDS_RE = re.compile(r"\b(" + "|".join(_NUMBER_WORDS) + r")\b")
+
+# Filler words that never change the meaning of an analytics question. Negations are deliberately absent.
+_FILLER_WORDS = {
+    "a", "an", "the", "what", "whats", "is", "are", "was", "were", "me", "show", "tell",
+    "give", "please", "can", "could", "you", "i", "get", "find", "of", "our", "my"
+}
+
+
+def _fold_grouped_number(match: re.Match) -> str:
+    if _IDENTIFIER_BEFORE_RE.search(match.string, 0, match.start()):
+        return match.group(0)
+    return match.group(1).replace(",", "")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question: lower-cased, single-spaced, trailing
+    punctuation dropped, number words and the separators of Western or
+    Indian digit grouping folded into digits and dd/mm/yyyy or yyyy/mm/dd
+    dates rewritten as yyyy-mm-dd
+    """
+    text = _WHITESPACE_RE.sub(" ", question.strip().lower())
+    text = _TRAILING_PUNCT_RE.sub("", text).strip()
+    text = _NUMBER_WORDS_RE.sub(lambda m: _NUMBER_WORDS[m.group(1)], text)
+    text = _GROUPED_NUMBER_RE.sub(_fold_grouped_number, text)
+    text = _DECIMAL_ZERO_RE.sub(r"\1", text)
+    text = _DMY_DATE_RE.sub(lambda m: f"{m.group(3)}-{int(m.group(2)):02d}-{int(m.group(1)):02d}", text)
+    text = _YMD_DATE_RE.sub(lambda m: f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}", text)
+    return text
+
+
+def _content_tokens(normalized: str) -> Tuple[str, ...]:
+    """
+    The question's words in order, without filler words and punctuation
+    """
+    return tuple(t for t in _TOKEN_RE.findall(normalized) if t not in _FILLER_WORDS)
+
+
+class _CacheEntry:
+    def __init__(self, sql: str, scope: str, tokens: Tuple[str, ...], expires_at: float):
+        self.sql = sql
+        self.scope = scope
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+
+class SQLCache:
+    """
+    LRU/TTL cache of generated SQL.
+
+    Entries are keyed by the normalised question within a scope made of the
+    schema fingerprint and the date context, so a schema change or a new day
+    never serves stale SQL. With near_match, an exact miss may also be served
+    by a question in the same scope with the same words in the same order
+    once filler words and punctuation are dropped ("show me the sales" and
+    "sales"). Anything looser would hand one question another's SQL: "top
+    clients ascending" and "descending" are near-identical as text.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, negative_ttl: float = 600,
+                 near_match: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.near_match = near_match
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _scope(schema_fingerprint: str, time_context: str) -> str:
+        return hashlib.sha256(f"{schema_fingerprint}\n{time_context}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, question: str, schema_fingerprint: str, time_context: str) -> Tuple[str, str, Tuple[str, ...]]:
+        normalized = normalize_question(question)
+        scope = self._scope(schema_fingerprint, time_context)
+        return f"{scope}:{normalized}", scope, _content_tokens(normalized)
+
+    def get(self, question: str, schema_fingerprint: str, time_context: str) -> Optional[str]:
+        key, scope, tokens = self._lookup(question, schema_fingerprint, time_context)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.sql
+            if entry is not None:
+                del self._entries[key]
+
+            if self.near_match and tokens:
+                for candidate_key, candidate in reversed(self._entries.items()):
+                    if candidate.scope == scope and candidate.tokens == tokens and candidate.expires_at > now:
+                        self._entries.move_to_end(candidate_key)
+                        self.near_hits += 1
+                        app_logger.debug("SQL cache hit on a filler-word variant of the question")
+                        return candidate.sql
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, schema_fingerprint: str, time_context: str, sql: str):
+        key, scope, tokens = self._lookup(question, schema_fingerprint, time_context)
+        ttl = self.negative_ttl if sql in NEGATIVE_OUTCOMES else self.ttl
+        with self._lock:
+            self._entries[key] = _CacheEntry(sql, scope, tokens, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+sql_cache = SQLCache(
+    settings.SQL_CACHE_MAX_ENTRIES,
+    settings.SQL_CACHE_TTL,
+    settings.SQL_CACHE_NEGATIVE_TTL,
+    settings.SQL_CACHE_NEAR_MATCH
+)
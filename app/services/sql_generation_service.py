@@ -1,12 +1,8 @@
-from groq import Groq
 from app.config.settings import settings
+from app.services.llm_client import get_llm_client
+from app.services.prompt_compiler import CompiledPrompt, PromptCompiler
 from app.utils.logger import app_logger
 
-def get_groq_client():
-    if not settings.GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY is not set in environment variables")
-    return Groq(api_key=settings.GROQ_API_KEY)
-
 SYSTEM_PROMPT = """
 You are a MySQL expert. Generate ONLY the raw SQL query for the user's question.
 Rules:
@@ -40,31 +36,31 @@ Rules:
 10. IMPORTANT: The schema information provided below contains ALL the available columns in the database. Use ONLY these column names and nothing else.
 """
 
-def generate_sql(query, schema_context, time_context):
-    app_logger.info(f"Generating SQL for query: {query[:50]}...")
-    full_prompt = (
-        f"SCHEMA CONTEXT:\n{schema_context}\n\n"
-        f"DATE CONTEXT:\n{time_context}\n\n"
-        f"USER QUESTION: {query}"
-    )
+sql_prompt_compiler = PromptCompiler(SYSTEM_PROMPT, settings.SQL_PROMPT_TOKEN_BUDGET)
+
+def build_sql_prompt(query, schema_context, time_context) -> CompiledPrompt:
+    """
+    Assemble the SQL-generation prompt; schema_context is a list of schema
+    sections ranked most relevant first (or one preformatted string)
+    """
+    return sql_prompt_compiler.compile(query, schema_context, time_context)
+
+async def generate_sql(prompt: CompiledPrompt):
+    app_logger.debug("Generating SQL from a %s-token prompt %s", prompt.total_tokens, prompt.token_counts)
     
     try:
-        client = get_groq_client()
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": full_prompt}
-            ],
-            model="llama-3.3-70b-versatile",
-            temperature=0
+        completion = await get_llm_client().complete(
+            prompt.messages,
+            temperature=settings.LLM_SQL_TEMPERATURE,
+            timeout=settings.LLM_SQL_TIMEOUT,
+            purpose="sql"
         )
         
-        sql = completion.choices[0].message.content.strip()
+        sql = completion.content.strip()
         # Cleanup in case LLM ignored "no backticks" rule
         sql = sql.replace("```sql", "").replace("```", "").strip()
         
-        app_logger.info(f"SQL generated successfully: {sql[:100]}...")
         return sql
     except Exception as e:
-        app_logger.error(f"Error generating SQL: {str(e)}")
+        app_logger.error("Error generating SQL: %s", e)
         raise
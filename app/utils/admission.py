@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from app.config.settings import settings
+from app.utils.metrics import ADMISSION_REJECTIONS
+
+# Monotonic time after which the current request may no longer wait for capacity
+_request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """
+    Raised when work is shed instead of queued. status_code is 429 when the
+    LLM rate limit is exhausted and 503 when a queue is full or the wait would
+    run past the request deadline; retry_after is a hint in seconds.
+    """
+    def __init__(self, message: str, status_code: int = 503, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def wait_budget(max_wait: float) -> float:
+    """
+    Seconds the current request may still wait: max_wait, cut short by its deadline
+    """
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return max_wait
+    return min(max_wait, deadline - time.monotonic())
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded FIFO wait queue. At most `limit` callers
+    hold a slot; up to `max_queue` more wait for one, each for at most
+    `max_wait` seconds or until its request deadline. Anyone beyond that is
+    rejected at once. A limit of 0 disables the gate.
+    """
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Smoothed slot hold time (seconds), for Retry-After hints
+        self._hold_time = 1.0
+
+    def _reject(self, reason: str, message: str) -> Overloaded:
+        ADMISSION_REJECTIONS.labels(gate=self.name, reason=reason).inc()
+        # Roughly how long the work ahead of a new arrival takes to drain
+        retry_after = max(1.0, self._hold_time * (len(self._waiters) + 1) / max(self.limit, 1))
+        return Overloaded(message, 503, retry_after)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full", f"Too many requests waiting for {self.name} capacity")
+        timeout = wait_budget(self.max_wait)
+        if timeout <= 0:
+            raise self._reject("deadline", f"Request deadline passed before {self.name} capacity was free")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self._forget(waiter)
+            raise
+        if not waiter.done():
+            self._forget(waiter)
+            raise self._reject("timeout", f"Timed out after {timeout:.1f}s waiting for {self.name} capacity")
+
+    def _forget(self, waiter: asyncio.Future):
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        # Hand the slot straight to the next waiter so newcomers can't overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.limit <= 0:
+            yield
+            return
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_time = 0.8 * self._hold_time + 0.2 * (time.monotonic() - started)
+            self.release()
+
+    def has_capacity(self) -> bool:
+        return self.limit <= 0 or (self.active < self.limit and not self._waiters)
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "queued": len(self._waiters), "limit": self.limit}
+
+
+class TokenBucket:
+    """
+    Request rate limiter: holds up to `burst` tokens, refilled at `rate` per
+    second. A caller reserves a token and sleeps until it is due if that fits
+    in its wait budget, otherwise it is rejected with 429 and the time until
+    a token frees up. A rate of 0 disables the limiter.
+    """
+    def __init__(self, name: str, rate: float, burst: float, max_wait: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self, cost: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        return self._tokens >= cost
+
+    async def acquire(self, cost: float = 1.0):
+        if self.rate <= 0:
+            return
+        self._refill()
+        # Tokens go negative while reserved by callers still sleeping
+        self._tokens -= cost
+        if self._tokens >= 0:
+            return
+        wait = -self._tokens / self.rate
+        if wait > wait_budget(self.max_wait):
+            self._tokens += cost
+            ADMISSION_REJECTIONS.labels(gate=self.name, reason="rate_limited").inc()
+            raise Overloaded(f"{self.name} rate limit reached", 429, wait)
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._tokens += cost
+            raise
+
+
+# Whole questions (or batches) processed at once
+request_gate = AdmissionGate(
+    "request", settings.ADMISSION_MAX_REQUESTS, settings.ADMISSION_QUEUE_SIZE, settings.ADMISSION_QUEUE_TIMEOUT
+)
+# Provider calls in flight, and their rate against the provider quota
+llm_gate = AdmissionGate("llm", settings.LLM_MAX_CONCURRENCY, settings.LLM_QUEUE_SIZE, settings.LLM_QUEUE_TIMEOUT)
+llm_rate_limiter = TokenBucket(
+    "llm", settings.LLM_RATE_LIMIT_RPM / 60, settings.LLM_RATE_LIMIT_BURST, settings.LLM_QUEUE_TIMEOUT
+)
+# Statements running on the analytics pool; kept at or below its size so checkouts never block
+db_gate = AdmissionGate("db", settings.DB_MAX_CONCURRENCY, settings.DB_QUEUE_SIZE, settings.DB_QUEUE_TIMEOUT)
+# Statements the planner judged expensive, so a few of them can't take every DB slot
+db_slow_gate = AdmissionGate(
+    "db_slow", settings.DB_SLOW_MAX_CONCURRENCY, settings.DB_SLOW_QUEUE_SIZE, settings.DB_SLOW_QUEUE_TIMEOUT
+)
+
+
+@asynccontextmanager
+async def admit_request():
+    """
+    Hold a request slot and start the request's deadline, which caps every
+    later wait for LLM or DB capacity made on its behalf
+    """
+    async with request_gate.slot():
+        # Restored by value: a streamed response may finish in a copy of the context it started in
+        previous = _request_deadline.get()
+        _request_deadline.set(time.monotonic() + settings.ADMISSION_REQUEST_DEADLINE)
+        try:
+            yield
+        finally:
+            _request_deadline.set(previous)
+
+
+@asynccontextmanager
+async def llm_slot():
+    await llm_rate_limiter.acquire()
+    async with llm_gate.slot():
+        yield
+
+
+@asynccontextmanager
+async def db_slot(slow: bool = False):
+    """
+    A slot at the DB gate; slow-queue statements first wait for a slow slot
+    """
+    if not slow:
+        async with db_gate.slot():
+            yield
+        return
+    async with db_slow_gate.slot(), db_gate.slot():
+        yield
+
+
+def llm_has_capacity() -> bool:
+    """
+    Whether an LLM call could start now without waiting on the rate limiter or the gate
+    """
+    return llm_rate_limiter.available() and llm_gate.has_capacity()
+
+
+def gate_stats() -> Dict[str, Dict[str, int]]:
+    return {gate.name: gate.stats() for gate in (request_gate, llm_gate, db_gate, db_slow_gate)}
@@ -0,0 +1,21 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from app.config.settings import settings
+
+# Bounded pool for CPU-bound or blocking work that must not run on the event loop
+_executor = ThreadPoolExecutor(max_workers=settings.CPU_EXECUTOR_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking callable on the shared bounded executor and await its
+    result. It runs in a copy of the caller's context, so context variables
+    such as the request id reach its log lines.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
@@ -0,0 +1,50 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+from typing import Any, Dict
+
+from app.config.settings import settings
+from app.utils.logger import app_logger
+
+if settings.CURSOR_SECRET:
+    _SECRET = settings.CURSOR_SECRET.encode("utf-8")
+else:
+    # Tokens then only verify on the worker that issued them
+    _SECRET = secrets.token_bytes(32)
+    app_logger.warning("CURSOR_SECRET is not set; result cursors will not be portable across workers")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    """
+    Serialise and sign a cursor payload as an opaque URL-safe token
+    """
+    body = json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    signature = hmac.new(_SECRET, body, hashlib.sha256).digest()
+    return f"{_b64encode(body)}.{_b64encode(signature)}"
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """
+    Verify and decode a token from encode_cursor(); raises ValueError if it
+    is malformed or was not issued with our secret
+    """
+    try:
+        body_part, signature_part = token.split(".", 1)
+        body = _b64decode(body_part)
+        signature = _b64decode(signature_part)
+    except Exception:
+        raise ValueError("Malformed cursor")
+    expected = hmac.new(_SECRET, body, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid cursor signature")
+    return json.loads(body)
@@ -0,0 +1,46 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Union
+
+Number = Union[int, float, Decimal]
+
+
+def format_indian_number(value: Number, decimals: int = 2) -> str:
+    """
+    Format a number with Indian digit grouping (12,34,567.89). Integers are
+    printed without decimals.
+    """
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        digits, fraction = str(abs(value)), ""
+    else:
+        quantum = Decimal(1).scaleb(-decimals)
+        rounded = Decimal(str(value)).quantize(quantum, rounding=ROUND_HALF_UP)
+        text = f"{abs(rounded):f}"
+        digits, _, fraction = text.partition(".")
+    negative = value < 0
+
+    if len(digits) > 3:
+        head, tail = digits[:-3], digits[-3:]
+        groups = []
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        if head:
+            groups.insert(0, head)
+        digits = ",".join(groups + [tail])
+
+    formatted = f"{digits}.{fraction}" if fraction else digits
+    return f"-{formatted}" if negative else formatted
+
+
+def format_inr(value: Number, decimals: int = 2) -> str:
+    """
+    Format an amount as Indian rupees, e.g. ₹1,23,456.00
+    """
+    if isinstance(value, int):
+        value = Decimal(value)
+    formatted = format_indian_number(value, decimals)
+    if formatted.startswith("-"):
+        return f"-₹{formatted[1:]}"
+    return f"₹{formatted}"
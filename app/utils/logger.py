@@ -1,41 +1,237 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import queue
 import sys
-from datetime import datetime
-from typing import Optional
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Dict, List, Optional, Tuple
 
+from app.config.settings import settings
 
-def setup_logger(name: str = __name__, level: int = logging.INFO) -> logging.Logger:
+# Id of the request being handled, and whether its INFO/DEBUG lines are sampled in
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("log_sampled", default=True)
+
+# Attributes every LogRecord has; anything else was passed through `extra` and goes into the JSON record
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def bind_request(request_id: str) -> Tuple[contextvars.Token, contextvars.Token]:
     """
-    Set up a logger with both file and console handlers
+    Tag log records from the current context with `request_id`, and decide
+    once for the whole request whether its INFO/DEBUG lines are kept
     """
+    sampled = settings.LOG_SAMPLE_RATE >= 1 or zlib.crc32(request_id.encode()) % 10000 < settings.LOG_SAMPLE_RATE * 10000
+    return request_id_var.set(request_id), _sampled_var.set(sampled)
+
+
+def unbind_request(tokens: Tuple[contextvars.Token, contextvars.Token]):
+    request_id_var.reset(tokens[0])
+    _sampled_var.reset(tokens[1])
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Runs on the calling thread: stamps the request id, drops INFO/DEBUG lines
+    of requests that were not sampled, and caps how often each message
+    template is logged below WARNING. The number of lines a template had
+    suppressed is reported on its next emitted line.
+    """
+    def __init__(self, rate_limit: int):
+        super().__init__()
+        self.rate_limit = rate_limit
+        # template -> (window start second, lines emitted in it, lines suppressed since the last emit)
+        self._windows: Dict[Tuple[str, object], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        if record.levelno >= logging.WARNING:
+            return True
+        if not _sampled_var.get():
+            return False
+        if self.rate_limit <= 0:
+            return True
+        key = (record.name, record.msg)
+        if key not in self._windows and len(self._windows) >= 4096:
+            # Templates are few when messages use %-style arguments; this only guards against f-strings
+            self._windows.clear()
+        second = int(time.monotonic())
+        window = self._windows.get(key)
+        if window is None or window[0] != second:
+            suppressed = window[2] if window is not None else 0
+            window = self._windows[key] = [second, 0, suppressed]
+        if window[1] >= self.rate_limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.suppressed = window[2]
+            window[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: timestamp, level, logger, message, request id,
+    any fields passed through `extra`, and the traceback when there is one
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "request_id", "-") != "-":
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_traceback_formatter = logging.Formatter()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks the caller: when the writer thread falls behind and the
+    queue is full, the record is dropped and counted instead
+    """
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, since they may change after the call, but keep the traceback separate
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def dropped_log_records() -> int:
+    return _DroppingQueueHandler.dropped
+
+
+_listener: Optional[QueueListener] = None
+
+
+def _output_handlers(formatter: logging.Formatter) -> List[logging.Handler]:
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if settings.LOG_FILE:
+        try:
+            if settings.LOG_MAX_BYTES > 0:
+                file_handler = RotatingFileHandler(
+                    settings.LOG_FILE, maxBytes=settings.LOG_MAX_BYTES,
+                    backupCount=settings.LOG_BACKUP_COUNT, encoding="utf-8"
+                )
+            else:
+                file_handler = TimedRotatingFileHandler(
+                    settings.LOG_FILE, when=settings.LOG_ROTATE_WHEN,
+                    backupCount=settings.LOG_BACKUP_COUNT, encoding="utf-8"
+                )
+            handlers.append(file_handler)
+        except OSError:
+            # If the logs directory doesn't exist, just use console
+            pass
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def setup_logger(name: str = __name__, level: Optional[str] = None) -> logging.Logger:
+    """
+    Set up a logger whose records are queued on the calling thread and
+    written to the console and the rotating log file by a background thread
+    """
+    global _listener
     logger = logging.getLogger(name)
-    logger.setLevel(level)
-    
+    logger.setLevel(level or settings.LOG_LEVEL)
+
     # Avoid adding handlers multiple times
     if logger.handlers:
         return logger
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
-    # File handler (optional)
-    try:
-        file_handler = logging.FileHandler(f"logs/app_{datetime.now().strftime('%Y%m%d')}.log")
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    except:
-        # If logs directory doesn't exist, just use console
-        pass
-    
+
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(settings.LOG_RATE_LIMIT))
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, *_output_handlers(formatter), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
     return logger
 
 
+def stop_logging():
+    """
+    Flush queued records and stop the writer thread
+    """
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving each HTTP request a request id (the caller's
+    X-Request-ID, or a new one) for its log lines, echoed back in the
+    response headers
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or new_request_id()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        tokens = bind_request(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            unbind_request(tokens)
+
+
 # Global logger instance
-app_logger = setup_logger("standard_insights")
\ No newline at end of file
+app_logger = setup_logger("standard_insights")
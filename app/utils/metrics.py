@@ -0,0 +1,201 @@
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "standard_insights_stage_seconds",
+    "Time spent in each stage of answering a question",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+
+QUERY_OUTCOMES = Counter(
+    "standard_insights_query_outcomes_total",
+    "Questions by how processing ended",
+    ["outcome"]
+)
+
+LLM_REQUESTS = Counter(
+    "standard_insights_llm_requests_total",
+    "LLM calls by result (ok, retry, error, timeout)",
+    ["model", "result"]
+)
+
+LLM_TOKENS = Counter(
+    "standard_insights_llm_tokens_total",
+    "LLM tokens used as reported by the provider, by kind (prompt, completion)",
+    ["model", "kind"]
+)
+
+LLM_HEDGES = Counter(
+    "standard_insights_llm_hedges_total",
+    "Hedged LLM requests by purpose and event (sent, skipped, primary_won, hedge_won)",
+    ["purpose", "event"]
+)
+
+LLM_FALLBACKS = Counter(
+    "standard_insights_llm_fallbacks_total",
+    "Calls answered by the fallback model after the primary timed out or was unavailable",
+    ["purpose"]
+)
+
+COALESCED_CALLS = Counter(
+    "standard_insights_coalesced_calls_total",
+    "Calls that attached to an identical in-flight computation instead of running their own",
+    ["flight"]
+)
+
+PLANNER_DECISIONS = Counter(
+    "standard_insights_planner_decisions_total",
+    "Generated queries by cost guard decision (ok, slow, rewritten, rejected, unplanned)",
+    ["decision"]
+)
+
+ROLLUP_QUERIES = Counter(
+    "standard_insights_rollup_queries_total",
+    "Queries rewritten to read a rollup, by rollup and result (hit, stale, error)",
+    ["rollup", "result"]
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "standard_insights_admission_rejections_total",
+    "Work shed by admission control, by gate (request, llm, db, db_slow) and reason",
+    ["gate", "reason"]
+)
+
+
+def record_outcome(outcome: str):
+    QUERY_OUTCOMES.labels(outcome=outcome).inc()
+
+
+def record_llm_usage(model: str, usage: Dict[str, int]):
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.labels(model=model, kind=kind).inc(tokens)
+
+
+class StageTimer:
+    """
+    Times the stages of one request. Each stage is observed in the stage
+    histogram and kept for the optional per-request breakdown.
+    """
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        STAGE_SECONDS.labels(stage=name).observe(seconds)
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def finish(self):
+        if "total" not in self.timings:
+            self.record("total", time.perf_counter() - self._started)
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+
+
+class _StateCollector:
+    """
+    Cache statistics and connection pool occupancy, read at scrape time
+    """
+    def describe(self):
+        # Without this the registry would call collect() at registration, before the services exist
+        return []
+
+    def collect(self):
+        # Imported here: the services being observed import this module
+        from app.models.database.connection import pool_stats
+        from app.models.query.query_planner import query_planner
+        from app.models.query.result_cache import result_cache
+        from app.models.rollup.store import rollup_store
+        from app.services.safety_service import sql_validator
+        from app.services.sql_cache import sql_cache
+        from app.utils.admission import gate_stats
+        from app.utils.logger import dropped_log_records
+
+        lookups = CounterMetricFamily(
+            "standard_insights_cache_lookups", "Cache lookups by cache and result", labels=["cache", "result"]
+        )
+        entries = GaugeMetricFamily("standard_insights_cache_entries", "Entries held per cache", labels=["cache"])
+        for name, stats in (("sql", sql_cache.stats()), ("result", result_cache.stats()),
+                            ("validation", sql_validator.stats()), ("plan", query_planner.stats()),
+                            ("rollup", rollup_store.stats())):
+            for key, result in (("hits", "hit"), ("near_hits", "near_hit"), ("misses", "miss")):
+                if key in stats:
+                    lookups.add_metric([name, result], stats[key])
+            entries.add_metric([name], stats["entries"])
+        yield lookups
+        yield entries
+        yield GaugeMetricFamily(
+            "standard_insights_result_cache_bytes", "Approximate size of the result cache", value=result_cache.stats()["bytes"]
+        )
+        age = GaugeMetricFamily(
+            "standard_insights_rollup_age_seconds", "Seconds since each rollup was last refreshed", labels=["rollup"]
+        )
+        for name, seconds in rollup_store.ages().items():
+            age.add_metric([name], seconds)
+        yield age
+
+        checked_out = GaugeMetricFamily(
+            "standard_insights_db_pool_checked_out", "Connections currently in use", labels=["engine"]
+        )
+        capacity = GaugeMetricFamily(
+            "standard_insights_db_pool_capacity", "Pool size plus allowed overflow", labels=["engine"]
+        )
+        overflow = GaugeMetricFamily(
+            "standard_insights_db_pool_overflow", "Connections open beyond the pool size", labels=["engine"]
+        )
+        healthy = GaugeMetricFamily(
+            "standard_insights_db_host_healthy", "Whether an analytics host is in rotation", labels=["engine"]
+        )
+        for name, stats in pool_stats().items():
+            if "checked_out" in stats:
+                checked_out.add_metric([name], stats["checked_out"])
+                capacity.add_metric([name], stats["capacity"])
+                overflow.add_metric([name], stats["overflow"])
+            if "healthy" in stats:
+                healthy.add_metric([name], 1 if stats["healthy"] else 0)
+        yield checked_out
+        yield capacity
+        yield overflow
+        yield healthy
+
+        active = GaugeMetricFamily("standard_insights_admission_active", "Slots in use per admission gate", labels=["gate"])
+        queued = GaugeMetricFamily("standard_insights_admission_queued", "Callers waiting per admission gate", labels=["gate"])
+        for name, stats in gate_stats().items():
+            active.add_metric([name], stats["active"])
+            queued.add_metric([name], stats["queued"])
+        yield active
+        yield queued
+        yield CounterMetricFamily(
+            "standard_insights_log_records_dropped", "Log records dropped because the log queue was full",
+            value=dropped_log_records()
+        )
+
+
+REGISTRY.register(_StateCollector())
+
+
+def render_metrics() -> bytes:
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    return generate_latest(REGISTRY)
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
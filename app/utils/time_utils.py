@@ -1,10 +1,22 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 import pytz
 
+def current_date():
+    """
+    Today's date in IST, the business timezone
+    """
+    return datetime.now(pytz.timezone('Asia/Kolkata')).date()
+
 def get_time_context():
-    tz = pytz.timezone('Asia/Kolkata')
-    now = datetime.now(tz)
-    today = now.date()
+    """
+    Date context for the SQL prompt. It only changes at midnight IST, so it
+    is built once per day and the same string is reused until then.
+    """
+    return _time_context_for(current_date())
+
+@lru_cache(maxsize=2)
+def _time_context_for(today):
     yesterday = today - timedelta(days=1)
     
     # Last month
@@ -0,0 +1,93 @@
+import asyncio
+import importlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.utils.concurrency import run_blocking
+from app.utils.logger import app_logger
+
+# Backoff bounds (seconds) between attempts of a required step that failed
+_RETRY_DELAY = 1.0
+_MAX_RETRY_DELAY = 30.0
+
+
+class Warmup:
+    """
+    Startup work run in the background once the server is listening, so
+    liveness answers at once while the process gets ready for traffic.
+    Heavy modules are imported first, off the event loop; the steps then run
+    concurrently, each under `step_timeout`. The process is ready when every
+    step has finished and every required step has succeeded; required steps
+    are retried until they do. An optional step that fails is reported and
+    left to the lazy first-use path.
+    """
+    def __init__(self, step_timeout: float):
+        self.step_timeout = step_timeout
+        self.modules: List[str] = []
+        self._steps: List[Tuple[str, Callable[[], Awaitable[Any]], bool]] = []
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self.ready = False
+
+    def preload(self, *modules: str):
+        self.modules.extend(modules)
+
+    def add_step(self, name: str, work: Callable[[], Awaitable[Any]], required: bool = False):
+        self._steps.append((name, work, required))
+        self._status[name] = {"state": "pending", "required": required}
+
+    def _import_modules(self):
+        for module in self.modules:
+            importlib.import_module(module)
+
+    async def _attempt(self, name: str, work: Callable[[], Awaitable[Any]]) -> bool:
+        status = self._status[name]
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(work(), self.step_timeout)
+        except asyncio.TimeoutError:
+            status.update(state="failed", error=f"timed out after {self.step_timeout}s")
+        except Exception as e:
+            status.update(state="failed", error=str(e))
+        else:
+            status.update(state="ok")
+            status.pop("error", None)
+        status["ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if status["state"] == "ok":
+            app_logger.info("Warm-up step %s done in %.1f ms", name, status["ms"])
+            return True
+        app_logger.warning("Warm-up step %s failed: %s", name, status["error"])
+        return False
+
+    async def _run_step(self, name: str, work: Callable[[], Awaitable[Any]], required: bool):
+        delay = _RETRY_DELAY
+        while not await self._attempt(name, work) and required:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+    async def run(self):
+        self._started = time.perf_counter()
+        # Imports hold the GIL, so they run once up front instead of racing each other inside the steps
+        await run_blocking(self._import_modules)
+        await asyncio.gather(*(self._run_step(name, work, required) for name, work, required in self._steps))
+        self._finished = time.perf_counter()
+        self.ready = True
+        app_logger.info("Warm-up finished in %.1f ms, ready for traffic", (self._finished - self._started) * 1000)
+
+    def mark_ready(self):
+        """
+        Skip the warm-up: report ready straight away
+        """
+        self.ready = True
+
+    def status(self) -> Dict[str, Any]:
+        status: Dict[str, Any] = {"ready": self.ready, "steps": {name: dict(step) for name, step in self._status.items()}}
+        if self._started is not None:
+            end = self._finished if self._finished is not None else time.perf_counter()
+            status["elapsed_ms"] = round((end - self._started) * 1000, 1)
+        return status
+
+
+warmup = Warmup(settings.WARMUP_STEP_TIMEOUT)
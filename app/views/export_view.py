@@ -0,0 +1,112 @@
+import csv
+import datetime
+import decimal
+import io
+import json
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+ColumnChunks = AsyncIterator[Tuple[List[str], List[Optional[str]], List[list]]]
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _as_text(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+async def encode_ndjson(chunks: ColumnChunks) -> AsyncIterator[bytes]:
+    async for keys, _, columns in chunks:
+        if not columns or not columns[0]:
+            continue
+        lines = [
+            json.dumps(dict(zip(keys, row)), default=_json_default, ensure_ascii=False)
+            for row in zip(*columns)
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def encode_csv(chunks: ColumnChunks) -> AsyncIterator[bytes]:
+    header_written = False
+    async for keys, _, columns in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow(keys)
+            header_written = True
+        if columns and columns[0]:
+            writer.writerows(zip(*columns))
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def encode_arrow(chunks: ColumnChunks) -> AsyncIterator[bytes]:
+    """
+    Arrow IPC stream, one record batch per chunk. The schema comes from the
+    column types of the first chunk, so it holds for every batch whatever
+    the values (a column that starts out all NULL, say). Decimals are
+    written as float64, and columns of unknown type as strings. Requires
+    pyarrow.
+    """
+    import pyarrow as pa
+
+    arrow_types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "decimal": pa.float64(),
+        "date": pa.date32(),
+        "datetime": pa.timestamp("us"),
+        "time": pa.duration("us"),
+        "null": pa.null(),
+        "string": pa.string()
+    }
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+    async for keys, types, columns in chunks:
+        if schema is None:
+            schema = pa.schema([(key, arrow_types.get(kind, pa.string())) for key, kind in zip(keys, types)])
+            writer = pa.ipc.new_stream(sink, schema)
+        if not columns or not columns[0]:
+            continue
+        arrays = []
+        for column, field in zip(columns, schema):
+            if pa.types.is_string(field.type):
+                column = [_as_text(v) for v in column]
+            elif pa.types.is_floating(field.type):
+                column = [float(v) if isinstance(v, decimal.Decimal) else v for v in column]
+            arrays.append(pa.array(column, type=field.type))
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is None:
+        # The query produced no chunks at all
+        writer = pa.ipc.new_stream(sink, pa.schema([]))
+    writer.close()
+    yield sink.getvalue()
+
+
+EXPORT_ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "arrow": encode_arrow
+}
@@ -0,0 +1,13 @@
+import json
+from typing import Any, Dict
+
+from fastapi.encoders import jsonable_encoder
+
+
+def format_sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """
+    Encode one Server-Sent Event. Payloads go through jsonable_encoder so DB
+    values such as Decimal and date serialise the same way as in /ask.
+    """
+    data = json.dumps(jsonable_encoder(payload), ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n"
@@ -0,0 +1,137 @@
+import datetime
+from typing import Dict, List
+
+
+def _month_bounds(today: datetime.date, months_back: int):
+    first = today.replace(day=1)
+    for _ in range(months_back):
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+    next_first = (first + datetime.timedelta(days=32)).replace(day=1)
+    return first, next_first - datetime.timedelta(days=1)
+
+
+def build_corpus(today: datetime.date = None) -> List[Dict[str, str]]:
+    """
+    Benchmark questions with the SQL the fake LLM returns for each and a
+    canned natural-language answer. Dates are resolved against `today` the
+    way the date context in the real prompt would have them.
+    """
+    today = today or datetime.date.today()
+    last_start, last_end = _month_bounds(today, 1)
+    this_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    week_start = today - datetime.timedelta(days=today.weekday() + 7)
+    week_end = week_start + datetime.timedelta(days=6)
+
+    return [
+        {
+            "question": "What is the total sales value of last month?",
+            "sql": f"SELECT SUM(total_cost) FROM data_so_summary WHERE so_date BETWEEN '{last_start}' AND '{last_end}'",
+            "answer": "The total sales value for last month was as shown."
+        },
+        {
+            "question": "How many orders did we get this month?",
+            "sql": f"SELECT COUNT(*) AS total_orders FROM data_so_summary WHERE so_date >= '{this_start}'",
+            "answer": "This month we received the orders shown."
+        },
+        {
+            "question": "Total sales last week",
+            "sql": f"SELECT SUM(total_cost) FROM data_so_summary WHERE so_date BETWEEN '{week_start}' AND '{week_end}'",
+            "answer": "Last week's sales are shown above."
+        },
+        {
+            "question": "Top 5 customers by revenue this year",
+            "sql": (
+                "SELECT c.company_name, SUM(s.total_cost) AS revenue FROM data_so_summary AS s "
+                "JOIN data_company_info AS c ON s.client_id = c.dci_id "
+                f"WHERE s.so_date >= '{year_start}' GROUP BY c.company_name ORDER BY revenue DESC LIMIT 5"
+            ),
+            "answer": "These are the top customers by revenue."
+        },
+        {
+            "question": "Monthly sales this year",
+            "sql": (
+                "SELECT MONTH(so_date) AS month, SUM(total_cost) AS sales FROM data_so_summary "
+                f"WHERE so_date >= '{year_start}' GROUP BY MONTH(so_date) ORDER BY month"
+            ),
+            "answer": "Monthly sales for this year are listed."
+        },
+        {
+            "question": "Which cities have the most customers?",
+            "sql": (
+                "SELECT city, COUNT(*) AS customers FROM data_company_info "
+                "GROUP BY city ORDER BY customers DESC LIMIT 10"
+            ),
+            "answer": "Customer counts by city are listed."
+        },
+        {
+            "question": "Average order value last month",
+            "sql": (
+                "SELECT AVG(total_cost) AS average_order_value FROM data_so_summary "
+                f"WHERE so_date BETWEEN '{last_start}' AND '{last_end}'"
+            ),
+            "answer": "The average order value last month is shown."
+        },
+        {
+            "question": "Top 10 products by quantity sold this year",
+            "sql": (
+                "SELECT v.variant_name, SUM(d.quantity) AS units FROM data_so_details AS d "
+                "JOIN data_so_summary AS s ON d.so_id = s.dsosu_id "
+                "JOIN data_prod_variant AS v ON d.sku_id = v.dprodv_id "
+                f"WHERE s.so_date >= '{year_start}' GROUP BY v.variant_name ORDER BY units DESC LIMIT 10"
+            ),
+            "answer": "The best-selling products are listed."
+        },
+        {
+            "question": "Sales by brand this year",
+            "sql": (
+                "SELECT v.brand, SUM(d.quantity * d.unit_price) AS revenue FROM data_so_details AS d "
+                "JOIN data_so_summary AS s ON d.so_id = s.dsosu_id "
+                "JOIN data_prod_variant AS v ON d.sku_id = v.dprodv_id "
+                f"WHERE s.so_date >= '{year_start}' GROUP BY v.brand ORDER BY revenue DESC"
+            ),
+            "answer": "Revenue by brand is listed."
+        },
+        {
+            "question": "How many pending orders are there?",
+            "sql": "SELECT COUNT(*) AS pending_orders FROM data_so_summary WHERE status = 'Pending'",
+            "answer": "The number of pending orders is shown."
+        },
+        {
+            "question": "List the 20 most recent orders",
+            "sql": "SELECT dsosu_id, so_date, total_cost FROM data_so_summary ORDER BY so_date DESC LIMIT 20",
+            "answer": "The most recent orders are listed."
+        },
+        {
+            "question": "Total sales for customers in Maharashtra last month",
+            "sql": (
+                "SELECT SUM(s.total_cost) FROM data_so_summary AS s "
+                "JOIN data_company_info AS c ON s.client_id = c.dci_id "
+                f"WHERE c.state = 'Maharashtra' AND s.so_date BETWEEN '{last_start}' AND '{last_end}'"
+            ),
+            "answer": "Sales for Maharashtra customers last month are shown."
+        },
+        {
+            "question": "Why did sales drop compared to last year?",
+            "sql": (
+                "SELECT YEAR(so_date) AS year, SUM(total_cost) AS sales FROM data_so_summary "
+                "GROUP BY YEAR(so_date) ORDER BY year"
+            ),
+            "answer": "Sales by year are compared above; the change comes from fewer orders."
+        },
+        {
+            "question": "Orders per status",
+            "sql": "SELECT status, COUNT(*) AS orders FROM data_so_summary GROUP BY status",
+            "answer": "Order counts by status are listed."
+        },
+        {
+            "question": "Show me everything about our best customer",
+            "sql": "__NEED_CLARIFICATION__",
+            "answer": ""
+        },
+        {
+            "question": "What is the weather in Mumbai today?",
+            "sql": "__NOT_DB__",
+            "answer": ""
+        }
+    ]
@@ -0,0 +1,62 @@
+import asyncio
+import random
+import re
+from typing import AsyncIterator, Dict, List
+
+from app.services.llm_client import LLMCompletion
+from app.services.prompt_compiler import count_tokens
+from app.services.sql_generation_service import SYSTEM_PROMPT
+
+_QUESTION_RE = re.compile(r"USER QUESTION: (.*)")
+
+
+class BenchmarkLLMBackend:
+    """
+    Deterministic LLM stand-in for benchmarks. SQL-generation calls (those
+    carrying the SQL system prompt) return the fixture SQL for the question;
+    response calls return its canned answer. Each call sleeps for latency_ms
+    plus up to jitter_ms, drawn from a seeded generator; a slow_rate fraction
+    of calls also stalls for slow_ms, the tail that hedging is meant to cut.
+    """
+    def __init__(self, corpus: List[Dict[str, str]], latency_ms: float = 300, jitter_ms: float = 0,
+                 seed: int = 7, slow_rate: float = 0, slow_ms: float = 0):
+        self.sql_fixtures = {item["question"]: item["sql"] for item in corpus}
+        self.answers = {item["question"]: item["answer"] for item in corpus}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self._rng = random.Random(seed)
+
+    def _delay(self) -> float:
+        delay_ms = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+        if self._rng.random() < self.slow_rate:
+            delay_ms += self.slow_ms
+        return delay_ms / 1000
+
+    def _respond(self, messages: List[Dict[str, str]]) -> str:
+        match = _QUESTION_RE.search(messages[-1]["content"])
+        question = match.group(1).strip() if match else ""
+        if messages[0]["content"] == SYSTEM_PROMPT:
+            return self.sql_fixtures.get(question, "__NEED_CLARIFICATION__")
+        return self.answers.get(question) or "Here is the result."
+
+    async def complete(self, messages: List[Dict[str, str]], model: str, temperature: float) -> LLMCompletion:
+        await asyncio.sleep(self._delay())
+        content = self._respond(messages)
+        usage = {
+            "prompt_tokens": sum(count_tokens(m["content"]) for m in messages),
+            "completion_tokens": count_tokens(content)
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return LLMCompletion(content, model, usage)
+
+    async def stream(self, messages: List[Dict[str, str]], model: str, temperature: float) -> AsyncIterator[str]:
+        words = self._respond(messages).split(" ")
+        delay = self._delay() / max(len(words), 1)
+        for word in words:
+            await asyncio.sleep(delay)
+            yield word + " "
+
+    async def aclose(self):
+        pass
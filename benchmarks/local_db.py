@@ -0,0 +1,184 @@
+import datetime
+import random
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+import sqlglot
+
+from app.utils.concurrency import run_blocking
+
+# Same tables and key columns the SQL prompt describes, with a few descriptive columns each
+TABLES = {
+    "data_company_info": [
+        ("dci_id", "int", "INTEGER PRIMARY KEY", True, None),
+        ("company_name", "varchar", "TEXT NOT NULL", False, None),
+        ("city", "varchar", "TEXT", False, None),
+        ("state", "varchar", "TEXT", False, None),
+        ("gst_number", "varchar", "TEXT", False, None),
+        ("created_at", "datetime", "TEXT", False, None)
+    ],
+    "data_prod_variant": [
+        ("dprodv_id", "int", "INTEGER PRIMARY KEY", True, None),
+        ("variant_name", "varchar", "TEXT NOT NULL", False, None),
+        ("brand", "varchar", "TEXT", False, None),
+        ("mrp", "decimal", "REAL", False, None)
+    ],
+    "data_so_summary": [
+        ("dsosu_id", "int", "INTEGER PRIMARY KEY", True, None),
+        ("so_date", "date", "TEXT NOT NULL", False, None),
+        ("client_id", "int", "INTEGER NOT NULL", False, "data_company_info.dci_id"),
+        ("total_cost", "decimal", "REAL", False, None),
+        ("price", "decimal", "REAL", False, None),
+        ("status", "varchar", "TEXT", False, None)
+    ],
+    "data_so_details": [
+        ("sod_id", "int", "INTEGER PRIMARY KEY", True, None),
+        ("so_id", "int", "INTEGER NOT NULL", False, "data_so_summary.dsosu_id"),
+        ("sku_id", "int", "INTEGER NOT NULL", False, "data_prod_variant.dprodv_id"),
+        ("quantity", "int", "INTEGER", False, None),
+        ("unit_price", "decimal", "REAL", False, None)
+    ]
+}
+
+INDEXES = [
+    "CREATE INDEX idx_so_date ON data_so_summary (so_date)",
+    "CREATE INDEX idx_so_client ON data_so_summary (client_id)",
+    "CREATE INDEX idx_sod_so ON data_so_details (so_id)"
+]
+
+CITIES = [("Mumbai", "Maharashtra"), ("Pune", "Maharashtra"), ("Bengaluru", "Karnataka"), ("Chennai", "Tamil Nadu"),
+          ("Delhi", "Delhi"), ("Hyderabad", "Telangana"), ("Ahmedabad", "Gujarat"), ("Kolkata", "West Bengal")]
+BRANDS = ["Acme", "Zenith", "Orbit", "Nova", "Apex", "Vertex"]
+STATUSES = ["Completed", "Completed", "Completed", "Pending", "Cancelled"]
+
+
+def seed(path: str, scale: float = 1.0, seed_value: int = 7, today: datetime.date = None) -> Dict[str, int]:
+    """
+    Create and fill the four tables at `path`. At scale 1: 200 customers,
+    500 product variants, 5,000 orders over the last 400 days and about
+    15,000 order lines. Deterministic for a given seed and date.
+    """
+    rng = random.Random(seed_value)
+    today = today or datetime.date.today()
+    counts = {
+        "data_company_info": max(1, int(200 * scale)),
+        "data_prod_variant": max(1, int(500 * scale)),
+        "data_so_summary": max(1, int(5000 * scale))
+    }
+
+    conn = sqlite3.connect(path)
+    try:
+        for table, columns in TABLES.items():
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {ddl}' for name, _, ddl, _, _ in columns)})")
+        for statement in INDEXES:
+            conn.execute(statement)
+
+        customers = []
+        for i in range(1, counts["data_company_info"] + 1):
+            city, state = rng.choice(CITIES)
+            created = today - datetime.timedelta(days=rng.randint(400, 1500))
+            customers.append((i, f"Company {i:04d}", city, state, f"27AAAC{i:05d}Z", f"{created} 10:00:00"))
+        conn.executemany("INSERT INTO data_company_info VALUES (?, ?, ?, ?, ?, ?)", customers)
+
+        variants = [
+            (i, f"Variant {i:04d}", rng.choice(BRANDS), round(rng.uniform(50, 5000), 2))
+            for i in range(1, counts["data_prod_variant"] + 1)
+        ]
+        conn.executemany("INSERT INTO data_prod_variant VALUES (?, ?, ?, ?)", variants)
+
+        orders, lines = [], []
+        for order_id in range(1, counts["data_so_summary"] + 1):
+            total = 0.0
+            for _ in range(rng.randint(1, 5)):
+                variant = rng.choice(variants)
+                quantity = rng.randint(1, 20)
+                unit_price = round(variant[3] * rng.uniform(0.8, 1.0), 2)
+                total += quantity * unit_price
+                lines.append((len(lines) + 1, order_id, variant[0], quantity, unit_price))
+            so_date = today - datetime.timedelta(days=rng.randint(0, 400))
+            orders.append((order_id, str(so_date), rng.randint(1, len(customers)), round(total, 2),
+                           round(total / 1.18, 2), rng.choice(STATUSES)))
+        conn.executemany("INSERT INTO data_so_summary VALUES (?, ?, ?, ?, ?, ?)", orders)
+        conn.executemany("INSERT INTO data_so_details VALUES (?, ?, ?, ?, ?)", lines)
+        conn.commit()
+        counts["data_so_details"] = len(lines)
+        return counts
+    finally:
+        conn.close()
+
+
+def schema_snippets() -> List[Dict[str, Any]]:
+    """
+    Schema snippets in the shape fetch_schema() builds from INFORMATION_SCHEMA
+    """
+    snippets = []
+    for table, columns in TABLES.items():
+        infos = []
+        meta = []
+        for name, dtype, ddl, primary_key, references in columns:
+            nullable = "NOT NULL" not in ddl and not primary_key
+            info = f"{name} ({dtype}, {'nullable' if nullable else 'not null'})"
+            if primary_key:
+                info += ", primary key"
+            elif references:
+                info += ", foreign key"
+            infos.append(info)
+            meta.append({"name": name, "type": dtype, "nullable": nullable, "comment": "",
+                         "primary_key": primary_key, "references": references})
+        column_list = "\n".join(f"  - {name}" for name, *_ in columns)
+        detailed = "\n".join(f"  - {info}" for info in infos)
+        snippets.append({
+            "table_name": table,
+            "content": f"Table: {table}\n\nAll Column Names:\n{column_list}\n\nDetailed Column Information:\n{detailed}\n",
+            "columns": meta
+        })
+    return snippets
+
+
+def _date_part(fmt: str):
+    def extract(value):
+        if value is None:
+            return None
+        return int(datetime.date.fromisoformat(str(value)[:10]).strftime(fmt))
+    return extract
+
+
+def _time_to_str(value, fmt):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(str(value)).strftime(fmt)
+
+
+class SQLiteExecutor:
+    """
+    Stand-in for the MySQL execution path: transpiles the validated MySQL
+    statement to SQLite and runs it on a per-thread connection from the
+    shared blocking pool. Matches query_executor._execute's signature so it
+    can replace it.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # MySQL functions the corpus uses that SQLite lacks
+            conn.create_function("YEAR", 1, _date_part("%Y"), deterministic=True)
+            conn.create_function("MONTH", 1, _date_part("%m"), deterministic=True)
+            conn.create_function("DAY", 1, _date_part("%d"), deterministic=True)
+            conn.create_function("TIME_TO_STR", 2, _time_to_str, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def _run(self, sql: str, limit: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+        cursor = self._connection().execute(sqlglot.transpile(sql, read="mysql", write="sqlite")[0])
+        rows = cursor.fetchmany(limit)
+        keys = [d[0] for d in cursor.description]
+        return keys, [dict(zip(keys, row)) for row in rows]
+
+    async def execute(self, sql: str, deadline: float, limit: int):
+        return await run_blocking(self._run, sql, limit)
@@ -0,0 +1,242 @@
+"""
+Offline latency and throughput benchmark.
+
+Runs the real application stack against a fake LLM with configurable
+latency and a seeded SQLite stand-in for MySQL, then reports p50/p95/p99
+latencies and QPS for /ask at several concurrency levels and for the
+internal stages (schema retrieval, SQL validation, query execution).
+
+    python -m benchmarks.run --scale 1 --requests 200 --concurrency 1,8,32 --llm-latency-ms 300
+"""
+import os
+
+# Must be set before the application modules read their settings
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ["SCHEMA_SNAPSHOT_PATH"] = ""
+os.environ["RESULT_CACHE_PROBE_INTERVAL"] = "0"
+os.environ.setdefault("CURSOR_SECRET", "benchmark")
+# The fake LLM has no provider quota to respect
+os.environ.setdefault("LLM_RATE_LIMIT_RPM", "0")
+# SQLite has no EXPLAIN FORMAT=JSON for the cost guard
+os.environ.setdefault("PLANNER_ENABLED", "false")
+# Rollups are built and switched on by --rollups
+os.environ.setdefault("ROLLUP_ENABLED", "false")
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import httpx
+import numpy as np
+
+from app.config.settings import settings
+from app.models.query import query_executor
+from app.models.query.result_cache import result_cache
+from app.models.rollup.store import rollup_store
+from app.services import schema_registry as schema_registry_module
+from app.services.llm_client import build_llm_client, set_llm_client
+from app.services.safety_service import SQLValidator, sql_validator
+from app.services.schema_registry import schema_registry
+from app.services.sql_cache import sql_cache
+from app.utils.metrics import LLM_HEDGES, ROLLUP_QUERIES
+from benchmarks.corpus import build_corpus
+from benchmarks.fake_llm import BenchmarkLLMBackend
+from benchmarks.local_db import SQLiteExecutor, schema_snippets, seed
+
+
+def summarize(latencies: List[float], elapsed: float = None) -> Dict[str, float]:
+    """
+    p50/p95/p99 in milliseconds, plus QPS when the wall time is given
+    """
+    values = np.array(latencies) * 1000
+    summary = {
+        "n": len(latencies),
+        "p50_ms": round(float(np.percentile(values, 50)), 2) if len(values) else 0.0,
+        "p95_ms": round(float(np.percentile(values, 95)), 2) if len(values) else 0.0,
+        "p99_ms": round(float(np.percentile(values, 99)), 2) if len(values) else 0.0
+    }
+    if elapsed:
+        summary["qps"] = round(len(latencies) / elapsed, 1)
+    return summary
+
+
+def print_table(title: str, rows: List[Dict[str, Any]]):
+    print(f"\n{title}")
+    if not rows:
+        print("  (no data)")
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  " + "  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  " + "  ".join(str(row.get(c, "")).rjust(widths[c]) for c in columns))
+
+
+def disable_caches():
+    # Every request then pays for SQL generation and execution
+    sql_cache.max_entries = 0
+    sql_cache.clear()
+    result_cache.default_ttl = 0
+    result_cache.table_ttls = {}
+    result_cache.clear()
+
+
+def bench_sync(name: str, func: Callable[[Any], Any], inputs: List[Any], iterations: int) -> Dict[str, Any]:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for value in inputs:
+            t0 = time.perf_counter()
+            func(value)
+            latencies.append(time.perf_counter() - t0)
+    return {"stage": name, **summarize(latencies, time.perf_counter() - started)}
+
+
+async def bench_async(name: str, func: Callable[[Any], Any], inputs: List[Any], iterations: int) -> Dict[str, Any]:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for value in inputs:
+            t0 = time.perf_counter()
+            await func(value)
+            latencies.append(time.perf_counter() - t0)
+    return {"stage": name, **summarize(latencies, time.perf_counter() - started)}
+
+
+async def bench_stages(corpus: List[Dict[str, str]], iterations: int) -> List[Dict[str, Any]]:
+    questions = [item["question"] for item in corpus]
+    statements = [item["sql"] for item in corpus if not item["sql"].startswith("__")]
+    retriever = schema_registry.get_snapshot().retriever
+    uncached_validator = SQLValidator(settings.ALLOWED_TABLES, settings.DB_NAME, cache_size=0)
+    validated = [sql_validator.validate(sql)[2] for sql in statements]
+
+    return [
+        bench_sync("SchemaRetriever.retrieve", lambda q: retriever.retrieve(q, k=3), questions, iterations),
+        bench_sync("validate_sql (uncached)", uncached_validator.validate, statements, iterations),
+        bench_sync("validate_sql (cached)", sql_validator.validate, statements, iterations),
+        await bench_async(
+            "execute_query",
+            lambda v: query_executor.execute_query(v, limit=settings.QUERY_ROW_LIMIT),
+            validated,
+            iterations
+        )
+    ]
+
+
+async def bench_ask(corpus: List[Dict[str, str]], concurrency: int, requests: int) -> Dict[str, Any]:
+    from app.main import app
+
+    latencies: List[float] = []
+    stage_latencies: Dict[str, List[float]] = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(app=app, base_url="http://benchmark", timeout=None) as client:
+        async def one(i: int):
+            nonlocal errors
+            question = corpus[i % len(corpus)]["question"]
+            async with semaphore:
+                t0 = time.perf_counter()
+                response = await client.post("/ask", json={"query": question})
+                latencies.append(time.perf_counter() - t0)
+            if response.status_code != 200:
+                errors += 1
+                return
+            for stage, ms in response.json().get("meta", {}).get("timings_ms", {}).items():
+                stage_latencies.setdefault(stage, []).append(ms / 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "summary": {"concurrency": concurrency, **summarize(latencies, elapsed), "errors": errors},
+        "stages": [{"concurrency": concurrency, "stage": s, **summarize(v)} for s, v in stage_latencies.items()]
+    }
+
+
+def counter_rows(counter) -> List[Dict[str, Any]]:
+    rows = []
+    for metric in counter.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_total"):
+                rows.append({**sample.labels, "count": int(sample.value)})
+    return rows
+
+
+async def main(args):
+    corpus = build_corpus()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="nlq-bench-"), "bench.sqlite")
+    t0 = time.perf_counter()
+    counts = seed(db_path, args.scale, args.seed)
+    print(f"Seeded {db_path} in {time.perf_counter() - t0:.1f}s: {counts}")
+
+    # Local stand-ins for INFORMATION_SCHEMA, MySQL and Groq
+    schema_registry_module.fetch_schema = schema_snippets
+    schema_registry_module.fetch_schema_signature = lambda: "benchmark"
+    schema_registry.refresh()
+    query_executor._execute = SQLiteExecutor(db_path).execute
+    if args.rollups:
+        # Built from scratch each run so they match the freshly seeded data
+        rollup_store.path = os.path.splitext(db_path)[0] + "-rollups.sqlite"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(rollup_store.path + suffix):
+                os.remove(rollup_store.path + suffix)
+        t0 = time.perf_counter()
+        await rollup_store.refresh()
+        settings.ROLLUP_ENABLED = True
+        print(f"Built rollups in {time.perf_counter() - t0:.1f}s: {rollup_store.path}")
+    set_llm_client(build_llm_client(
+        BenchmarkLLMBackend(corpus, args.llm_latency_ms, args.llm_jitter_ms, args.seed,
+                            args.llm_slow_rate, args.llm_slow_ms)
+    ))
+    settings.RESPONSE_TIMINGS_ENABLED = True
+    if not args.warm_caches:
+        disable_caches()
+
+    results: Dict[str, Any] = {"config": vars(args), "rows": counts}
+    results["stages"] = await bench_stages(corpus, args.iterations)
+    print_table("Internal stages", results["stages"])
+
+    results["ask"] = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        results["ask"].append(await bench_ask(corpus, concurrency, args.requests))
+    print_table("/ask", [r["summary"] for r in results["ask"]])
+    print_table("/ask per stage", [s for r in results["ask"] for s in r["stages"]])
+
+    results["hedges"] = counter_rows(LLM_HEDGES)
+    print_table("LLM hedges", results["hedges"])
+    if args.rollups:
+        results["rollups"] = counter_rows(ROLLUP_QUERIES)
+        print_table("Rollup queries", results["rollups"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark with a fake LLM and SQLite")
+    parser.add_argument("--scale", type=float, default=1.0, help="Data scale; 1 = 5,000 orders")
+    parser.add_argument("--requests", type=int, default=200, help="/ask requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--iterations", type=int, default=20, help="Passes over the corpus per internal stage")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Fake LLM latency per call")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0, help="Extra uniform random LLM latency")
+    parser.add_argument("--llm-slow-rate", type=float, default=0, help="Fraction of LLM calls that stall")
+    parser.add_argument("--llm-slow-ms", type=float, default=0, help="Extra latency of a stalled LLM call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--warm-caches", action="store_true", help="Keep the SQL and result caches enabled")
+    parser.add_argument("--rollups", action="store_true", help="Build the rollups and let /ask read them")
+    parser.add_argument("--db", help="SQLite file to seed (default: a temporary file)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,48 @@
+import datetime
+
+import sqlglot
+
+from app.models.query.query_planner import window_dates
+
+DATE_COLUMNS = {"data_so_summary": "so_date"}
+SINCE = datetime.date(2026, 7, 20)
+
+
+def _window(sql):
+    ast, tables = window_dates(sqlglot.parse_one(sql, read="mysql"), DATE_COLUMNS, SINCE)
+    return (ast.sql(dialect="mysql") if ast is not None else None), tables
+
+
+def test_single_table_bound_goes_in_where():
+    sql, tables = _window("SELECT SUM(total_cost) FROM data_so_summary")
+    assert sql == "SELECT SUM(total_cost) FROM data_so_summary WHERE data_so_summary.so_date >= '2026-07-20'"
+    assert tables == ["data_so_summary"]
+
+
+def test_inner_join_bound_goes_in_where():
+    sql, _ = _window(
+        "SELECT c.company_name FROM data_so_summary s JOIN data_company_info c ON s.client_id = c.dci_id"
+    )
+    assert sql.endswith("ON s.client_id = c.dci_id WHERE s.so_date >= '2026-07-20'")
+
+
+def test_left_joined_table_bound_goes_in_on_clause():
+    sql, tables = _window(
+        "SELECT c.company_name, SUM(s.total_cost) FROM data_company_info c "
+        "LEFT JOIN data_so_summary s ON s.client_id = c.dci_id GROUP BY c.company_name"
+    )
+    # Customers without recent orders must stay in the answer
+    assert "WHERE" not in sql
+    assert "LEFT JOIN data_so_summary AS s ON s.client_id = c.dci_id AND s.so_date >= '2026-07-20'" in sql
+    assert tables == ["data_so_summary"]
+
+
+def test_table_null_extended_by_right_join_is_not_restricted():
+    sql, tables = _window(
+        "SELECT c.company_name FROM data_so_summary s RIGHT JOIN data_company_info c ON s.client_id = c.dci_id"
+    )
+    assert sql is None and tables == []
+
+
+def test_no_date_table_is_not_rewritten():
+    assert _window("SELECT company_name FROM data_company_info") == (None, [])
@@ -0,0 +1,170 @@
+import datetime
+
+import pytest
+import sqlglot
+
+from app.models.rollup.definitions import build_definitions
+from app.models.rollup.rewriter import rewrite_for_rollup
+from app.models.rollup.store import RollupStore, _fold_dates
+from benchmarks.local_db import seed
+
+TODAY = datetime.date(2026, 3, 31)
+DIMENSION_TABLES = ["data_company_info", "data_prod_variant"]
+DEFINITIONS = build_definitions({
+    "daily_client_sales": {
+        "source": "data_so_summary AS s",
+        "dimensions": ["s.so_date", "s.client_id"],
+        "measures": ["s.total_cost", "s.price"],
+        "date_column": "s.so_date",
+        "key_column": "s.dsosu_id"
+    },
+    "daily_sku_sales": {
+        "source": "data_so_details AS d JOIN data_so_summary AS s ON d.so_id = s.dsosu_id",
+        "dimensions": ["s.so_date", "d.sku_id"],
+        "measures": ["d.quantity", "d.unit_price", "d.quantity * d.unit_price"],
+        "date_column": "s.so_date",
+        "key_column": "s.dsosu_id"
+    }
+})
+
+
+def _rewrite(sql, dimension_tables=DIMENSION_TABLES):
+    result = rewrite_for_rollup(sqlglot.parse_one(sql, read="mysql"), DEFINITIONS, dimension_tables)
+    return None if result is None else (result[0].name, result[1])
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    """
+    The seeded source tables and, in the same SQLite file, each rollup built from them
+    """
+    path = str(tmp_path_factory.mktemp("rollups") / "store.sqlite")
+    seed(path, scale=0.05, today=TODAY)
+    conn = RollupStore(path, DEFINITIONS, DIMENSION_TABLES, 300, 3, 3600, 900)._connect()
+    for rollup in DEFINITIONS:
+        select = sqlglot.parse_one(rollup.aggregate_sql("1 = 1"), read="mysql").sql(dialect="sqlite")
+        conn.execute(f"CREATE TABLE {rollup.table} AS {select}")
+    yield conn
+    conn.close()
+
+
+def _rows(conn, ast):
+    sql = _fold_dates(ast, TODAY).sql(dialect="sqlite")
+    return [tuple(round(v, 4) if isinstance(v, float) else v for v in row) for row in conn.execute(sql)]
+
+
+SAME_ANSWER = [
+    "SELECT SUM(total_cost) FROM data_so_summary",
+    "SELECT COUNT(*) AS orders, AVG(total_cost) AS aov FROM data_so_summary WHERE so_date >= '2026-01-01'",
+    "SELECT client_id, COUNT(total_cost), MIN(price), MAX(price) FROM data_so_summary "
+    "GROUP BY client_id ORDER BY client_id",
+    "SELECT client_id, COUNT(*) AS n FROM data_so_summary GROUP BY client_id "
+    "HAVING SUM(total_cost) > 100000 ORDER BY client_id",
+    "SELECT MONTH(so_date) AS month, SUM(total_cost) AS sales FROM data_so_summary "
+    "WHERE YEAR(so_date) = 2026 GROUP BY MONTH(so_date) ORDER BY month",
+    "SELECT DATE_FORMAT(so_date, '%Y-%m') AS period, SUM(total_cost) FROM data_so_summary "
+    "GROUP BY DATE_FORMAT(so_date, '%Y-%m') ORDER BY period",
+    "SELECT SUM(total_cost) FROM data_so_summary WHERE so_date >= DATE_SUB(CURDATE(), INTERVAL 1 MONTH)",
+    "SELECT COUNT(DISTINCT client_id), MAX(so_date) FROM data_so_summary WHERE so_date < CURDATE() - INTERVAL 7 DAY",
+    "SELECT c.city, SUM(s.total_cost) AS revenue FROM data_so_summary AS s "
+    "JOIN data_company_info AS c ON s.client_id = c.dci_id GROUP BY c.city ORDER BY c.city",
+    "SELECT c.city, COUNT(*) FROM data_so_summary AS s LEFT JOIN data_company_info AS c ON s.client_id = c.dci_id "
+    "GROUP BY c.city ORDER BY c.city",
+    "SELECT v.brand, SUM(d.quantity * d.unit_price) AS revenue, AVG(d.unit_price), COUNT(*) FROM data_so_details AS d "
+    "JOIN data_so_summary AS s ON d.so_id = s.dsosu_id JOIN data_prod_variant AS v ON d.sku_id = v.dprodv_id "
+    "GROUP BY v.brand ORDER BY v.brand",
+    "SELECT SUM(d.quantity) FROM data_so_summary AS s JOIN data_so_details AS d ON s.dsosu_id = d.so_id "
+    "WHERE s.so_date BETWEEN '2026-02-01' AND '2026-02-28'",
+]
+
+
+@pytest.mark.parametrize("sql", SAME_ANSWER)
+def test_rewritten_query_gives_the_same_answer(db, sql):
+    rewritten = _rewrite(sql)
+    assert rewritten is not None
+    expected = _rows(db, sqlglot.parse_one(sql, read="mysql"))
+    assert expected and _rows(db, rewritten[1]) == expected
+
+
+def test_aggregates_read_the_stored_partials():
+    name, ast = _rewrite(
+        "SELECT client_id, COUNT(*), AVG(total_cost) FROM data_so_summary GROUP BY client_id "
+        "HAVING SUM(price) > 10"
+    )
+    sql = ast.sql(dialect="mysql")
+    assert name == "daily_client_sales"
+    assert "FROM rollup_daily_client_sales" in sql
+    assert "COALESCE(SUM(data_so_summary.row_count), 0)" in sql
+    assert "SUM(data_so_summary.m0_sum) / SUM(data_so_summary.m0_count)" in sql
+    assert "HAVING SUM(data_so_summary.m1_sum) > 10" in sql
+
+
+def test_join_between_rollup_tables_is_dropped():
+    name, ast = _rewrite(
+        "SELECT s.so_date, SUM(d.quantity) FROM data_so_details AS d "
+        "JOIN data_so_summary AS s ON d.so_id = s.dsosu_id GROUP BY s.so_date"
+    )
+    sql = ast.sql(dialect="mysql")
+    assert name == "daily_sku_sales"
+    assert "JOIN" not in sql and "FROM rollup_daily_sku_sales AS d" in sql
+
+
+@pytest.mark.parametrize("sql", [
+    # Not an aggregate
+    "SELECT so_date, total_cost FROM data_so_summary",
+    # Filter, group or measure outside the rollup
+    "SELECT SUM(total_cost) FROM data_so_summary WHERE status = 'Completed'",
+    "SELECT status, COUNT(*) FROM data_so_summary GROUP BY status",
+    "SELECT SUM(total_cost * 2) FROM data_so_summary",
+    "SELECT SUM(DISTINCT total_cost) FROM data_so_summary",
+    # Shapes the rewriter does not handle
+    "SELECT * FROM data_so_summary GROUP BY client_id",
+    "SELECT SUM(total_cost) FROM (SELECT * FROM data_so_summary) AS t",
+    "SELECT client_id, SUM(total_cost) OVER () FROM data_so_summary",
+    "SELECT SUM(total_cost) FROM data_so_summary WHERE client_id IN (SELECT dci_id FROM data_company_info)",
+    # Join keys other than the rollup's own, or only part of its tables
+    "SELECT SUM(d.quantity) FROM data_so_details AS d JOIN data_so_summary AS s ON d.sku_id = s.dsosu_id",
+    "SELECT SUM(quantity) FROM data_so_details",
+    # The rollup on the NULL-extended side of an outer join
+    "SELECT c.city, COUNT(*) FROM data_company_info AS c LEFT JOIN data_so_summary AS s ON s.client_id = c.dci_id "
+    "GROUP BY c.city",
+    # Unqualified column with several tables
+    "SELECT SUM(total_cost) FROM data_so_summary AS s JOIN data_company_info AS c ON s.client_id = c.dci_id",
+    # A table that is neither a rollup source nor a copied dimension
+    "SELECT SUM(s.total_cost) FROM data_so_summary AS s JOIN other_table AS o ON s.client_id = o.id",
+    # Formats that do not translate exactly
+    "SELECT DATE_FORMAT(so_date, '%W') AS day, SUM(total_cost) FROM data_so_summary GROUP BY DATE_FORMAT(so_date, '%W')",
+])
+def test_rejected_shapes(sql):
+    assert _rewrite(sql) is None
+
+
+def test_dimension_join_needs_a_copied_table():
+    sql = (
+        "SELECT c.city, SUM(s.total_cost) FROM data_so_summary AS s "
+        "JOIN data_company_info AS c ON s.client_id = c.dci_id GROUP BY c.city"
+    )
+    assert _rewrite(sql) is not None
+    assert _rewrite(sql, dimension_tables=[]) is None
+
+
+@pytest.mark.parametrize("expression, folded", [
+    ("CURDATE()", "'2026-03-31'"),
+    ("DATE_SUB(CURDATE(), INTERVAL 1 MONTH)", "'2026-02-28'"),
+    ("CURDATE() - INTERVAL 7 DAY", "'2026-03-24'"),
+    ("DATE_ADD('2024-01-31', INTERVAL 1 MONTH)", "'2024-02-29'"),
+    ("DATE_SUB(CURDATE(), INTERVAL 1 YEAR)", "'2025-03-31'"),
+    ("CURDATE() + INTERVAL 1 QUARTER", "'2026-06-30'"),
+])
+def test_fold_dates(expression, folded):
+    ast = sqlglot.parse_one(f"SELECT {expression}", read="mysql")
+    assert _fold_dates(ast, TODAY).sql(dialect="sqlite") == f"SELECT {folded}"
+
+
+def test_folded_dates_filter_like_mysql(db):
+    ast = sqlglot.parse_one(
+        "SELECT COUNT(*) FROM data_so_summary WHERE so_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)", read="mysql"
+    )
+    since = (TODAY - datetime.timedelta(days=30)).isoformat()
+    expected = db.execute("SELECT COUNT(*) FROM data_so_summary WHERE so_date >= ?", (since,)).fetchone()[0]
+    assert expected > 0 and _rows(db, ast) == [(expected,)]
@@ -0,0 +1,31 @@
+import pytest
+
+from app.services.sql_cache import normalize_question
+
+
+@pytest.mark.parametrize("grouped, plain", [
+    ("sales over 100,000", "sales over 100000"),
+    ("sales over 1,234,567", "sales over 1234567"),
+    ("sales over 1,00,000", "sales over 100000"),
+    ("orders above 2,50,00,000", "orders above 25000000"),
+])
+def test_digit_grouping_is_folded(grouped, plain):
+    assert normalize_question(grouped) == normalize_question(plain)
+
+
+@pytest.mark.parametrize("listed, joined", [
+    ("orders with quantity 10,20 or 30", "orders with quantity 1020 or 30"),
+    ("values 1,2345", "values 12345"),
+    ("sku 5,100", "sku 5100"),
+    ("orders #1,000", "orders #1000"),
+])
+def test_lists_and_identifiers_keep_their_commas(listed, joined):
+    assert normalize_question(listed) != normalize_question(joined)
+
+
+def test_case_whitespace_punctuation_and_number_words():
+    assert normalize_question("  Top  five clients?! ") == "top 5 clients"
+
+
+def test_dates_are_rewritten_as_iso():
+    assert normalize_question("sales on 5/3/2026") == normalize_question("sales on 2026-03-05")